@@ -23,6 +23,15 @@
 
 #define DELIMITER "_"
 
+#define PROTOCOL_VERSION 1
+#define FRAME_START '#'
+#define FRAME_DELIMITER ':'
+#define MAX_LINE_LENGTH 128
+#define LEGACY_IDLE_MS 50
+#define MAX_QUEUE_SEGMENTS 64
+#define MAX_PROFILE_STAIRS 8
+#define MAX_RAMP_RATE 40000UL  // rates are squared in an unsigned long
+
 #define DebounceTimer 50
 
 typedef void (*intFunction)();
@@ -35,6 +44,21 @@ volatile unsigned int currentMillis = 0;
 
 Servo xRollServo, yRollServo;
 
+char lineBuffer[MAX_LINE_LENGTH];
+int lineLength = 0;
+unsigned long lastByteMillis = 0;
+bool lastMoveStopped = false;
+
+// steps is a long like the steps of single commands, an int wraps above 32767
+struct Segment {
+  byte direction;
+  long steps;
+  byte speed;
+};
+
+Segment motionQueue[MAX_QUEUE_SEGMENTS];
+int queueLength = 0;
+
 enum Direction { forward, backward, up, down, xRoll, yRoll };
 
 int getMotorDirPin(enum Direction direction) {
@@ -67,17 +91,27 @@ int getMotorStepValue(int direction) {
   return res;
 }
 
-void moveAxis(int direction, int revolutions, float speed) {
+// Step period in microseconds of a speed value.
+unsigned int stepInterval(float speed) {
+  return 2 * (unsigned int)(((MAX_SPEED - speed) / MAX_SPEED) * SPEED_FACTOR);
+}
+
+// Steps with a period of interval microseconds. Returns the number of steps
+// taken, lastMoveStopped tells whether a limit switch cut the move short.
+long moveAxis(int direction, long revolutions, unsigned int interval) {
   int motorDirPin = getMotorDirPin(direction);
   int stepPin = getMotorStepPin(direction);
   int stepPinValue = getMotorStepValue(direction);
-  float delay = ((MAX_SPEED - speed) / MAX_SPEED) * SPEED_FACTOR;
+  unsigned int delay = interval / 2;
 
   digitalWrite(motorDirPin, stepPinValue);
+  lastMoveStopped = false;
 
-  for (int i = 0; i < revolutions; i++) {
+  long i;
+  for (i = 0; i < revolutions; i++) {
     if (doesConflit(direction)) {
       Serial.println("stop!");
+      lastMoveStopped = true;
       break;
     }
     digitalWrite(stepPin, HIGH);
@@ -85,6 +119,7 @@ void moveAxis(int direction, int revolutions, float speed) {
     digitalWrite(stepPin, LOW);
     delayMicroseconds(delay);
   }
+  return i;
 }
 
 bool doesConflit(int direction) {
@@ -150,53 +185,346 @@ void setup() {
   // ZBackbuttonStateChanged);
 }
 
-void loop() {
-  if (Serial.available()) {                       // Check if there is data available to read
-    String receivedString = Serial.readString();  // Read the incoming string
-
-    // type
-    int startIndex = 0;
-    int endIndex = receivedString.indexOf(DELIMITER, startIndex);
-    String type = receivedString.substring(startIndex, endIndex);
-
-    // direction
-    startIndex = endIndex + 1;
-    endIndex = receivedString.indexOf(DELIMITER, startIndex);
-    String direction = receivedString.substring(startIndex, endIndex);
-
-    // steps
-    startIndex = endIndex + 1;
-    endIndex = receivedString.indexOf(DELIMITER, startIndex);
-    int steps = receivedString.substring(startIndex, endIndex).toInt();
-
-    // speed
-    startIndex = endIndex + 1;
-    endIndex = receivedString.indexOf(DELIMITER, startIndex);
-    int speed = receivedString.substring(startIndex, endIndex).toInt();
-
-    Serial.println(type);
-    Serial.println(direction);
-    Serial.println(steps);
-    Serial.println(speed);
-
-    if (direction == "up") {
-      // Serial.println("move 10 up"); // Print the received string
-      moveAxis(up, steps, speed);
-    } else if (direction == "down") {
-      // Serial.println("move 10 up"); // Print the received string
-      moveAxis(down, steps, speed);
-    } else if (direction == "forward") {
-      // Serial.println("move 10 up"); // Print the received string
-      moveAxis(forward, steps, speed);
-    } else if (direction == "backward") {
-      // Serial.println("move 10 up"); // Print the received string
-      moveAxis(backward, steps, speed);
-    } else if (direction == "xRoll") {
-      steps = constrain(steps, ZERO_X_ROLL - DELTA_X_ROLL, ZERO_X_ROLL + DELTA_X_ROLL);
-      xRollServo.write(steps);
-    } else if (direction == "yRoll") {
-      steps = constrain(steps, ZERO_Y_ROLL - DELTA_Y_ROLL, ZERO_Y_ROLL + DELTA_Y_ROLL);
-      yRollServo.write(steps);
+// Reads serial bytes without blocking. Returns true once a complete line is in
+// lineBuffer: framed commands end with a newline, legacy unframed commands end
+// when no byte arrived for LEGACY_IDLE_MS.
+bool readLine() {
+  while (Serial.available()) {
+    char c = Serial.read();
+    lastByteMillis = millis();
+    if (c == '\n' || c == '\r') {
+      if (lineLength > 0) {
+        lineBuffer[lineLength] = '\0';
+        return true;
+      }
+      continue;
+    }
+    if (lineLength < MAX_LINE_LENGTH - 1) {
+      lineBuffer[lineLength++] = c;
+    }
+  }
+
+  if (lineLength > 0 && lineBuffer[0] != FRAME_START &&
+      millis() - lastByteMillis >= LEGACY_IDLE_MS) {
+    lineBuffer[lineLength] = '\0';
+    return true;
+  }
+  return false;
+}
+
+// Splits a "<type>_<direction>_<steps>_<speed>[_<rest>]" command into its
+// fields.
+void splitCommand(String command, String &type, String &direction, long &steps, int &speed,
+                  String &rest) {
+  // type
+  int startIndex = 0;
+  int endIndex = command.indexOf(DELIMITER, startIndex);
+  type = command.substring(startIndex, endIndex);
+
+  // direction
+  startIndex = endIndex + 1;
+  endIndex = command.indexOf(DELIMITER, startIndex);
+  direction = command.substring(startIndex, endIndex);
+
+  // steps
+  startIndex = endIndex + 1;
+  endIndex = command.indexOf(DELIMITER, startIndex);
+  steps = command.substring(startIndex, endIndex).toInt();
+
+  // speed
+  startIndex = endIndex + 1;
+  endIndex = command.indexOf(DELIMITER, startIndex);
+  speed = command.substring(startIndex, endIndex).toInt();
+
+  // rest
+  rest = endIndex < 0 ? "" : command.substring(endIndex + 1);
+}
+
+int parseDirection(String direction) {
+  if (direction == "up") return up;
+  if (direction == "down") return down;
+  if (direction == "forward") return forward;
+  if (direction == "backward") return backward;
+  if (direction == "xRoll") return xRoll;
+  if (direction == "yRoll") return yRoll;
+  return -1;
+}
+
+// Moves an axis or a roll servo. Returns the number of steps taken.
+long runSegment(int direction, long steps, int speed) {
+  lastMoveStopped = false;
+  if (direction == xRoll) {
+    steps = constrain(steps, ZERO_X_ROLL - DELTA_X_ROLL, ZERO_X_ROLL + DELTA_X_ROLL);
+    xRollServo.write(steps);
+    return 0;
+  }
+  if (direction == yRoll) {
+    steps = constrain(steps, ZERO_Y_ROLL - DELTA_Y_ROLL, ZERO_Y_ROLL + DELTA_Y_ROLL);
+    yRollServo.write(steps);
+    return 0;
+  }
+  return moveAxis(direction, steps, stepInterval(speed));
+}
+
+// Step period in microseconds of a rate in steps per second, rounded to an
+// even number of microseconds like the host's planner.
+unsigned int rateInterval(unsigned long rate) { return 2 * ((500000UL + rate / 2) / rate); }
+
+// Parses a "<start interval>.<stairs>.<acceleration>" ramp. A malformed ramp
+// has no stairs.
+void parseRamp(String ramp, unsigned int &startInterval, int &stairCount,
+               unsigned long &acceleration) {
+  int firstDot = ramp.indexOf('.');
+  int secondDot = ramp.indexOf('.', firstDot + 1);
+  if (firstDot < 0 || secondDot < 0) {
+    startInterval = 0;
+    stairCount = 0;
+    acceleration = 0;
+    return;
+  }
+  startInterval = ramp.substring(0, firstDot).toInt();
+  stairCount = constrain(ramp.substring(firstDot + 1, secondDot).toInt(), 0, MAX_PROFILE_STAIRS);
+  acceleration = ramp.substring(secondDot + 1).toInt();
+}
+
+// Builds the acceleration stairs of a move of maxSteps steps from a ramp.
+// The rate rises linearly from the start rate to the cruise rate in
+// stairCount stairs, each one run at the rate it starts from for as many
+// steps as the acceleration takes to reach the next. Stairs that do not fit
+// in half of the move are left out and the move cruises at the rate the last
+// stair reached instead. Returns the number of stairs.
+int buildRamp(String ramp, long maxSteps, unsigned int &cruiseInterval, long counts[],
+              unsigned int intervals[]) {
+  unsigned int startInterval;
+  int stairCount;
+  unsigned long acceleration;
+  parseRamp(ramp, startInterval, stairCount, acceleration);
+  if (stairCount <= 0 || startInterval == 0 || cruiseInterval == 0 || acceleration == 0) return 0;
+
+  unsigned long startRate = 1000000UL / startInterval;
+  unsigned long cruiseRate = min(1000000UL / cruiseInterval, MAX_RAMP_RATE);
+  if (cruiseRate <= startRate) return 0;
+
+  long rampSteps = 0;
+  unsigned long low = startRate;
+  for (int i = 0; i < stairCount; i++) {
+    unsigned long high = startRate + (cruiseRate - startRate) * (i + 1) / stairCount;
+    long count = (high - low) * (high + low) / (2 * acceleration);
+    if (count == 0 || 2 * (rampSteps + count) > maxSteps) {
+      cruiseInterval = rateInterval(low);
+      return i;
+    }
+    counts[i] = count;
+    intervals[i] = rateInterval(low);
+    rampSteps += count;
+    low = high;
+  }
+  return stairCount;
+}
+
+// Runs a move of steps steps at cruiseInterval microseconds, accelerating
+// and decelerating along the stairs of the ramp if there is one.
+long runProfile(int direction, long steps, unsigned int cruiseInterval, String ramp) {
+  long counts[MAX_PROFILE_STAIRS];
+  unsigned int intervals[MAX_PROFILE_STAIRS];
+  int stairCount = buildRamp(ramp, steps, cruiseInterval, counts, intervals);
+
+  long cruiseSteps = steps;
+  for (int i = 0; i < stairCount; i++) cruiseSteps -= 2 * counts[i];
+
+  long taken = 0;
+  for (int i = 0; i < stairCount; i++) {
+    taken += moveAxis(direction, counts[i], intervals[i]);
+    if (lastMoveStopped) return taken;
+  }
+  taken += moveAxis(direction, cruiseSteps, cruiseInterval);
+  if (lastMoveStopped) return taken;
+  for (int i = stairCount - 1; i >= 0; i--) {
+    taken += moveAxis(direction, counts[i], intervals[i]);
+    if (lastMoveStopped) return taken;
+  }
+  return taken;
+}
+
+// Steps Y and Z together along a straight line, dy up and dz forward. The
+// axis with more steps is paced by the profile, steps of the other one are
+// interleaved with Bresenham's algorithm. Returns the number of steps taken
+// by the major axis.
+long moveLine(long dy, long dz, unsigned int cruiseInterval, String ramp) {
+  int yDirection = dy >= 0 ? up : down;
+  int zDirection = dz >= 0 ? forward : backward;
+  long ySteps = labs(dy);
+  long zSteps = labs(dz);
+  bool yMajor = ySteps >= zSteps;
+  long major = yMajor ? ySteps : zSteps;
+  long minor = yMajor ? zSteps : ySteps;
+  int majorPin = yMajor ? Y_STEP_PIN : Z_STEP_PIN;
+  int minorPin = yMajor ? Z_STEP_PIN : Y_STEP_PIN;
+
+  long counts[MAX_PROFILE_STAIRS];
+  unsigned int intervals[MAX_PROFILE_STAIRS];
+  int stairCount = buildRamp(ramp, major, cruiseInterval, counts, intervals);
+
+  long rampSteps = 0;
+  for (int i = 0; i < stairCount; i++) rampSteps += counts[i];
+  long cruiseSteps = max(major - 2 * rampSteps, 0L);
+
+  digitalWrite(Y_DIR_PIN, getMotorStepValue(yDirection));
+  digitalWrite(Z_DIR_PIN, getMotorStepValue(zDirection));
+  lastMoveStopped = false;
+
+  long error = major / 2;
+  long taken = 0;
+  for (int segment = 0; segment < 2 * stairCount + 1; segment++) {
+    long count = cruiseSteps;
+    unsigned int interval = cruiseInterval;
+    if (segment != stairCount) {
+      int stair = segment < stairCount ? segment : 2 * stairCount - segment;
+      count = counts[stair];
+      interval = intervals[stair];
+    }
+
+    unsigned int delay = interval / 2;
+    for (long i = 0; i < count; i++) {
+      if ((ySteps > 0 && doesConflit(yDirection)) || (zSteps > 0 && doesConflit(zDirection))) {
+        Serial.println("stop!");
+        lastMoveStopped = true;
+        return taken;
+      }
+      error -= minor;
+      bool minorStep = error < 0;
+      if (minorStep) error += major;
+
+      digitalWrite(majorPin, HIGH);
+      if (minorStep) digitalWrite(minorPin, HIGH);
+      delayMicroseconds(delay);
+      digitalWrite(majorPin, LOW);
+      digitalWrite(minorPin, LOW);
+      delayMicroseconds(delay);
+      taken++;
+    }
+  }
+  return taken;
+}
+
+// Returns the number of steps taken by the command.
+long executeCommand(String command) {
+  String type, direction, rest;
+  long steps;
+  int speed;
+  splitCommand(command, type, direction, steps, speed, rest);
+
+  lastMoveStopped = false;
+  if (type == "line") {
+    // "line_<dy>_<dz>_<cruise interval>[_<ramp>]"
+    return moveLine(direction.toInt(), steps, speed, rest);
+  }
+
+  int dir = parseDirection(direction);
+  if (dir < 0) return 0;
+  if (type == "profile") {
+    if (dir == xRoll || dir == yRoll) return 0;
+    return runProfile(dir, steps, speed, rest);
+  }
+  return runSegment(dir, steps, speed);
+}
+
+void printReply(const char *status, long id, long value) {
+  Serial.print(status);
+  Serial.print(id);
+  Serial.print(":");
+  Serial.println(value);
+}
+
+// "queue_<direction>_<steps>_<speed>" appends a segment to the motion queue
+// without a reply, so a whole program can be uploaded in one burst.
+// "queue_run_<count>_0" executes the <count> queued segments back to back,
+// reporting "seg:<id>:<index>:<steps>" after each of them.
+void handleQueueCommand(long id, String direction, long steps, int speed) {
+  if (direction == "run") {
+    if (steps != queueLength) {
+      Serial.print("err:");
+      Serial.println(id);
+      queueLength = 0;
+      return;
+    }
+
+    Serial.print("ack:");
+    Serial.println(id);
+    long total = 0;
+    lastMoveStopped = false;
+    for (int i = 0; i < queueLength && !lastMoveStopped; i++) {
+      long taken = runSegment(motionQueue[i].direction, motionQueue[i].steps, motionQueue[i].speed);
+      total += taken;
+      Serial.print("seg:");
+      Serial.print(id);
+      Serial.print(":");
+      Serial.print(i);
+      Serial.print(":");
+      Serial.println(taken);
     }
+    queueLength = 0;
+    printReply(lastMoveStopped ? "stop:" : "done:", id, total);
+    return;
+  }
+
+  int dir = parseDirection(direction);
+  if (dir < 0 || queueLength == MAX_QUEUE_SEGMENTS) {
+    Serial.print("err:");
+    Serial.println(id);
+    return;
+  }
+  motionQueue[queueLength].direction = dir;
+  motionQueue[queueLength].steps = steps;
+  motionQueue[queueLength].speed = speed;
+  queueLength++;
+}
+
+// Frames look like "#<version>:<id>:<command>". The id is acknowledged with
+// "ack:<id>" as soon as the frame is parsed, or rejected with "err:<id>". Once
+// the command finished "done:<id>:<steps>" is sent, or "stop:<id>:<steps>" if
+// a limit switch stopped it.
+void handleLine(String line) {
+  if (line.charAt(0) != FRAME_START) {
+    executeCommand(line);
+    return;
+  }
+
+  int versionEnd = line.indexOf(FRAME_DELIMITER);
+  int idEnd = line.indexOf(FRAME_DELIMITER, versionEnd + 1);
+  if (versionEnd < 0 || idEnd < 0) {
+    Serial.println("err:-1");
+    return;
+  }
+
+  int version = line.substring(1, versionEnd).toInt();
+  long id = line.substring(versionEnd + 1, idEnd).toInt();
+  if (version != PROTOCOL_VERSION) {
+    Serial.print("err:");
+    Serial.println(id);
+    return;
+  }
+
+  String command = line.substring(idEnd + 1);
+  String type, direction, rest;
+  long steps;
+  int speed;
+  splitCommand(command, type, direction, steps, speed, rest);
+  if (type == "queue") {
+    handleQueueCommand(id, direction, steps, speed);
+    return;
+  }
+
+  Serial.print("ack:");
+  Serial.println(id);
+  long taken = executeCommand(command);
+  printReply(lastMoveStopped ? "stop:" : "done:", id, taken);
+}
+
+void loop() {
+  if (readLine()) {
+    String line = String(lineBuffer);
+    lineLength = 0;
+    handleLine(line);
   }
 }
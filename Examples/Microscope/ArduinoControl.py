@@ -1,154 +1,284 @@
+"""Serial control of the focal sweep controller, ``FocalSweep4.ino``.
+
+Commands are two letters and an optional value, e.g. ``pe20000``. Once the
+controller applied a command it prints ``ok:<command>``, after the lines
+reporting the new values. A reader thread parses the controller's lines into
+:class:`Reply` objects, so each command returns as soon as it is acknowledged
+instead of sleeping for a fixed time.
+"""
+
 from __future__ import division
 
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Dict, List, Union
 
 import serial  # conda install pyserial
 
+ACK_PREFIX = "ok:"
+READY_MESSAGE = "Waiting for order"
+READ_TIMEOUT = 0.1  # seconds, bounds how long close waits for the reader
+STARTUP_QUIET = 0.2  # seconds without output ending the start report
+MAX_UNSOLICITED_LINES = 1000
+
+
+def _parse_value(text):
+    """Number printed after ``Name:``, or the stripped text."""
+    text = text.strip()
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    return text
+
+
+@dataclass
+class Reply:
+    """Answer of the controller to one command.
+
+    Args:
+        command (str): Command sent, without the line ending.
+        lines (List[str]): Lines printed while the command was applied.
+        values (Dict[str, Union[int, float, str]]): Values of the
+            ``Name: value`` lines, e.g. ``{"Exposure": 20000}``.
+        acknowledged (bool): False if the timeout expired before the
+            controller acknowledged the command.
+    """
+
+    command: str
+    lines: List[str] = field(default_factory=list)
+    values: Dict[str, Union[int, float, str]] = field(default_factory=dict)
+    acknowledged: bool = False
+
 
 class ArduinoControl(object):
-    def __init__(self, timeout=20):  #
-        # def __init__(self, com = '/dev/ttyACM0',  timeout = 20):
+    """Connection to the focal sweep controller.
+
+    Commands are sent one at a time. Each one blocks until the controller
+    acknowledged it or its timeout expired, whichever comes first.
+
+    Args:
+        port (str): Serial port of the controller. Defaults to ``COM3``.
+        baudrate (int): Defaults to 9600, like the firmware.
+        timeout (float): Seconds to wait for the reply to a command.
+            Defaults to 1.
+        connect_timeout (float): Seconds to wait for the start message of a
+            controller that resets on connection. Defaults to 1.
+        report_timeout (float): Seconds to wait for the report of the focal
+            steps following the start message. Defaults to 3.
+        verbose (bool): Print the lines the controller sends. Defaults to
+            True.
+    """
+
+    def __init__(
+        self,
+        port="COM3",
+        baudrate=9600,
+        timeout=1.0,
+        connect_timeout=1.0,
+        report_timeout=3.0,
+        verbose=True,
+    ):
         print("Connecting to arduino...")
-        # self.ser = serial.Serial(com, 9600, timeout=timeout)
-        self.ser = serial.Serial("COM3", 9600, timeout=timeout)
-        time.sleep(1)
-        print(self.ser.read_all())
-        # self.ser.reset_output_buffer()
+        self.timeout = timeout
+        self.verbose = verbose
+        self.ser = serial.Serial(port, baudrate, timeout=READ_TIMEOUT)
+
+        self._send_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._pending = None  # (Reply, Future) of the command in flight
+        self._error = None  # error that stopped the reader
+        self._unsolicited = deque(maxlen=MAX_UNSOLICITED_LINES)
+        self._ready = threading.Event()
+        self._quiet = threading.Event()
+        self._running = True
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+
+        # boards resetting on connection drop what is sent before they start,
+        # boards with native USB keep running and print nothing. The start
+        # message is followed by a report, which must not be taken for the
+        # reply to the first command.
+        if self._ready.wait(connect_timeout):
+            self._quiet.wait(report_timeout)
 
     def close(self):
+        self._running = False
+        self._reader.join()
         self.ser.close()
         print("Closing serial port")
 
     def writeCmd(self, cmd):
         self.ser.write(cmd.encode())
 
+    def request(self, cmd, timeout=None):
+        """Send a command and wait for its reply.
+
+        Args:
+            cmd (str): Command without the line ending, e.g. ``pe20000``.
+            timeout (Optional[float]): Seconds to wait for the reply.
+                Defaults to the connection's timeout.
+
+        Raises:
+            serial.SerialException: If the connection failed, now or before.
+
+        Returns:
+            Reply: The reply, not acknowledged if the timeout expired.
+        """
+        reply = Reply(cmd)
+        future = Future()
+        with self._send_lock:
+            with self._state_lock:
+                if self._error is not None:
+                    raise self._error
+                self._pending = (reply, future)
+            try:
+                self.writeCmd(cmd + "\n")
+                future.result(self.timeout if timeout is None else timeout)
+            except FutureTimeoutError:
+                pass
+            finally:
+                with self._state_lock:
+                    self._pending = None
+        return reply
+
+    def _read_replies(self):
+        """Collect the controller's lines into the reply of the command.
+
+        Reads time out in the middle of lines, so bytes are kept until the
+        line ending. An error of the connection is recorded for `request` to
+        raise, and fails the command in flight.
+        """
+        self.ser.timeout = STARTUP_QUIET
+        buffer = b""
+        while self._running:
+            try:
+                data = self.ser.readline()
+            except (serial.SerialException, OSError) as error:
+                if self._running:
+                    self._fail(error)
+                return
+            if not data and self._ready.is_set() and not self._quiet.is_set():
+                self._quiet.set()
+                self.ser.timeout = READ_TIMEOUT
+            buffer += data
+            if not buffer.endswith(b"\n"):
+                continue
+            line = buffer.decode(errors="replace").strip()
+            buffer = b""
+            if not line:
+                continue
+            if self.verbose:
+                print(line)
+            if READY_MESSAGE in line:
+                self._ready.set()
+
+            with self._state_lock:
+                if self._pending is None:
+                    self._unsolicited.append(line)
+                    continue
+                reply, future = self._pending
+                if line == ACK_PREFIX + reply.command:
+                    reply.acknowledged = True
+                    self._pending = None
+                    future.set_result(reply)
+                    continue
+
+                reply.lines.append(line)
+                name, separator, value = line.partition(":")
+                if separator and value.strip():
+                    reply.values[name.strip()] = _parse_value(value)
+
+    def _fail(self, error):
+        with self._state_lock:
+            if not isinstance(error, serial.SerialException):
+                error = serial.SerialException(str(error))
+            self._error = error
+            if self._pending is not None:
+                self._pending[1].set_exception(error)
+                self._pending = None
+
     def printAll(self):
-        print(self.ser.read_all())
+        """Print the lines received outside of any command."""
+        with self._state_lock:
+            lines = list(self._unsolicited)
+            self._unsolicited.clear()
+        for line in lines:
+            print(line)
 
     def startLiveView(self):
-        cmd = "cl\n"
-        self.writeCmd(cmd)
-        time.sleep(0.1)
-        print(self.ser.read_all())
+        return self.request("cl")
 
     def stopLiveView(self):
-        cmd = "cb\n"
-        self.writeCmd(cmd)
-        time.sleep(0.1)
-        print(self.ser.read_all())
+        return self.request("cb")
 
     def startFocalStack(self):
-        cmd = "cf\n"
-        self.writeCmd(cmd)
-        time.sleep(0.001)
-        print(self.ser.read_all())
+        return self.request("cf")
 
     def startLimitedFocalStack(self):
-        cmd = "ca\n"
-        self.writeCmd(cmd)
-        time.sleep(0.1)
-        print(self.ser.read_all())
+        return self.request("ca")
 
     def startOneShot(self):
-        cmd = "cs\n"
-        self.writeCmd(cmd)
-        time.sleep(0.001)
-        print(self.ser.read_all())
+        return self.request("cs")
 
     def startLimitedOneShot(self):
-        cmd = "co\n"
-        self.writeCmd(cmd)
-        time.sleep(0.1)
-        print(self.ser.read_all())
+        return self.request("co")
 
     def startCaptureSingle(self):
-        cmd = "cm\n"
-        self.writeCmd(cmd)
-        time.sleep(0.1)
-        print(self.ser.read_all())
+        return self.request("cm")
 
     def setNSteps(self, x):
-        cmd = "os" + str(x) + "\n"
-        # self.writeCmd(str.encode(cmd))
-        self.writeCmd(cmd)
-        time.sleep(0.1)
-        print(self.ser.read_all())
+        return self.request("os" + str(x))
 
     def setExposure(self, x):
-        cmd = "pe" + str(x) + "\n"
-        self.writeCmd(cmd)
-        time.sleep(0.1)
-        print(self.ser.read_all())
+        return self.request("pe" + str(x))
 
     def LightsOn(self):
-        cmd = "le1" + "\n"
-        self.writeCmd(cmd)
-        time.sleep(0.1)
-        print(self.ser.read_all())
+        return self.request("le1")
 
     def LightsOff(self):
-        cmd = "le0" + "\n"
-        self.writeCmd(cmd)
-        time.sleep(0.1)
-        print(self.ser.read_all())
+        return self.request("le0")
 
     def LightExposure(self, x):
-        cmd = "le" + str(x) + "\n"
-        self.writeCmd(cmd)
-        time.sleep(0.1)
-        print(self.ser.read())
+        return self.request("le" + str(x))
 
     def setMaxCurrent(self, x):
-        cmd = "pc" + str(x) + "\n"
-        self.writeCmd(cmd)
-        time.sleep(1)
-        print(self.ser.read_all())
+        return self.request("pc" + str(x))
 
     def setUseLED(self, x):
-        cmd = "pl" + str(x) + "\n"
-        self.writeCmd(cmd)
-        time.sleep(1)
-        print(self.ser.read_all())
+        return self.request("pl" + str(x))
 
     def setExposureProj(self, x):
-        cmd = "pp" + str(x) + "\n"
-        self.writeCmd(cmd)
-        time.sleep(1)
-        print(self.ser.read_all())
+        return self.request("pp" + str(x))
 
     def setStep(self, x):
-        cmd = "oc" + str(x) + "\n"
-        self.writeCmd(cmd)
+        return self.request("oc" + str(x))
 
     def stepForward(self):
-        cmd = "of\n"
-        self.writeCmd(cmd)
+        return self.request("of")
 
     def stepBackward(self):
-        cmd = "ob\n"
-        self.writeCmd(cmd)
+        return self.request("ob")
 
     def upperOptoLimit(self, x):
-        cmd = "ou" + str(x) + "\n"
-        self.writeCmd(cmd)
+        return self.request("ou" + str(x))
 
     def lowerOptoLimit(self, x):
-        cmd = "ol" + str(x) + "\n"
-        self.writeCmd(cmd)
+        return self.request("ol" + str(x))
 
     def advanceProjector(self):
-        cmd = "dp\n"
-        self.writeCmd(cmd)
+        return self.request("dp")
 
     def advanceCamera(self):
-        cmd = "cr\n"
-        self.writeCmd(cmd)
+        return self.request("cr")
 
     def reportValues(self):
-        cmd = "R\n"
-        self.writeCmd(cmd)
-        time.sleep(0.2)
-        self.printAll()
+        return self.request("R")
 
 
 if __name__ == "__main__":
@@ -158,6 +288,5 @@ if __name__ == "__main__":
     ard.stopLiveView()
     ard.stepForward()
     ard.reportValues()
-    time.sleep(2)
     ard.printAll()
     ard.close()
@@ -0,0 +1,70 @@
+"""Worker thread owning a device, for calls made from the Qt GUI thread.
+
+Serial commands block until the device answers. Run from a button handler,
+they freeze the window and the image repaint. :class:`DeviceExecutor` runs
+them one at a time on its own thread instead, returns a future for each one
+and reports the results through Qt signals, which Qt delivers on the thread
+of the connected widget.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class DeviceExecutor(QObject):
+    """Runs device calls in submission order on a single worker thread.
+
+    Args:
+        parent (Optional[QObject]): Qt parent of the executor.
+    """
+
+    # name of the call and its return value or exception
+    finished = pyqtSignal(str, object)
+    failed = pyqtSignal(str, object)
+
+    def __init__(self, parent=None):
+        super(DeviceExecutor, self).__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="device")
+
+    def submit(self, name, fn, *args, **kwargs):
+        """Queue a call without waiting for it.
+
+        Args:
+            name (str): Name reported with the result, e.g. ``"setExposure"``.
+            fn (Callable): Device method to call.
+            *args: Positional arguments of ``fn``.
+            **kwargs: Keyword arguments of ``fn``.
+
+        Returns:
+            Future: Resolves to the return value of ``fn``.
+        """
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(partial(self._report, name))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """Queue a call named after ``fn``, see :meth:`submit`."""
+        return self.submit(fn.__name__, fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """Stop the worker thread.
+
+        Args:
+            wait (bool): Wait for the running call, and the queued ones
+                unless they are cancelled. Defaults to True.
+            cancel_pending (bool): Drop the calls that did not start yet.
+                Defaults to False.
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_pending)
+
+    def _report(self, name, future):
+        """Emit the outcome of a call, from the worker thread."""
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self.finished.emit(name, future.result())
+        else:
+            self.failed.emit(name, error)
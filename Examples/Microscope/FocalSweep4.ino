@@ -88,6 +88,8 @@ int setting = 0;
 int mode = 0;
 long value = 0;
 boolean state = 0;
+String ackCommand;  // last command read, acknowledged once applied
+boolean ackPending = 0;
 // Controlling Loops
 boolean firstLoop = 1;
 
@@ -146,6 +148,12 @@ void loop() {
     setParameters();
     setting = 'q';
   }
+  // Acknowledge settings once applied and captures before they start
+  if (ackPending) {
+    Serial.print("ok:");
+    Serial.println(ackCommand);
+    ackPending = 0;
+  }
   // Imaging
   if (setting == 'C' || setting == 'c')  // Capture
   {
@@ -204,6 +212,9 @@ void readInput() {
     state = 1;
   } else
     state = 2;
+  ackCommand = command;
+  ackCommand.trim();
+  ackPending = 1;
   command = "";
   Serial.flush();
 }
@@ -1,11 +1,19 @@
 from pyueye import ueye
-from Utils import ImageBuffer, Rect, check, get_bits_per_pixel, uEyeException
+from Utils import (
+    ImageBuffer,
+    MemoryInfo,
+    Rect,
+    check,
+    get_bits_per_pixel,
+    uEyeException,
+)
 
 
 class Camera:
     def __init__(self, device_id=0):
         self.h_cam = ueye.HIDS(device_id)
         self.img_buffers = []
+        self.mem_infos = {}  # MemoryInfo of each buffer, by mem_id
 
     def __enter__(self):
         self.init()
@@ -23,6 +31,8 @@ class Camera:
 
         for buff in self.img_buffers:
             check(ueye.is_FreeImageMem(self.h_cam, buff.mem_ptr, buff.mem_id))
+        self.img_buffers = []
+        self.mem_infos = {}
 
         for i in range(buffer_count):
             buff = ImageBuffer()
@@ -33,9 +43,22 @@ class Camera:
             check(ueye.is_AddToSequence(self.h_cam, buff.mem_ptr, buff.mem_id))
 
             self.img_buffers.append(buff)
+            self.mem_infos[buff.mem_id.value] = MemoryInfo(self.h_cam, buff)
 
         ueye.is_InitImageQueue(self.h_cam, 0)
 
+    def memory_info(self, img_buff):
+        """Cached :class:`MemoryInfo` of the buffer holding a frame.
+
+        Queried from the driver only for buffers not allocated by
+        :meth:`alloc`, or after the AOI or colour mode changed.
+        """
+        info = self.mem_infos.get(img_buff.mem_id.value)
+        if info is None:
+            info = MemoryInfo(self.h_cam, img_buff)
+            self.mem_infos[img_buff.mem_id.value] = info
+        return info
+
     def init(self):
         ret = ueye.is_InitCamera(self.h_cam, None)
         if ret != ueye.IS_SUCCESS:
@@ -71,6 +94,7 @@ class Camera:
         rect_aoi.s32Width = ueye.int(width)
         rect_aoi.s32Height = ueye.int(height)
 
+        self.mem_infos = {}
         return ueye.is_AOI(
             self.h_cam, ueye.IS_AOI_IMAGE_SET_AOI, rect_aoi, ueye.sizeof(rect_aoi)
         )
@@ -87,6 +111,7 @@ class Camera:
         return ueye.is_FreezeVideo(self.h_cam, wait_param)
 
     def set_colormode(self, colormode):
+        self.mem_infos = {}
         check(ueye.is_SetColorMode(self.h_cam, colormode))
 
     def get_colormode(self):
@@ -0,0 +1,260 @@
+"""Background saving of camera frames.
+
+Writing a frame to disk from the camera callback holds the camera's buffer
+for as long as the disk takes, and the camera drops frames meanwhile.
+:class:`StackWriter` only copies the frame into a leased buffer and returns,
+a pool of writer threads saves it, to a raw file or into a stack container.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from queue import Full, Queue
+
+import numpy as np
+
+from Scanner3D.storage.container import StackFileWriter
+
+LATENCY_SAMPLES = 1024  # recent writes the latency percentiles cover
+
+
+@dataclass
+class WriterStats:
+    """Counters of a :class:`StackWriter`.
+
+    Args:
+        queued (int): Frames waiting to be written.
+        high_water (int): Most frames ever waiting at once.
+        written (int): Frames written.
+        dropped (int): Frames discarded because the queue stayed full.
+        errors (int): Frames that failed to be written.
+        bytes_written (int): Bytes written.
+        bytes_per_second (float): Bytes written per second, from the first
+            submitted frame to the last written one.
+        latency_p50 (float): Median seconds from submit to closed file.
+        latency_p95 (float): 95th percentile of the latency.
+        latency_p99 (float): 99th percentile of the latency.
+    """
+
+    queued: int = 0
+    high_water: int = 0
+    written: int = 0
+    dropped: int = 0
+    errors: int = 0
+    bytes_written: int = 0
+    bytes_per_second: float = 0.0
+    latency_p50: float = 0.0
+    latency_p95: float = 0.0
+    latency_p99: float = 0.0
+
+
+class StackWriter(object):
+    """Writes frames to files on a pool of threads.
+
+    Frames are copied into buffers reused once written, so saving a stack
+    allocates at most ``max_queued + workers`` frames. When ``max_queued``
+    frames are waiting, ``submit`` waits up to ``block_timeout`` seconds for
+    the writers, then drops the frame.
+
+    Args:
+        workers (int): Writer threads. Defaults to 2.
+        max_queued (int): Frames waiting to be written at most. Defaults to
+            16.
+        block_timeout (Optional[float]): Seconds ``submit`` waits for a free
+            place in the queue. Defaults to 1.
+        on_error (Optional[Callable[[object, Exception], None]]): Called on a
+            writer thread with the target and the error of every frame that
+            failed to be written, besides counting it in ``errors``.
+    """
+
+    def __init__(self, workers=2, max_queued=16, block_timeout=1.0, on_error=None):
+        if workers < 1 or max_queued < 1:
+            raise ValueError("workers and max_queued must be positive")
+
+        self._block_timeout = block_timeout
+        self._on_error = on_error
+        self._jobs = Queue(maxsize=max_queued)
+        self._free = []  # buffers of written frames, for reuse
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0  # submitted and not written yet
+        self._flushes = []  # futures of flush_async, resolved once idle
+        self._stats = WriterStats()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._first_submit = None
+        self._last_write = None
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, target, frame, info=None):
+        """Queue a copy of ``frame`` to be written.
+
+        A record of a container is reserved right away, so frames keep their
+        submission order even though several threads write them. The record
+        of a dropped frame stays empty.
+
+        Args:
+            target (Union[str, StackFileWriter]): Path of the raw file to
+                write, or container to append the frame to.
+            frame (np.ndarray): Frame to write.
+            info (Optional[FrameInfo]): Metadata of the frame in a container.
+
+        Returns:
+            bool: False if the frame was dropped.
+        """
+        record = None
+        if isinstance(target, StackFileWriter):
+            try:
+                record = target.reserve()
+            except ValueError:  # the container was closed meanwhile
+                with self._lock:
+                    self._stats.dropped += 1
+                return False
+        buffer = self._lease(frame)
+        np.copyto(buffer, frame)
+        with self._lock:
+            now = time.monotonic()
+            if self._first_submit is None:
+                self._first_submit = now
+            self._in_flight += 1
+        try:
+            self._jobs.put(
+                (target, record, info, buffer, now), timeout=self._block_timeout
+            )
+        except Full:
+            with self._lock:
+                self._in_flight -= 1
+                self._stats.dropped += 1
+                self._free.append(buffer)
+                flushes = self._settle()
+            self._resolve(flushes)
+            return False
+
+        with self._lock:
+            self._stats.high_water = max(self._stats.high_water, self._jobs.qsize())
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until every submitted frame was written.
+
+        Returns:
+            bool: False on timeout.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._in_flight == 0, timeout)
+
+    def flush_async(self):
+        """Flush without waiting.
+
+        Returns:
+            Future: Resolves to the :class:`WriterStats` once every frame
+            submitted so far was written, on the thread that wrote the last
+            one.
+        """
+        future = Future()
+        with self._lock:
+            self._flushes.append(future)
+            flushes = self._settle()
+        self._resolve(flushes)
+        return future
+
+    def stats(self):
+        """Snapshot of the writer counters."""
+        with self._lock:
+            stats = WriterStats(**vars(self._stats))
+            latencies = list(self._latencies)
+            if self._last_write is not None:
+                elapsed = self._last_write - self._first_submit
+                stats.bytes_per_second = stats.bytes_written / max(elapsed, 1e-9)
+        stats.queued = self._jobs.qsize()
+        if latencies:
+            stats.latency_p50, stats.latency_p95, stats.latency_p99 = (
+                float(latency) for latency in np.percentile(latencies, (50, 95, 99))
+            )
+        return stats
+
+    def close(self, flush=True):
+        """Stop the writers, after writing the queued frames if ``flush``."""
+        if flush:
+            self.flush()
+        else:
+            while not self._jobs.empty():
+                self._jobs.get_nowait()
+                with self._lock:
+                    self._in_flight -= 1
+                    flushes = self._settle()
+                self._resolve(flushes)
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _settle(self):
+        """Wake flushes if every frame was written, called holding the lock.
+
+        Returns:
+            List[Future]: Futures of ``flush_async`` to resolve once the lock
+            is released.
+        """
+        if self._in_flight:
+            return []
+
+        self._idle.notify_all()
+        flushes, self._flushes = self._flushes, []
+        return flushes
+
+    def _resolve(self, flushes):
+        """Resolve the futures of flushes with the writer counters."""
+        if flushes:
+            stats = self.stats()
+            for future in flushes:
+                future.set_result(stats)
+
+    def _lease(self, frame):
+        """Free buffer with the shape and dtype of ``frame``."""
+        with self._lock:
+            for i, buffer in enumerate(self._free):
+                if buffer.shape == frame.shape and buffer.dtype == frame.dtype:
+                    return self._free.pop(i)
+        return np.empty_like(frame)
+
+    def _run(self):
+        """Write queued frames until given None."""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            target, record, info, buffer, submitted = job
+            try:
+                if record is None:
+                    with open(target, "wb") as file:
+                        buffer.tofile(file)
+                else:
+                    target.write(record, buffer, info)
+            except (OSError, ValueError) as e:
+                # ValueError: frame of another shape, or container closed
+                failed = True
+                if self._on_error is not None:
+                    self._on_error(target, e)
+            else:
+                failed = False
+
+            with self._lock:
+                now = time.monotonic()
+                if failed:
+                    self._stats.errors += 1
+                else:
+                    self._stats.written += 1
+                    self._stats.bytes_written += buffer.nbytes
+                    self._latencies.append(now - submitted)
+                    self._last_write = now
+                self._free.append(buffer)
+                self._in_flight -= 1
+                flushes = self._settle()
+            self._resolve(flushes)
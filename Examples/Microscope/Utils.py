@@ -56,6 +56,13 @@ class ImageBuffer:
 
 
 class MemoryInfo:
+    """Geometry, pitch and colour mode of an image buffer.
+
+    These only change when the buffers are allocated again, so
+    :meth:`Camera.alloc` queries them once per buffer, see
+    :meth:`Camera.memory_info`.
+    """
+
     def __init__(self, h_cam, img_buff):
         self.x = ueye.int()
         self.y = ueye.int()
@@ -83,15 +90,18 @@ class MemoryInfo:
                 self.pitch,
             )
         )
+        self.color_mode = ueye.is_SetColorMode(h_cam, ueye.IS_GET_COLOR_MODE)
+        self.bits_per_pixel = get_bits_per_pixel(self.color_mode)
 
 
 class ImageData:
-    def __init__(self, h_cam, img_buff):
+    def __init__(self, h_cam, img_buff, mem_info=None):
+        """Frame in ``img_buff``, described by ``mem_info`` if it is cached."""
         self.h_cam = h_cam
         self.img_buff = img_buff
-        self.mem_info = MemoryInfo(h_cam, img_buff)
-        self.color_mode = ueye.is_SetColorMode(h_cam, ueye.IS_GET_COLOR_MODE)
-        self.bits_per_pixel = get_bits_per_pixel(self.color_mode)
+        self.mem_info = mem_info or MemoryInfo(h_cam, img_buff)
+        self.color_mode = self.mem_info.color_mode
+        self.bits_per_pixel = self.mem_info.bits_per_pixel
         self.array = ueye.get_data(
             self.img_buff.mem_ptr,
             self.mem_info.width,
@@ -153,7 +163,9 @@ class FrameThread(Thread):
                 self.cam.handle(), self.timeout, img_buffer.mem_ptr, img_buffer.mem_id
             )
             if ret == ueye.IS_SUCCESS:
-                image_data = ImageData(self.cam.handle(), img_buffer)
+                image_data = ImageData(
+                    self.cam.handle(), img_buffer, self.cam.memory_info(img_buffer)
+                )
                 # frame = image_data.as_1d_image()
                 # curr_frame_rgb    = cv2.cvtColor(frame.astype('uint8'), cv2.COLOR_BAYER_GB2BGR)
                 # curr_frame_resize = cv2.resize(curr_frame_rgb, (500, 500))
@@ -1,9 +1,12 @@
 import sys
+import threading
 import time
+from functools import partial
 
 import cv2
 import numpy as np
 from ArduinoControl import ArduinoControl
+from DeviceExecutor import DeviceExecutor
 from IdsCamera import Camera
 from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QImage
@@ -21,15 +24,20 @@ from PyQt5.QtWidgets import (
     QWidget,
 )
 from pyueye import ueye
+from StackWriter import StackWriter
 from Utils import FrameThread, create_Folder
 
+from Scanner3D.storage.container import STACK_EXTENSION, FrameInfo, StackFileWriter
+from Scanner3D.utils.coalescer import CommandCoalescer
+
 
 class ControlWindow(QWidget):
     update_signal = pyqtSignal(QImage, name="update_signal")
     changeImgIdx = pyqtSignal(int)
+    write_failed = pyqtSignal(object, object)
     # keyPressed = pyqtSignal(int)
 
-    def __init__(self, camera, parent=None):
+    def __init__(self, camera, parent=None, codec=None):
         super(ControlWindow, self).__init__(parent)
         self.optotune_value = 20
 
@@ -38,6 +46,13 @@ class ControlWindow(QWidget):
         self.image = None
         self.img_idx = 0
         self.make_folder = False
+        # frames are saved by background threads, not the camera callback
+        self.writer = StackWriter(on_error=self.write_failed.emit)
+        self.write_failed.connect(self.frame_not_saved)
+        self.stack_file = None  # container of the frames being saved
+        # the camera thread submits frames to the file the GUI thread closes
+        self.stack_lock = threading.Lock()
+        self.codec = codec  # FrameCodec compressing saved frames, or None
 
         # window cosmetics
         self.setWindowTitle("Microscope controller")
@@ -45,10 +60,19 @@ class ControlWindow(QWidget):
 
         # --------------------  Arduino initial setup  -----------------------#
         self.arduino = ArduinoControl()
-        self.arduino.setNSteps(self.optotune_value)
-        self.arduino.LightExposure(3000)
-        self.arduino.stopLiveView()
-        # self.arduino.startLiveView()
+        # serial commands run on the device thread, the GUI thread never waits
+        self.device = DeviceExecutor(self)
+        self.device.finished.connect(self.device_replied)
+        self.device.failed.connect(self.device_failed)
+        self.device.call(self.arduino.setNSteps, self.optotune_value)
+        self.device.call(self.arduino.LightExposure, 3000)
+        self.device.call(self.arduino.stopLiveView)
+        # self.device.call(self.arduino.startLiveView)
+
+        # rapid clicks only send the newest value of each parameter, and the
+        # newest of the acquisition modes sharing the "mode" key. Failures
+        # are reported by device_failed.
+        self.commands = CommandCoalescer(on_error=lambda key, error: None)
 
         # --------------------  Optotune  -----------------------#
         optotune_lbl = QLabel("Optotune Steps")
@@ -341,7 +365,7 @@ class ControlWindow(QWidget):
             self.camera.stop_video()
             self.camera.enable_external_trigger()
             self.camera.capture_video()
-            self.arduino.startLiveView()
+            self.send("mode", self.arduino.startLiveView)
             self.live_view_btn.setChecked(True)
         else:
             self.camera.stop_video()
@@ -354,19 +378,15 @@ class ControlWindow(QWidget):
             self.one_shot_btn.setEnabled(False)
             self.img_idx = self.opto_lower_limit_value
             if self.make_folder == True:
-                self.curr_action = "LimitedStack"
-                self.dirName = create_Folder(self.curr_action, self.Folder)
-                self.save_image = True
-            self.arduino.startFocalStack()
+                self.start_saving("LimitedStack")
+            self.send("mode", self.arduino.startFocalStack)
         elif self.stack_btn.isChecked():
             self.live_view_btn.setEnabled(False)
             self.one_shot_btn.setEnabled(False)
             if self.make_folder == True:
-                self.curr_action = "Stack"
-                self.dirName = create_Folder(self.curr_action, self.Folder)
-                self.save_image = True
+                self.start_saving("Stack")
             self.img_idx = 0
-            self.arduino.startFocalStack()
+            self.send("mode", self.arduino.startFocalStack)
 
         else:
             self.live_view_btn.setEnabled(True)
@@ -377,11 +397,9 @@ class ControlWindow(QWidget):
             self.stack_btn.setEnabled(False)
             self.one_shot_btn.setEnabled(False)
             if self.make_folder == True:
-                self.curr_action = "LiveView"
-                self.dirName = create_Folder(self.curr_action, self.Folder)
-                self.save_image = True
+                self.start_saving("LiveView")
             self.img_idx = 0
-            self.arduino.startLiveView()
+            self.send("mode", self.arduino.startLiveView)
         else:
             self.stack_btn.setEnabled(True)
             self.one_shot_btn.setEnabled(True)
@@ -414,11 +432,9 @@ class ControlWindow(QWidget):
             self.stack_btn.setEnabled(False)
             self.live_view_btn.setEnabled(False)
             if self.make_folder == True:
-                self.curr_action = "OneShot"
-                self.dirName = create_Folder(self.curr_action, self.Folder)
-                self.save_image = True
+                self.start_saving("OneShot")
             self.img_idx = 0
-            self.arduino.startOneShot()
+            self.send("mode", self.arduino.startOneShot)
         else:
             self.stack_btn.setEnabled(True)
             self.live_view_btn.setEnabled(True)
@@ -426,65 +442,67 @@ class ControlWindow(QWidget):
     def save_btn_clicked(self):
         if self.save_btn.isChecked() and self.live_view_btn.isChecked():
             self.img_idx = 0
-            self.curr_action = "LiveView"
-            self.dirName = create_Folder(self.curr_action, self.Folder)
-            self.save_image = True
+            self.start_saving("LiveView")
         elif self.save_btn.isChecked():
             self.img_idx = 0
             self.make_folder = True
         else:
-            self.save_image = False
-            self.make_folder = False
+            self.stop_saving()
 
     def light_btn_clicked(self):
         if self.light_btn.isChecked():
-            self.arduino.LightsOff()
+            self.send("lights", self.arduino.LightsOff)
         else:
-            self.arduino.LightsOn()
+            self.send("lights", self.arduino.LightsOn)
 
     def optotune_step_up_btn_clicked(self):
         self.step_value = self.step_value - 1
         self.step_display.setNum(self.step_value)
-        self.arduino.stepBackward()
-        time.sleep(1)
-        self.arduino.printAll()
+        # every step counts, a unique key keeps it from being superseded
+        self.send(object(), self.arduino.stepBackward)
         self.live_view_btn.setChecked(True)
         self.live_view_btn_clicked()
 
     def optotune_step_down_btn_clicked(self):
         self.step_value = self.step_value + 1
         self.step_display.setNum(self.step_value)
-        self.arduino.stepForward()
-        time.sleep(1)
-        self.arduino.printAll()
+        self.send(object(), self.arduino.stepForward)
         self.live_view_btn.setChecked(True)
         self.live_view_btn_clicked()
 
     def opto_up_up(self):
         self.opto_upper_limit_value = self.opto_upper_limit_value + 1
         self.opto_upper_limit_display.setNum(self.opto_upper_limit_value)
-        self.arduino.upperOptoLimit(self.opto_upper_limit_value)
+        self.send(
+            "upperOptoLimit", self.arduino.upperOptoLimit, self.opto_upper_limit_value
+        )
         self.live_view_btn.setChecked(True)
         self.live_view_btn_clicked()
 
     def opto_up_down(self):
         self.opto_upper_limit_value = self.opto_upper_limit_value - 1
         self.opto_upper_limit_display.setNum(self.opto_upper_limit_value)
-        self.arduino.upperOptoLimit(self.opto_upper_limit_value)
+        self.send(
+            "upperOptoLimit", self.arduino.upperOptoLimit, self.opto_upper_limit_value
+        )
         self.live_view_btn.setChecked(True)
         self.live_view_btn_clicked()
 
     def opto_lower_up(self):
         self.opto_lower_limit_value = self.opto_lower_limit_value + 1
         self.opto_lower_limit_display.setNum(self.opto_lower_limit_value)
-        self.arduino.lowerOptoLimit(self.opto_lower_limit_value)
+        self.send(
+            "lowerOptoLimit", self.arduino.lowerOptoLimit, self.opto_lower_limit_value
+        )
         self.live_view_btn.setChecked(True)
         self.live_view_btn_clicked()
 
     def opto_lower_down(self):
         self.opto_lower_limit_value = self.opto_lower_limit_value - 1
         self.opto_lower_limit_display.setNum(self.opto_lower_limit_value)
-        self.arduino.lowerOptoLimit(self.opto_lower_limit_value)
+        self.send(
+            "lowerOptoLimit", self.arduino.lowerOptoLimit, self.opto_lower_limit_value
+        )
         self.live_view_btn.setChecked(True)
         self.live_view_btn_clicked()
 
@@ -503,14 +521,14 @@ class ControlWindow(QWidget):
     def optotune_increase_num(self):
         self.optotune_value = self.optotune_value + 1
         self.optotune_display.setNum(self.optotune_value)
-        self.arduino.setNSteps(self.optotune_value)
+        self.send("setNSteps", self.arduino.setNSteps, self.optotune_value)
         self.live_view_btn.setChecked(True)
         self.live_view_btn_clicked()
 
     def optotune_decrease_num(self):
         self.optotune_value = self.optotune_value - 1
         self.optotune_display.setNum(self.optotune_value)
-        self.arduino.setNSteps(self.optotune_value)
+        self.send("setNSteps", self.arduino.setNSteps, self.optotune_value)
         self.live_view_btn.setChecked(True)
         self.live_view_btn_clicked()
 
@@ -520,8 +538,10 @@ class ControlWindow(QWidget):
         else:
             self.exposure_value = self.exposure_value + 1
         self.exposure_display.setNum(self.exposure_value)
-        self.arduino.setExposure(self.exposure_value * 1000)
-        self.arduino.LightExposure(self.exposure_value * 1000)
+        self.send("setExposure", self.arduino.setExposure, self.exposure_value * 1000)
+        self.send(
+            "LightExposure", self.arduino.LightExposure, self.exposure_value * 1000
+        )
         print(self.camera.get_gain())
         self.camera.set_exposure(self.exposure_value)
         self.live_view_btn.setChecked(True)
@@ -533,12 +553,31 @@ class ControlWindow(QWidget):
         else:
             self.exposure_value = self.exposure_value - 1
         self.exposure_display.setNum(self.exposure_value)
-        self.arduino.setExposure(self.exposure_value * 1000)
-        self.arduino.LightExposure(self.exposure_value * 1000)
+        self.send("setExposure", self.arduino.setExposure, self.exposure_value * 1000)
+        self.send(
+            "LightExposure", self.arduino.LightExposure, self.exposure_value * 1000
+        )
         self.camera.set_exposure(self.exposure_value)
         self.live_view_btn.setChecked(True)
         self.live_view_btn_clicked()
 
+    def send(self, key, fn, *args):
+        """Coalesce a device call under ``key``, then run it on the device thread."""
+        self.commands.submit(key, partial(self.device.call, fn, *args))
+
+    @pyqtSlot(str, object)
+    def device_replied(self, name, reply):
+        if reply is not None and not reply.acknowledged:
+            print("No reply to " + reply.command)
+
+    @pyqtSlot(str, object)
+    def device_failed(self, name, error):
+        print(name + " failed: " + repr(error))
+
+    @pyqtSlot(object, object)
+    def frame_not_saved(self, target, error):
+        print("Failed to write " + str(target) + ": " + repr(error))
+
     def draw_background(self, painter, rect):
         if self.image:
             image = self.image.scaled(rect.width(), rect.height(), Qt.KeepAspectRatio)
@@ -546,7 +585,11 @@ class ControlWindow(QWidget):
 
     def exit_gui(self):
         if self.exit_btn.isChecked():
-            self.arduino.LightsOff()
+            self.commands.close(flush=False)
+            self.close_stack(wait=True)
+            self.writer.close()
+            self.device.call(self.arduino.LightsOff)
+            self.device.shutdown()
             camera_thread.stop()
             camera.stop_video()
             camera.exit()
@@ -557,8 +600,7 @@ class ControlWindow(QWidget):
     def img_idx_valuechange(self, image_idx):
         self.img_number_display.setNum(image_idx)
         if image_idx > self.optotune_value and self.stack_btn.isChecked():
-            self.save_image = False
-            self.make_folder = False
+            self.stop_saving()
             self.save_btn.setEnabled(True)
             self.save_btn.setChecked(False)
             self.stack_btn.setEnabled(True)
@@ -568,8 +610,7 @@ class ControlWindow(QWidget):
             self.live_view_btn.setChecked(True)
             self.live_view_btn_clicked()
         elif image_idx >= 1 and self.one_shot_btn.isChecked():
-            self.save_image = False
-            self.make_folder = False
+            self.stop_saving()
             self.save_btn.setEnabled(True)
             self.save_btn.setChecked(False)
             self.one_shot_btn.setEnabled(True)
@@ -581,8 +622,7 @@ class ControlWindow(QWidget):
             image_idx > self.opto_upper_limit_value
             and self.optotune_enter_value_box.isChecked()
         ):
-            self.save_image = False
-            self.make_folder = False
+            self.stop_saving()
             self.save_btn.setEnabled(True)
             self.save_btn.setChecked(False)
             self.one_shot_btn.setEnabled(True)
@@ -591,6 +631,41 @@ class ControlWindow(QWidget):
             self.live_view_btn.setChecked(True)
             self.live_view_btn_clicked()
 
+    def start_saving(self, action):
+        """Save the frames of a capture into a new folder."""
+        self.close_stack()
+        self.curr_action = action
+        self.dirName = create_Folder(action, self.Folder)
+        self.save_image = True
+
+    def stop_saving(self):
+        """End a capture, reporting the saving once every frame is on disk."""
+        self.save_image = False
+        self.make_folder = False
+        self.close_stack()
+
+    def close_stack(self, wait=False):
+        """Close the stack file once its frames are written.
+
+        Args:
+            wait (bool): Block until then instead of closing it from a
+                background thread. Defaults to False.
+        """
+        with self.stack_lock:
+            stack_file, self.stack_file = self.stack_file, None
+        if stack_file is None:
+            return
+        if wait:
+            self.writer.flush()
+            stack_file.close()
+            return
+
+        def closed(saved):
+            stack_file.close()
+            print("Saved stack:", stack_file.path, saved.result())
+
+        self.writer.flush_async().add_done_callback(closed)
+
     def update_image(self, image):
         self.scene.update()
 
@@ -605,21 +680,28 @@ class ControlWindow(QWidget):
     def process_image(self, image_data):
         image = image_data.as_1d_image()
 
-        if self.save_image == True:
-            exp = self.camera.get_exposure()
-            exp_rounded = round(exp, 2)
-            file = open(
-                self.dirName
-                + "file"
-                + str(self.img_idx)
-                + "Exp_"
-                + str(exp_rounded)
-                + "TotStepNumbers"
-                + str(self.optotune_value)
-                + ".bin",
-                "wb",
-            )
-            image.tofile(file)
+        with self.stack_lock:
+            if self.save_image == True:
+                if self.stack_file is None:
+                    # one file per capture, of raw frames demosaiced like below
+                    self.stack_file = StackFileWriter(
+                        self.dirName
+                        + "TotStepNumbers"
+                        + str(self.optotune_value)
+                        + STACK_EXTENSION,
+                        image.shape,
+                        image.dtype,
+                        bayer_pattern="GB",
+                        codec=self.codec,
+                    )
+                info = FrameInfo(
+                    step=self.img_idx,
+                    exposure=self.camera.get_exposure(),
+                    timestamp=time.time(),
+                )
+                # submitted before close_stack swaps the file, so its flush
+                # covers the frame
+                self.writer.submit(self.stack_file, image, info)
 
         image = cv2.cvtColor(image.astype("uint8"), cv2.COLOR_BAYER_GB2BGR)
         image = cv2.resize(image, (500, 500))
@@ -689,6 +771,8 @@ if __name__ == "__main__":
     camera.set_exposure(3)
     camera.set_frame_rate(10)
     camera.capture_video()
+    # raw frames stay readable if the program dies before closing the stack,
+    # a FrameCodec only locates its frames through the index written on close
     control_window = ControlWindow(camera)
 
     camera_thread = FrameThread(camera, control_window)
@@ -700,6 +784,10 @@ if __name__ == "__main__":
 
     app.exec_()
 
+    control_window.commands.close()
+    control_window.close_stack(wait=True)
+    control_window.writer.close()
+    control_window.device.shutdown()
     camera_thread.stop()
     # camera_thread.join()
     cv2.destroyAllWindows()
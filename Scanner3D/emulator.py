@@ -0,0 +1,712 @@
+"""Python models of the scanner and microscope controller firmware.
+
+:class:`ControllerEmulator` mirrors the serial parser and motion commands of
+``Controller/Controller.ino`` closely enough to exercise :class:`Scanner` and
+the protocol without the physical board. :class:`FocalSweepEmulator` does the
+same for ``Examples/Microscope/FocalSweep4.ino`` and ``ArduinoControl``.
+Motion and exposures are not slept through, their duration is computed from
+the firmware's timing instead. :class:`PtyEmulator` serves an emulator on a
+pseudo-terminal in real time, so the unchanged ``serial.Serial`` code paths
+can talk to it.
+"""
+
+import os
+import queue
+import select
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from Scanner3D.interface import (
+    MAX_QUEUE_SEGMENTS,
+    RX_BUFFER_SIZE,
+    SERVO_RANGES,
+    ZERO_X_ROLL,
+    ZERO_Y_ROLL,
+)
+from Scanner3D.planner import (
+    MAX_PROFILE_STAIRS,
+    LineProfile,
+    MotionProfile,
+    Ramp,
+    step_period_us,
+)
+from Scanner3D.protocol import (
+    AXES,
+    BITS_PER_BYTE,
+    FRAME_START,
+    MAX_LINE_LENGTH,
+    PROTOCOL_VERSION,
+    Direction,
+    parse_frame,
+)
+
+LEGACY_IDLE_S = 0.05
+
+
+def _constrain(value: int, low: int, high: int) -> int:
+    """Clamp like Arduino's ``constrain``."""
+    return max(low, min(value, high))
+
+
+def _parse_ramp(ramp: bytes) -> Ramp:
+    """Parse a ``<start interval>.<stairs>.<acceleration>`` ramp like
+    ``parseRamp``."""
+    fields = ramp.split(b".", 2)
+    if len(fields) < 3:
+        return Ramp(0, 0, 0)
+    stairs = _constrain(_to_int(fields[1]), 0, MAX_PROFILE_STAIRS)
+    return Ramp(_to_int(fields[0]), stairs, _to_int(fields[2]))
+
+
+def _to_int(text: bytes) -> int:
+    """Parse a leading integer like Arduino's ``String.toInt``."""
+    digits = bytearray()
+    for i, char in enumerate(text.strip()):
+        if chr(char).isdigit() or (i == 0 and char in b"+-"):
+            digits.append(char)
+        else:
+            break
+    try:
+        return int(digits)
+    except ValueError:
+        return 0
+
+
+class ControllerEmulator:
+    """Emulate the serial protocol and motion of the scanner controller.
+
+    Args:
+        clock (Callable[[], float]): Time source used for the legacy idle
+            timeout. Defaults to ``time.monotonic``.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self._line = bytearray()
+        self._last_byte = 0.0
+        self.position: Dict[str, int] = {"y": 0, "z": 0}
+        self.servos: Dict[Direction, int] = {
+            Direction.XROLL: ZERO_X_ROLL,
+            Direction.YROLL: ZERO_Y_ROLL,
+        }
+        self.pressed_switches: Set[Direction] = set()
+        self.motion_time = 0.0  # accumulated seconds spent stepping
+        self.last_duration = 0.0
+        self.last_steps = 0
+        self.last_stopped = False
+        self.queue: List[bytes] = []  # queued segment commands
+        self.segment_durations: List[float] = []  # of the last queue run
+        self.last_wait = 0.0  # seconds the last command waited to be read
+
+    def startup(self) -> List[bytes]:
+        """Lines printed when the controller starts, none."""
+        return []
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Receive bytes from the host.
+
+        Returns:
+            List[bytes]: Lines the controller prints, without line endings.
+        """
+        replies = []
+        for char in data:
+            self._last_byte = self._clock()
+            if char in b"\r\n":
+                if self._line:
+                    replies.extend(self._take_line())
+                continue
+            if len(self._line) < MAX_LINE_LENGTH - 1:
+                self._line.append(char)
+        return replies
+
+    def poll(self) -> List[bytes]:
+        """Complete an unframed legacy command once the line went idle."""
+        if (
+            self._line
+            and not self._line.startswith(FRAME_START)
+            and self._clock() - self._last_byte >= LEGACY_IDLE_S
+        ):
+            return self._take_line()
+        return []
+
+    def _take_line(self) -> List[bytes]:
+        """Handle the buffered line and start a new one."""
+        line, self._line = bytes(self._line), bytearray()
+        return self.handle_line(line)
+
+    def handle_line(self, line: bytes) -> List[bytes]:
+        """Handle one complete line, framed or legacy."""
+        self.segment_durations = []
+        if not line.startswith(FRAME_START):
+            return self.execute(line)
+
+        try:
+            version, command_id, cmd = parse_frame(line)
+        except ValueError:
+            return [b"err:-1"]
+
+        if version != PROTOCOL_VERSION:
+            return [b"err:%d" % command_id]
+
+        if cmd.startswith(b"queue_"):
+            return self._handle_queue(command_id, cmd)
+
+        replies = [b"ack:%d" % command_id] + self.execute(cmd)
+        status = b"stop" if self.last_stopped else b"done"
+        return replies + [b"%s:%d:%d" % (status, command_id, self.last_steps)]
+
+    def _handle_queue(self, command_id: int, cmd: bytes) -> List[bytes]:
+        """Queue a segment silently, or run the queue on ``queue_run_<count>``."""
+        fields = cmd.split(b"_")
+        fields += [b""] * (4 - len(fields))
+        if fields[1] != b"run":
+            try:
+                Direction(fields[1].decode())
+            except ValueError:
+                return [b"err:%d" % command_id]
+            if len(self.queue) == MAX_QUEUE_SEGMENTS:
+                return [b"err:%d" % command_id]
+            self.queue.append(cmd)
+            return []
+
+        queue, self.queue = self.queue, []
+        if _to_int(fields[2]) != len(queue):
+            return [b"err:%d" % command_id]
+
+        replies = [b"ack:%d" % command_id]
+        total, duration = 0, 0.0
+        for index, segment in enumerate(queue):
+            replies += self.execute(segment)
+            total += self.last_steps
+            duration += self.last_duration
+            self.segment_durations.append(self.last_duration)
+            replies.append(b"seg:%d:%d:%d" % (command_id, index, self.last_steps))
+            if self.last_stopped:
+                break
+
+        self.last_steps, self.last_duration = total, duration
+        status = b"stop" if self.last_stopped else b"done"
+        return replies + [b"%s:%d:%d" % (status, command_id, total)]
+
+    def execute(self, cmd: bytes) -> List[bytes]:
+        """Execute an unframed ``mode_direction_steps_speed`` command."""
+        fields = cmd.split(b"_", 4)
+        fields += [b""] * (5 - len(fields))
+        direction, steps, speed = fields[1], _to_int(fields[2]), _to_int(fields[3])
+        self.last_duration = 0.0
+        self.last_steps = 0
+        self.last_stopped = False
+
+        if fields[0] == b"line":
+            return self._move_line(_to_int(direction), steps, speed, fields[4])
+
+        try:
+            direction = Direction(direction.decode())
+        except ValueError:
+            return []
+
+        if fields[0] == b"profile":
+            if direction not in AXES:
+                return []
+            return self._run_profile(direction, steps, speed, fields[4])
+
+        if direction in AXES:
+            return self._move_axis(direction, steps, step_period_us(speed))
+
+        low, high = SERVO_RANGES[direction]
+        self.servos[direction] = _constrain(steps, low, high)
+        return []
+
+    def _run_profile(
+        self, direction: Direction, steps: int, cruise_interval: int, ramp: bytes
+    ) -> List[bytes]:
+        """Run a ``profile`` command like ``runProfile``."""
+        profile = MotionProfile(direction, steps, cruise_interval, _parse_ramp(ramp))
+
+        replies = []
+        total, duration = 0, 0.0
+        for segment in profile.segments:
+            replies += self._move_axis(direction, segment.steps, segment.interval_us)
+            total += self.last_steps
+            duration += self.last_duration
+            if self.last_stopped:
+                break
+
+        self.last_steps, self.last_duration = total, duration
+        return replies
+
+    def _move_line(
+        self, dy: int, dz: int, cruise_interval: int, ramp: bytes
+    ) -> List[bytes]:
+        """Step Y and Z together like ``moveLine``."""
+        profile = LineProfile(dy, dz, cruise_interval, _parse_ramp(ramp))
+
+        moving = set()
+        if dy:
+            moving.add(Direction.UP if dy > 0 else Direction.DOWN)
+        if dz:
+            moving.add(Direction.FORWARD if dz > 0 else Direction.BACKWARD)
+
+        replies = []
+        if moving & self.pressed_switches and profile.steps > 0:
+            replies.append(b"stop!")
+            self.last_stopped = True
+            self.last_steps, self.last_duration = 0, 0.0
+            return replies
+
+        y, z = profile.position(profile.steps)
+        self.position["y"] += y
+        self.position["z"] += z
+        self.last_steps = profile.steps
+        self.last_duration = profile.duration
+        self.motion_time += self.last_duration
+        return replies
+
+    def _move_axis(
+        self, direction: Direction, steps: int, interval_us: int
+    ) -> List[bytes]:
+        """Step one axis like ``moveAxis``, stopping at a pressed switch."""
+        replies = []
+        executed = max(steps, 0)
+        if direction in self.pressed_switches and executed > 0:
+            replies.append(b"stop!")
+            executed = 0
+            self.last_stopped = True
+
+        axis, sign = AXES[direction]
+        self.position[axis] += sign * executed
+        self.last_steps = executed
+        self.last_duration = executed * interval_us * 1e-6
+        self.motion_time += self.last_duration
+        return replies
+
+    def press_switch(self, direction: Direction, pressed: bool = True) -> None:
+        """Press or release the limit switch that blocks ``direction``."""
+        if pressed:
+            self.pressed_switches.add(direction)
+        else:
+            self.pressed_switches.discard(direction)
+
+    def servo(self, direction: Direction) -> Optional[int]:
+        """Current angle of a roll servo."""
+        return self.servos.get(direction)
+
+
+FOCAL_SWEEP_ACK = "ok:"
+FOCAL_SWEEP_FPS = 10
+LED_TIMES_US = (400, 200, 200, 200, 10)  # ledTime, by LED mode
+LED_ALL, LED_EXTERNAL = 0, 4
+DRIVER_MAX_MA = 300.0  # driverAmp_max
+DRIVER_LEVELS = 4095  # 12 bit current driver
+
+
+class FocalSweepEmulator:
+    """Emulate the serial protocol and capture timing of the microscope controller.
+
+    Commands are a setting letter, a mode letter and a value, e.g.
+    ``pe20000``, answered with the same text as ``FocalSweep4.ino``. Like the
+    firmware, live view keeps triggering the camera until the next command
+    arrives, and that command is read once the running frame was exposed.
+    Text printed without a line ending is returned as a line of its own.
+
+    Args:
+        clock (Callable[[], float]): Time source of the live view frames.
+            Defaults to ``time.monotonic``.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self._line = bytearray()
+        self._output: List[str] = []
+        self._live_since: Optional[float] = None
+        self.step_total = 6
+        self.step_num = 0
+        self.exposure_time = 20000  # us
+        self.projector_exposure = 50  # percent
+        self.use_led = False
+        self.max_current = 250.0  # mA
+        self.fps = FOCAL_SWEEP_FPS
+        self.driver_values = self._driver_values()
+        self.frames = 0  # camera triggers of finished captures
+        self.last_duration = 0.0
+        self.last_wait = 0.0
+
+    @property
+    def frame_period(self) -> float:
+        """Seconds between live view frames, like ``cameraDelay``."""
+        delay_ms = 1000 // self.fps - LED_TIMES_US[LED_ALL] // 1000
+        return delay_ms * 1e-3 + LED_TIMES_US[LED_EXTERNAL] * 1e-6
+
+    @property
+    def live(self) -> bool:
+        """Whether live view is running."""
+        return self._live_since is not None
+
+    def startup(self) -> List[bytes]:
+        """Lines printed when the controller starts."""
+        self._println("Arduino connected! Version 0")
+        self._println("Hello Teensy Started, Waiting for order...")
+        self._optotune("S", self.step_total)
+        return self._take_output()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Receive bytes from the host.
+
+        Returns:
+            List[bytes]: Lines the controller prints, without line endings.
+        """
+        replies = []
+        for char in data:
+            if char in b"\r\n":
+                if self._line:
+                    line, self._line = bytes(self._line), bytearray()
+                    replies.extend(self.handle_line(line))
+                continue
+            self._line.append(char)
+        return replies
+
+    def poll(self) -> List[bytes]:
+        """Nothing completes while the line is idle."""
+        return []
+
+    def handle_line(self, line: bytes) -> List[bytes]:
+        """Handle one command like ``readInput`` and one pass of ``loop``."""
+        self.last_duration = 0.0
+        self.last_wait = 0.0
+        if self._live_since is not None:
+            # the loop reads the next command once the running frame is done
+            elapsed = self._clock() - self._live_since
+            frames = int(elapsed // self.frame_period) + 1
+            self.last_wait = frames * self.frame_period - elapsed
+            self.frames += frames
+            self._live_since = None
+
+        command = line.decode(errors="replace").strip()
+        setting, mode, value = command[:1], command[1:2], _to_int(line[2:])
+        if setting in ("O", "o"):
+            self._optotune(mode, value)
+        elif setting in ("P", "p"):
+            self._set_parameter(mode, value)
+
+        self._println(FOCAL_SWEEP_ACK + command)
+        if setting in ("C", "c"):
+            self._capture(mode)
+        elif setting == "d" and mode == "p":
+            # the firmware repeats this until the next command, once is enough
+            self._println("Advance PROJ!")
+            self._print("switch projector pattern")
+            self._print("prepare for next rising edge")
+            self.last_duration = 1e-3
+        return self._take_output()
+
+    def _driver_values(self) -> List[int]:
+        """Driver level of each focal step, spread over the usable current."""
+        return [
+            int(self._step_current(i) / DRIVER_MAX_MA * DRIVER_LEVELS)
+            for i in range(self.step_total)
+        ]
+
+    def _step_current(self, step: int) -> float:
+        """Optotune current of a focal step in mA."""
+        return (step + 0.5) / max(self.step_total, 1) * self.max_current
+
+    def _step_exposure(self) -> int:
+        """Exposure of one focal step in µs, like ``stepExposure``."""
+        return self.exposure_time // max(self.step_total, 1)
+
+    def _optotune(self, mode: str, value: int) -> None:
+        """Change the focal steps like ``optotuneControl``."""
+        if mode in ("S", "s"):
+            self.step_total = value
+            self.driver_values = self._driver_values()
+            self._println(f"New Number of Steps: {value}")
+            for i, driver_value in enumerate(self.driver_values):
+                self._println(
+                    f"Step:{i}  WD:0.00mm  Current:{self._step_current(i):.2f}mA"
+                    f"  DriverVal: {driver_value}"
+                )
+            current = (
+                int(self._step_current(self.step_num))
+                if self.step_num < self.step_total
+                else 0
+            )
+            self._println(
+                f"Current Step: {self.step_num} ( {value} total steps)"
+                f"  Current:{current}mA"
+            )
+
+            step_exposure = self._step_exposure()
+            delay = int((10000.0 - self.projector_exposure) * step_exposure / 10000.0)
+            first_half = (step_exposure - delay) // 2
+            self._println()
+            self._println(f"Exposure time = {self.exposure_time // 1000}ms")
+            self._println(f"Step duration is {step_exposure}us")
+            self._println(f"Delay: {delay}us")
+            self._println(f"First duty cycle: {first_half}us")
+            self._println(f"Second duty cycle: {step_exposure - delay - first_half}us")
+            self._println(f"Max current: {self.max_current:.2f}mA")
+            self.step_num = 0
+        elif mode in ("F", "f"):
+            self.step_num = (
+                self.step_num + 1 if self.step_num < self.step_total - 1 else 0
+            )
+        elif mode in ("B", "b"):
+            self.step_num = (
+                self.step_num - 1 if self.step_num > 0 else self.step_total - 1
+            )
+        elif mode in ("C", "c"):
+            if -1 < value < self.step_total:
+                self.step_num = value
+        elif mode in ("A", "a"):
+            self.step_num = self.step_total - 1
+        elif mode in ("Z", "z"):
+            self.step_num = 0
+
+    def _set_parameter(self, mode: str, value: int) -> None:
+        """Change a capture parameter like ``setParameters``."""
+        if mode == "e":
+            self.exposure_time = value
+            self._println(f"Exposure: {value}")
+        elif mode == "p":
+            self.projector_exposure = value
+            self._println(f"Projector exposure: {value}")
+        elif mode == "l":
+            self.use_led = bool(value)
+            self._println(f"Use LED: {int(self.use_led)}")
+        elif mode == "c":
+            self.max_current = float(value)
+            self._println(f"Max current use: {self.max_current:.2f}")
+
+    def _capture(self, mode: str) -> None:
+        """Trigger the camera like the capture modes of ``loop``."""
+        step_exposure = self._step_exposure()
+        if mode in ("S", "s"):
+            delay = int((100.0 - self.projector_exposure) * step_exposure / 100.0)
+            first_half = (step_exposure - delay) // 2
+            self._println("proj Exposure")
+            self._print(str(self.projector_exposure))
+            self._println("pre Pattern Delay")
+            self._print(str(delay))
+            self._println("delay first half")
+            self._print(str(first_half))
+            self._println("dealy Second Half")
+            self._println(str(step_exposure - delay - first_half))
+            self._println("Camera Trigger High")
+            self.last_duration = self.step_total * step_exposure * 1e-6
+            self.frames += 1
+        elif mode in ("R", "r"):
+            self._println("Advance cam")
+            self._print("cameraTrigger high")
+            self._print("cameraTrigger low")
+            self.last_duration = 10e-3
+            self.frames += 1
+        elif mode == "m":
+            self.last_duration = step_exposure * 1e-6
+            self.frames += 1
+        elif mode == "l":
+            self._live_since = self._clock()
+        elif mode in ("F", "f"):
+            self._println("Single Focal Stack")
+            self._print(f"Step Number(1-{self.step_total}):")
+            for step, driver_value in enumerate(self.driver_values):
+                current = int(driver_value / DRIVER_LEVELS * DRIVER_MAX_MA)
+                self._print(f"{step + 1} ({current}mA), ")
+            # one extra exposure after the stack
+            self.last_duration = (self.step_total + 1) * self.frame_period
+            self.frames += self.step_total + 1
+
+    def _print(self, text: str) -> None:
+        """Print without a line ending, like ``Serial.print``."""
+        self._output.append(text)
+
+    def _println(self, text: str = "") -> None:
+        """Print a line, like ``Serial.println``."""
+        self._output.append(text + "\n")
+
+    def _take_output(self) -> List[bytes]:
+        """Printed text split into lines, the last one possibly unterminated."""
+        lines = "".join(self._output).split("\n")
+        self._output = []
+        if lines[-1] == "":
+            lines.pop()
+        return [line.encode() for line in lines]
+
+
+Emulator = Union[ControllerEmulator, FocalSweepEmulator]
+COMPLETION_PREFIXES = (b"done:", b"stop:")
+POLL_INTERVAL_S = 0.005
+
+
+class PtyEmulator:
+    """Serve an emulator on a pseudo-terminal, in real time.
+
+    The emulator is given the host's commands one line at a time, each once
+    it crossed the emulated serial line. Replies reporting the end of a move
+    or of a program segment are held back until it finished, other replies
+    are written right away and followed by the command's duration, so the
+    next command waits like it would on the board. Use as a context manager,
+    and close the host's connection first. POSIX only.
+
+    Like the board, the emulator does not read while a command runs, and the
+    bytes that do not fit in its `RX_BUFFER_SIZE` bytes receive buffer
+    meanwhile are lost and counted in ``overflowed``.
+
+    Args:
+        emulator (Emulator): Controller to serve.
+        baudrate (Optional[int]): Pace the traffic like a serial line at this
+            rate, None to send at full speed. Defaults to 9600.
+    """
+
+    def __init__(self, emulator: Emulator, baudrate: Optional[int] = 9600) -> None:
+        self.emulator = emulator
+        self.baudrate = baudrate
+        self.port: Optional[str] = None
+        self._master: Optional[int] = None
+        self._slave: Optional[int] = None
+        self._running = False
+        self._threads: List[threading.Thread] = []
+        self._received: "queue.Queue[Tuple[float, bytes]]" = queue.Queue()
+        self.overflowed = 0  # bytes lost to a full receive buffer
+
+    def __enter__(self) -> "PtyEmulator":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def start(self) -> str:
+        """Open the pseudo-terminal and start serving.
+
+        Returns:
+            str: Device path of the port to connect to.
+        """
+        import tty  # pylint: disable=import-outside-toplevel  # POSIX only
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._threads = [
+            threading.Thread(target=target, daemon=True)
+            for target in (self._receive, self._serve)
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self.port
+
+    def close(self) -> None:
+        """Stop serving and close the pseudo-terminal."""
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def _transfer_time(self, size: int) -> float:
+        """Seconds ``size`` bytes take on the emulated serial line."""
+        return size * BITS_PER_BYTE / self.baudrate if self.baudrate else 0.0
+
+    def _receive(self) -> None:
+        """Timestamp the host's lines with the time they finish arriving."""
+        line_free_at = 0.0
+        while self._running:
+            ready, _, _ = select.select([self._master], [], [], POLL_INTERVAL_S)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                return
+            for line in data.splitlines(keepends=True):
+                # bytes queue behind the ones still crossing the line
+                line_free_at = max(line_free_at, time.monotonic())
+                line_free_at += self._transfer_time(len(line))
+                self._received.put((line_free_at, line))
+
+    def _serve(self) -> None:
+        """Feed the host's lines to the emulator until closed."""
+        self._write(self.emulator.startup())
+        backlog: Deque[Tuple[float, bytes]] = deque()
+        while self._running:
+            if not backlog:
+                try:
+                    backlog.append(self._received.get(timeout=POLL_INTERVAL_S))
+                except queue.Empty:
+                    self._run(self.emulator.poll)
+                    continue
+            arrival, line = backlog.popleft()
+            time.sleep(max(arrival - time.monotonic(), 0.0))
+            start = time.monotonic()
+            self._run(lambda line=line: self.emulator.feed(line))
+            backlog = self._buffer(backlog, start)
+
+    def _buffer(
+        self, backlog: Deque[Tuple[float, bytes]], busy_from: float
+    ) -> Deque[Tuple[float, bytes]]:
+        """Drop the bytes that overflowed the receive buffer while busy.
+
+        The board does not read while it runs a command, so the bytes that
+        arrived meanwhile wait in its `RX_BUFFER_SIZE` bytes buffer, and the
+        ones that do not fit are lost.
+        """
+        now = time.monotonic()
+        while True:
+            try:
+                backlog.append(self._received.get_nowait())
+            except queue.Empty:
+                break
+
+        kept: Deque[Tuple[float, bytes]] = deque()
+        buffered = 0
+        for arrival, line in backlog:
+            if busy_from < arrival <= now:
+                room = max(RX_BUFFER_SIZE - buffered, 0)
+                self.overflowed += max(len(line) - room, 0)
+                line = line[:room]
+            if line:
+                buffered += len(line)
+                kept.append((arrival, line))
+        return kept
+
+    def _run(self, step: Callable[[], List[bytes]]) -> None:
+        """Let the emulator handle input, then reply in real time.
+
+        Each ``seg:`` reply of a program is sent once its segment finished,
+        and the completion once the whole command did.
+        """
+        self.emulator.last_duration = 0.0
+        self.emulator.last_wait = 0.0
+        replies = step()
+        time.sleep(self.emulator.last_wait)
+
+        segments = iter(getattr(self.emulator, "segment_durations", []))
+        pending: List[bytes] = []
+        elapsed = 0.0
+        for reply in replies:
+            if reply.startswith(b"seg:"):
+                delay = next(segments, 0.0)
+            elif reply.startswith(COMPLETION_PREFIXES):
+                delay = max(self.emulator.last_duration - elapsed, 0.0)
+            else:
+                pending.append(reply)
+                continue
+            self._write(pending)
+            time.sleep(delay)
+            elapsed += delay
+            pending = [reply]
+        self._write(pending)
+        time.sleep(max(self.emulator.last_duration - elapsed, 0.0))
+
+    def _write(self, lines: List[bytes]) -> None:
+        """Send lines to the host, as fast as the serial line allows."""
+        if not lines:
+            return
+        data = b"".join(line + b"\r\n" for line in lines)
+        time.sleep(self._transfer_time(len(data)))
+        os.write(self._master, data)
@@ -1,62 +1,195 @@
 """Interface for 3D Scanner."""
 
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
 from enum import Enum
-from typing import Union
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from serial import Serial
 
+from Scanner3D.planner import (
+    AxisLimits,
+    MotionProfile,
+    TimingModel,
+    parse_command,
+    plan_line,
+)
+from Scanner3D.protocol import (
+    AXES,
+    BITS_PER_BYTE,
+    FRAME_END,
+    Direction,
+    Mode,
+    SpeedMode,
+    frame_command,
+    generate_command,
+    parse_frame,
+)
 
-class SpeedMode(Enum):
-    """Speed modes."""
+MAX_COMMAND_ID = 1_000_000
+MAX_QUEUE_SEGMENTS = 64  # size of the controller's motion queue
+RX_BUFFER_SIZE = 64  # bytes the controller's serial port holds while it steps
+TIMING_SAMPLES = 200  # completed moves the timing model is fitted to
+ZERO_X_ROLL = 123
+DELTA_X_ROLL = 20
+ZERO_Y_ROLL = 123
+DELTA_Y_ROLL = 90
 
-    NORMAL: str = "normal"
-    FAST: str = "fast"
+_REPLY = re.compile(rb"(ack|done|stop|err|seg):(-?\d+)(?::(-?\d+))?(?::(-?\d+))?")
+# limit switch notices are printed without a line ending, in front of or
+# inside reply lines
+_SWITCH_NOTICE = re.compile(rb"Down,|Up,")
 
-    def speed(self) -> int:
-        """Speed value represented by the speed mode."""
-        if self == SpeedMode.NORMAL:
-            return "25"
+ProgressCallback = Callable[[int, int], None]
 
-        if self == SpeedMode.FAST:
-            return "50"
 
-        return 0
+# angles the firmware constrains each roll servo to
+SERVO_RANGES: Dict[Direction, Tuple[int, int]] = {
+    Direction.XROLL: (ZERO_X_ROLL - DELTA_X_ROLL, ZERO_X_ROLL + DELTA_X_ROLL),
+    Direction.YROLL: (ZERO_Y_ROLL - DELTA_Y_ROLL, ZERO_Y_ROLL + DELTA_Y_ROLL),
+}
 
+# the only limit switch reporting its state changes, blocking this direction
+EVENT_SWITCH = Direction.BACKWARD
 
-class Mode(Enum):
-    """Run modes."""
 
-    QUEUE: str = "queue"
-    SINGLE: str = "single"
+class MoveStatus(Enum):
+    """Outcome of a command sent to the scanner controller."""
 
+    DONE: str = "done"
+    STOPPED: str = "stop"
+    REJECTED: str = "err"
+    SENT: str = "sent"
 
-class Direction(Enum):
-    """Directions in which the scanner can move."""
 
-    UP = "up"
-    DOWN = "down"
-    FORWARD = "forward"
-    BACKWARD = "backward"
-    XROLL = "xRoll"
-    YROLL = "yRoll"
+@dataclass
+class MoveResult:
+    """Completion report of a command.
+
+    Args:
+        command_id (int): ID of the command.
+        status (MoveStatus): How the command ended.
+        steps (int): Steps executed before completion or the limit switch.
+        elapsed (float): Seconds from sending the command to its completion.
+        predicted (float): Seconds the timing model predicted for ``elapsed``.
+    """
+
+    command_id: int
+    status: MoveStatus
+    steps: int = 0
+    elapsed: float = 0.0
+    predicted: float = 0.0
+
+
+@dataclass
+class _PendingCommand:
+    """A command sent to the controller that did not complete yet."""
+
+    future: Future
+    sent: float
+    arrival: float  # predicted completion, in time.monotonic() seconds
+    commands: List[bytes]  # unframed commands executed under the same ID
+    planned: float = 0.0
+    size: int = 0  # bytes sent for the commands
+    on_progress: Optional[ProgressCallback] = None
+    segment: Optional[int] = None  # last segment of a program reported
+
+
+@dataclass
+class MotionSegment:
+    """One segment of a motion program.
+
+    Args:
+        direction (Direction): Direction of the segment.
+        steps (int): Steps to move, or the servo angle for rolls.
+        speed (Union[SpeedMode, int]): Speed of the segment. Defaults to
+            `SpeedMode.NORMAL`.
+    """
+
+    direction: Direction
+    steps: int
+    speed: Union[SpeedMode, int] = SpeedMode.NORMAL
 
 
 class Scanner:
     """Communication interface with the scanner.
 
+    The scanner keeps track of the absolute position of the stage in steps
+    from where it was connected, or from the last `set_position`, using the
+    steps the controller reports for each move. A move stopped by a limit
+    switch with a known position in ``switch_positions`` resets its axis to
+    that position.
+
     Args:
         port (int): Port to which the scanner is connected.
         baudrate (int): Baudrate of the connection. Defaults to 9600.
+        framed (bool): Wrap commands in protocol frames. Disable only for
+            controllers running firmware older than the framed protocol.
+            Defaults to True.
+        timing (Optional[TimingModel]): Initial model predicting when moves
+            complete. Defaults to the planned stepping time and the transfer
+            time at ``baudrate``.
+        calibrate (bool): Refit the timing model to every completed move.
+            Defaults to True.
+        switch_positions (Optional[Dict[Direction, int]]): Axis position, in
+            steps, at which the limit switch blocking each direction is hit.
     """
 
-    def __init__(self, port: str, baudrate: int = 9600) -> None:
+    def __init__(
+        self,
+        port: str,
+        baudrate: int = 9600,
+        framed: bool = True,
+        timing: Optional[TimingModel] = None,
+        calibrate: bool = True,
+        switch_positions: Optional[Dict[Direction, int]] = None,
+    ) -> None:
         self._baudrate = baudrate
         self._port = port
+        self._framed = framed
+        self._next_id = 0
+        self._id_lock = threading.Lock()
+        self._pending: Dict[int, _PendingCommand] = {}
+        self._outbox: Deque[Tuple[int, bytes]] = deque()  # frames not written yet
+        self._unacked: Dict[int, int] = {}  # bytes written per unacknowledged ID
+        self._executing: Set[int] = set()  # IDs written and not completed
+        self._write_lock = threading.Lock()
+        self._position = {"y": 0, "z": 0}
+        self._servos: Dict[Direction, Optional[int]] = dict.fromkeys(SERVO_RANGES)
+        self._switch_positions = dict(switch_positions or {})
+        self._switch_pressed = False
+        self._timing = timing or TimingModel(per_byte=BITS_PER_BYTE / baudrate)
+        self._calibrate = calibrate
+        self._samples = deque(maxlen=TIMING_SAMPLES)
+        self._idle_at = 0.0
+        self._completed_at = 0.0
+        self._error: Optional[Exception] = None
         self._connection = Serial()
         self._connection.port = port
         self._connection.baudrate = baudrate
+        self._connection.timeout = 0.1
         self._connection.open()
 
+        self._running = True
+        self._reader = None
+        if framed:
+            self._reader = threading.Thread(target=self._read_replies, daemon=True)
+            self._reader.start()
+
     @property
     def baudrate(self) -> int:
         """Baudrate of the connection."""
@@ -75,39 +208,507 @@ class Scanner:
     def port(self, value) -> None:
         self._port = value
 
-    def move(self, cmd: Union[str, bytes]) -> None:
+    @property
+    def position(self) -> Dict[str, int]:
+        """Absolute ``y`` (up) and ``z`` (forward) position, in steps."""
+        with self._id_lock:
+            return dict(self._position)
+
+    def set_position(self, y: Optional[int] = None, z: Optional[int] = None) -> None:
+        """Redefine the current position, e.g. after homing the stage."""
+        with self._id_lock:
+            if y is not None:
+                self._position["y"] = y
+            if z is not None:
+                self._position["z"] = z
+
+    @property
+    def servos(self) -> Dict[Direction, Optional[int]]:
+        """Last angle set on each roll servo, None until one is set."""
+        with self._id_lock:
+            return dict(self._servos)
+
+    @property
+    def limit_switch_pressed(self) -> bool:
+        """Whether the switch blocking `EVENT_SWITCH` was last reported pressed."""
+        return self._switch_pressed
+
+    @property
+    def timing(self) -> TimingModel:
+        """Model predicting when commands complete."""
+        return self._timing
+
+    @property
+    def idle_at(self) -> float:
+        """Predicted ``time.monotonic()`` at which all sent commands complete.
+
+        Read right after sending a move, this is when the move is expected to
+        arrive, e.g. to arm a camera capture instead of polling.
+        """
+        with self._id_lock:
+            return max(self._idle_at, time.monotonic())
+
+    def predict(self, cmd: Union[str, bytes]) -> float:
+        """Predicted seconds from sending a command to its completion."""
+        if isinstance(cmd, str):
+            cmd = bytes(cmd, "utf-8")
+        return self._timing.predict(
+            self._planned_duration([cmd]), self._frames_size([cmd])
+        )
+
+    def _frames_size(self, commands: List[bytes]) -> int:
+        """Bytes sent for commands, framed with an ID of the next one's length."""
+        if not self._framed:
+            return sum(len(cmd) for cmd in commands)
+        return sum(len(self.frame_command(cmd, self._next_id)) for cmd in commands)
+
+    @staticmethod
+    def _planned_duration(commands: List[bytes]) -> float:
+        """Stepping time of unframed commands, as planned."""
+
+        profiles = [parse_command(cmd) for cmd in commands]
+        return sum(profile.duration for profile in profiles if profile is not None)
+
+    def _apply(self, cmd: bytes, taken: Optional[int] = None) -> None:
+        """Update the tracked state after a command took ``taken`` steps.
+
+        Args:
+            cmd (bytes): Unframed command.
+            taken (Optional[int]): Steps reported by the controller. Defaults
+                to all steps of the command.
+        """
+
+        fields = cmd.split(b"_")
+        if len(fields) > 2 and fields[1] in (b"xRoll", b"yRoll"):
+            direction = Direction(fields[1].decode())
+            low, high = SERVO_RANGES[direction]
+            try:
+                angle = max(low, min(int(fields[2]), high))
+            except ValueError:
+                return
+            with self._id_lock:
+                self._servos[direction] = angle
+            return
+
+        profile = parse_command(cmd)
+        if profile is None:
+            return
+        dy, dz = profile.position(profile.steps if taken is None else taken)
+        with self._id_lock:
+            self._position["y"] += dy
+            self._position["z"] += dz
+
+    def _reconcile_stop(self, cmd: bytes) -> None:
+        """Snap the axis of a single-axis move stopped by a limit switch."""
+
+        profile = parse_command(cmd)
+        if isinstance(profile, MotionProfile):
+            self._snap_to_switch(profile.direction)
+
+    def _snap_to_switch(self, direction: Direction) -> None:
+        """Set the axis of ``direction`` to its limit switch's position, if known."""
+        if direction in self._switch_positions:
+            axis, _ = AXES[direction]
+            with self._id_lock:
+                self._position[axis] = self._switch_positions[direction]
+
+    def _new_command_id(self) -> int:
+        """Next command ID, wrapping around at `MAX_COMMAND_ID`."""
+        with self._id_lock:
+            command_id = self._next_id
+            self._next_id = (self._next_id + 1) % MAX_COMMAND_ID
+        return command_id
+
+    def move(
+        self,
+        cmd: Union[str, bytes],
+        callback: Optional[Callable[[MoveResult], None]] = None,
+    ) -> "Future[MoveResult]":
         """Send the command to the scanner controller.
 
+        The returned future resolves once the controller reports that the
+        command finished or hit a limit switch. Without framing the controller
+        reports nothing, so it resolves with `MoveStatus.SENT` right away.
+
         Args:
             cmd (Union[str, bytes]): Command to send to the scanner.
+            callback (Optional[Callable[[MoveResult], None]]): Called with the
+                result when the command completes, from the reply thread.
+
+        Returns:
+            Future[MoveResult]: Completion of the command.
         """
 
         if isinstance(cmd, str):
             cmd = bytes(cmd, "utf-8")
 
-        self._connection.write(cmd)
+        command_id = self._new_command_id()
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(
+                lambda f: None
+                if f.cancelled() or f.exception()
+                else callback(f.result())
+            )
 
-    @staticmethod
-    def generate_command_for_specs(
-        mode: Mode, direction: Direction, steps: int, speed: Union[SpeedMode, int]
-    ) -> bytes:
-        """Generates a command from the specified values.
+        if not self._framed:
+            with self._write_lock:
+                self._connection.write(cmd)
+            # nothing is reported back, assume the command runs to completion
+            self._apply(cmd)
+            predicted = self.predict(cmd)
+            with self._id_lock:
+                self._idle_at = max(self._idle_at, time.monotonic()) + predicted
+            future.set_result(
+                MoveResult(command_id, MoveStatus.SENT, predicted=predicted)
+            )
+            return future
+
+        self._send(command_id, future, [cmd], self.frame_command(cmd, command_id))
+        return future
+
+    def move_to(
+        self,
+        dy: int,
+        dz: int,
+        roll: Optional[int] = None,
+        roll_axis: Direction = Direction.XROLL,
+        limits: Optional[AxisLimits] = None,
+        callback: Optional[Callable[[MoveResult], None]] = None,
+    ) -> "Future[MoveResult]":
+        """Move the Y and Z axes together, and optionally roll.
+
+        Both axes arrive at the same time, following the profile planned by
+        `Scanner3D.planner.plan_line` with the scanner's `timing`. The servo is
+        set right before the steppers start, so the roll happens during the
+        move.
 
         Args:
-            mode (Mode): Operation mode. Possible values are `queue` | `queue`.
-            direction (Direction): Direction of the command.
-            steps (int): How many steps to perform.
-            speed (Union[SpeedMode, int]): Speed of the command,
+            dy (int): Steps up, negative to move down.
+            dz (int): Steps forward, negative to move backward.
+            roll (Optional[int]): Servo angle to roll to. Defaults to no roll.
+            roll_axis (Direction): Servo to roll. Defaults to `Direction.XROLL`.
+            limits (Optional[AxisLimits]): Limits of the major axis. Defaults
+                to the planner's defaults.
+            callback (Optional[Callable[[MoveResult], None]]): Called with the
+                result when the move completes, from the reply thread.
+
+        Raises:
+            RuntimeError: If the connection is not framed.
+            ValueError: If ``roll_axis`` is not a roll direction.
 
         Returns:
-            bytes: The command to execute.
+            Future[MoveResult]: Completion of the move. ``steps`` counts the
+            steps of the axis with the longer travel.
+        """
+
+        if not self._framed:
+            raise RuntimeError("Coordinated moves require the framed protocol")
+        if roll_axis not in (Direction.XROLL, Direction.YROLL):
+            raise ValueError(f"{roll_axis} is not a roll direction")
+
+        if roll is not None:
+            self.move(self.generate_command_for_specs(Mode.SINGLE, roll_axis, roll, 0))
+        move = plan_line(dy, dz, limits, timing=self._timing)
+        return self.move(move.command(), callback)
+
+    def run_program(
+        self,
+        segments: Iterable[MotionSegment],
+        on_progress: Optional[ProgressCallback] = None,
+        callback: Optional[Callable[[MoveResult], None]] = None,
+    ) -> "Future[MoveResult]":
+        """Upload a motion program and run it on the controller.
+
+        The segments are queued on the controller in one burst and executed
+        back to back, so a program pays the serial and parsing overhead once
+        instead of once per move. Programs longer than `MAX_QUEUE_SEGMENTS`
+        are split into chunks, each uploaded once the previous one finished.
+        The program ends early if a limit switch stops a segment.
+
+        Args:
+            segments (Iterable[MotionSegment]): Segments, in execution order.
+            on_progress (Optional[ProgressCallback]): Called from the reply
+                thread as ``on_progress(index, steps)`` after each segment.
+            callback (Optional[Callable[[MoveResult], None]]): Called with the
+                result when the program completes, from the reply thread.
+
+        Raises:
+            RuntimeError: If the connection is not framed.
+            ValueError: If ``segments`` is empty.
+
+        Returns:
+            Future[MoveResult]: Completion of the program, with the total steps
+            of all segments executed. ``command_id`` is the ID of the last
+            chunk.
+        """
+        if not self._framed:
+            raise RuntimeError("Motion programs require the framed protocol")
+
+        segments = list(segments)
+        if not segments:
+            raise ValueError("Motion programs must have at least one segment")
+
+        program = Future()
+        if callback is not None:
+            program.add_done_callback(
+                lambda f: None
+                if f.cancelled() or f.exception()
+                else callback(f.result())
+            )
+        started = time.monotonic()
+
+        def run_chunk(first: int, steps: int) -> None:
+            end = min(first + MAX_QUEUE_SEGMENTS, len(segments))
+
+            def progress(index: int, taken: int) -> None:
+                if on_progress is not None:
+                    on_progress(first + index, taken)
+
+            def chunk_done(chunk: Future) -> None:
+                if chunk.cancelled():
+                    program.cancel()
+                    return
+                if chunk.exception() is not None:
+                    program.set_exception(chunk.exception())
+                    return
+
+                result = chunk.result()
+                total = steps + result.steps
+                if result.status == MoveStatus.DONE and end < len(segments):
+                    run_chunk(end, total)
+                    return
+
+                elapsed = time.monotonic() - started
+                program.set_result(
+                    MoveResult(
+                        result.command_id, result.status, total, elapsed, predicted
+                    )
+                )
+
+            self._queue_segments(segments[first:end], progress).add_done_callback(
+                chunk_done
+            )
+
+        commands = [self._segment_command(segment) for segment in segments]
+        chunks = [
+            commands[first : first + MAX_QUEUE_SEGMENTS]
+            for first in range(0, len(commands), MAX_QUEUE_SEGMENTS)
+        ]
+        predicted = sum(
+            self._timing.predict(
+                self._planned_duration(chunk),
+                self._frames_size(chunk + [b"queue_run_%d_0" % len(chunk)]),
+            )
+            for chunk in chunks
+        )
+        run_chunk(0, 0)
+        return program
+
+    def _queue_segments(
+        self, segments: List[MotionSegment], on_progress: ProgressCallback
+    ) -> "Future[MoveResult]":
+        """Upload segments to the controller's queue and run them."""
+        command_id = self._new_command_id()
+        commands = [self._segment_command(segment) for segment in segments]
+        frames = [self.frame_command(cmd, command_id) for cmd in commands]
+        # the run command carries the segment count to detect lost segments
+        frames.append(self.frame_command(b"queue_run_%d_0" % len(segments), command_id))
+
+        future = Future()
+        self._send(command_id, future, commands, b"".join(frames), on_progress)
+        return future
+
+    @staticmethod
+    def _segment_command(segment: MotionSegment) -> bytes:
+        """Command queueing ``segment`` on the controller."""
+        return Scanner.generate_command_for_specs(
+            Mode.QUEUE, segment.direction, segment.steps, segment.speed
+        )
+
+    def _send(
+        self,
+        command_id: int,
+        future: Future,
+        commands: List[bytes],
+        data: bytes,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> None:
+        """Register a pending command and queue its frames for writing.
+
+        Fails ``future`` with the reader's error if the connection broke.
         """
-        command = [mode.value, direction.value, str(steps)]
-        if isinstance(speed, SpeedMode):
-            command.append(speed.speed())
-        else:
-            command.append(str(speed))
-
-        command = "_".join(command)
-        command = bytes(command, "utf-8")
-        return command
+        planned = self._planned_duration(commands)
+        predicted = self._timing.predict(planned)
+        with self._id_lock:
+            if self._error is not None:
+                future.set_exception(self._error)
+                return
+            now = time.monotonic()
+            # the frames cross the line while earlier commands run
+            start = max(self._idle_at, now + self._timing.transfer(len(data)))
+            self._idle_at = start + predicted
+            self._pending[command_id] = _PendingCommand(
+                future, now, self._idle_at, commands, planned, len(data), on_progress
+            )
+            self._outbox.append((command_id, data))
+        self._pump()
+
+    def _pump(self) -> None:
+        """Write queued frames while the controller has room to receive them.
+
+        The controller does not read while it steps, and bytes that do not fit
+        in its `RX_BUFFER_SIZE` bytes receive buffer are lost. Frames are
+        written while the unacknowledged bytes fit in the buffer, or at once
+        when the controller is idle, and otherwise wait for an ``ack`` or the
+        completion of the running commands. The frames of a program are
+        written in one burst, it is only acknowledged once all were parsed.
+        """
+        with self._write_lock:
+            while True:
+                with self._id_lock:
+                    if not self._outbox or self._error is not None:
+                        return
+                    command_id, data = self._outbox[0]
+                    buffered = sum(self._unacked.values()) + len(data)
+                    if self._executing and buffered > RX_BUFFER_SIZE:
+                        return
+                    self._outbox.popleft()
+                    self._unacked[command_id] = len(data)
+                    self._executing.add(command_id)
+                    if command_id in self._pending:
+                        self._pending[command_id].sent = time.monotonic()
+                try:
+                    self._connection.write(data)
+                except Exception as error:  # pylint: disable=broad-except
+                    self._fail_pending(error)
+                    return
+
+    def _acknowledge(self, command_id: int) -> None:
+        """Free the receive buffer space of a command the controller parsed."""
+        with self._id_lock:
+            self._unacked.pop(command_id, None)
+        self._pump()
+
+    def _complete(self, command_id: int, status: MoveStatus, steps: int) -> None:
+        """Reconcile the tracked state with a completed command."""
+        with self._id_lock:
+            self._unacked.pop(command_id, None)
+            self._executing.discard(command_id)
+            pending = self._pending.pop(command_id, None)
+            now, previous = time.monotonic(), self._completed_at
+            if pending is not None:
+                # later commands queue behind this one, shift them by its error
+                self._idle_at = (
+                    now if not self._pending else self._idle_at + now - pending.arrival
+                )
+                self._completed_at = now
+        # frames held back until the controller is idle can be written now
+        self._pump()
+        if pending is None:
+            return
+
+        # a pipelined command started once the one before it completed, its
+        # frames crossed the line in the meantime
+        pipelined = pending.sent < previous
+        started = previous if pipelined else pending.sent
+
+        if pending.segment is None and status != MoveStatus.REJECTED:
+            self._apply(pending.commands[0], steps)
+        if status == MoveStatus.STOPPED:
+            self._reconcile_stop(pending.commands[pending.segment or 0])
+
+        elapsed = now - pending.sent
+        predicted = pending.arrival - pending.sent
+        if status == MoveStatus.DONE and self._calibrate:
+            size = 0 if pipelined else pending.size
+            self._samples.append((pending.planned, size, now - started))
+            self._timing = self._timing.fit(self._samples)
+        pending.future.set_result(
+            MoveResult(command_id, status, steps, elapsed, predicted)
+        )
+
+    def _read_replies(self) -> None:
+        """Resolve pending commands from the controller's replies.
+
+        Reads time out every 0.1 s, possibly in the middle of a line, so bytes
+        are buffered until the line is complete. If the connection fails, the
+        pending commands fail with its error.
+        """
+        buffer = b""
+        while self._running:
+            try:
+                buffer += self._connection.readline()
+            except Exception as error:  # pylint: disable=broad-except
+                if self._running:
+                    self._fail_pending(error)
+                return
+
+            buffer = self._take_switch_notices(buffer)
+            if not buffer.endswith(FRAME_END):
+                continue
+            line, buffer = buffer.strip(), b""
+
+            match = _REPLY.fullmatch(line)
+            if match is None:
+                continue
+
+            command_id = int(match.group(2))
+            if match.group(1) == b"ack":
+                self._acknowledge(command_id)
+                continue
+            if match.group(1) == b"seg":
+                self._segment_done(
+                    command_id, int(match.group(3) or 0), int(match.group(4) or 0)
+                )
+                continue
+
+            status = MoveStatus(match.group(1).decode())
+            self._complete(command_id, status, int(match.group(3) or 0))
+
+    def _take_switch_notices(self, data: bytes) -> bytes:
+        """Track the limit switch from the notices in data, and remove them."""
+        for notice in _SWITCH_NOTICE.findall(data):
+            self._switch_pressed = notice == b"Down,"
+            if self._switch_pressed:
+                self._snap_to_switch(EVENT_SWITCH)
+        return _SWITCH_NOTICE.sub(b"", data)
+
+    def _fail_pending(self, error: Exception) -> None:
+        """Fail the pending commands, and those sent later, with error."""
+        with self._id_lock:
+            self._error = error
+            pending, self._pending = self._pending, {}
+            self._outbox.clear()
+            self._unacked.clear()
+            self._executing.clear()
+        for command in pending.values():
+            command.future.set_exception(error)
+
+    def _segment_done(self, command_id: int, index: int, taken: int) -> None:
+        """Track a segment of a program and report its progress."""
+        with self._id_lock:
+            pending = self._pending.get(command_id)
+        if pending is None or not 0 <= index < len(pending.commands):
+            return
+
+        pending.segment = index
+        self._apply(pending.commands[index], taken)
+        if pending.on_progress is not None:
+            pending.on_progress(index, taken)
+
+    def close(self) -> None:
+        """Stop reading replies and close the connection."""
+        self._running = False
+        if self._reader is not None:
+            self._reader.join()
+        self._connection.close()
+
+        with self._id_lock:
+            pending, self._pending = self._pending, {}
+        for command in pending.values():
+            command.future.cancel()
+
+    frame_command = staticmethod(frame_command)
+    parse_frame = staticmethod(parse_frame)
+    generate_command_for_specs = staticmethod(generate_command)
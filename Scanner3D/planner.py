@@ -0,0 +1,565 @@
+"""Acceleration planning for the scanner's stepper axes.
+
+The controller steps at a constant period per command, and a period short
+enough for long travels stalls the motor from standstill. :func:`plan_move`
+plans a trapezoidal profile instead: accelerate from a rate the axis can start
+at, cruise, and decelerate symmetrically. The ramps are approximated by a
+staircase of constant-period segments that the firmware builds from the three
+numbers of a :class:`Ramp`, so the command stays short and the predicted
+duration is exact up to the firmware's per-step overhead::
+
+    profile = plan_move(Direction.UP, 20000)
+    scanner.move(profile.command())
+
+A ramp only pays off if the stepping time it saves exceeds the time its bytes
+take on the serial line, so short moves are sent as plain commands.
+:func:`plan_line` plans moves of the Y and Z axes together the same way, the
+steps of the shorter axis being interleaved by the firmware.
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from Scanner3D.protocol import (
+    AXES,
+    BITS_PER_BYTE,
+    Direction,
+    Mode,
+    frame_command,
+    generate_command,
+)
+
+MAX_SPEED = 100
+SPEED_FACTOR = 100
+MAX_PROFILE_STAIRS = 8
+MAX_INTERVAL_US = 32766  # the firmware parses intervals into an int
+MAX_RAMP_RATE = 40_000  # the firmware squares rates in an unsigned long
+# steps per second the motors start at from standstill without stalling,
+# below the normal speed mode. Override it per axis with `AxisLimits`.
+PULL_IN_RATE = 5_000
+
+
+def step_period_us(speed: int) -> int:
+    """Duration of one step at a firmware speed value, in microseconds."""
+    half_period = int((MAX_SPEED - speed) / MAX_SPEED * SPEED_FACTOR)
+    return 2 * max(half_period, 0)
+
+
+def _interval_us(rate: float) -> int:
+    """Step period of a step rate, quantised like the firmware's delays."""
+    return min(max(2 * round(5e5 / rate), 2), MAX_INTERVAL_US)
+
+
+def _rate_interval(rate: int) -> int:
+    """Step period of an integer rate, rounded like ``rateInterval``."""
+    return 2 * ((500_000 + rate // 2) // rate)
+
+
+@dataclass(frozen=True)
+class AxisLimits:
+    """Kinematic limits of a stepper axis.
+
+    Args:
+        start_rate (float): Steps per second the axis reliably starts at from
+            standstill, its pull-in rate, e.g. `PULL_IN_RATE`.
+        max_rate (float): Highest cruise rate, in steps per second.
+        acceleration (float): Rate change per second, in steps per second².
+    """
+
+    start_rate: float
+    max_rate: float
+    acceleration: float
+
+    def __post_init__(self) -> None:
+        if not 0 < self.start_rate <= self.max_rate:
+            raise ValueError("Rates must satisfy 0 < start_rate <= max_rate")
+        if self.acceleration <= 0:
+            raise ValueError("Acceleration must be positive")
+
+
+DEFAULT_LIMITS: Dict[str, AxisLimits] = {
+    "y": AxisLimits(start_rate=PULL_IN_RATE, max_rate=20_000, acceleration=40_000),
+    "z": AxisLimits(start_rate=PULL_IN_RATE, max_rate=20_000, acceleration=40_000),
+}
+
+
+@dataclass(frozen=True)
+class StepSegment:
+    """Steps run at a constant period.
+
+    Args:
+        steps (int): Number of steps.
+        interval_us (int): Step period in microseconds.
+    """
+
+    steps: int
+    interval_us: int
+
+    @property
+    def duration(self) -> float:
+        """Seconds the segment takes."""
+        return self.steps * self.interval_us * 1e-6
+
+
+@dataclass(frozen=True)
+class Ramp:
+    """Acceleration ramp the firmware builds, like ``buildRamp``.
+
+    The rate rises linearly from the rate of ``start_interval_us`` to the
+    cruise rate in ``stairs`` constant-period stairs. Each stair runs at the
+    rate it starts from, for as many steps as ``acceleration`` takes to reach
+    the next one. Stairs that do not fit in half of the move are left out,
+    and the move then cruises at the rate the last stair reached.
+
+    Args:
+        start_interval_us (int): Step period of the first stair.
+        stairs (int): Number of stairs, at most `MAX_PROFILE_STAIRS`.
+        acceleration (int): Rate change per second, in steps per second².
+    """
+
+    start_interval_us: int
+    stairs: int
+    acceleration: int
+
+    def encode(self) -> str:
+        """The ramp as ``<start interval>.<stairs>.<acceleration>``."""
+        return f"{self.start_interval_us}.{self.stairs}.{self.acceleration}"
+
+    @classmethod
+    def parse(cls, text: bytes) -> Optional["Ramp"]:
+        """Parse an encoded ramp, None for an empty one.
+
+        Raises:
+            ValueError: If ``text`` is not an encoded ramp.
+        """
+        if not text:
+            return None
+        start_interval_us, stairs, acceleration = (int(v) for v in text.split(b"."))
+        return cls(start_interval_us, stairs, acceleration)
+
+    def build(
+        self, steps: int, cruise_interval_us: int
+    ) -> Tuple[List[StepSegment], int]:
+        """Stairs of a move and the step period it cruises at.
+
+        Uses the firmware's integer arithmetic, so the stairs are the ones the
+        controller runs.
+
+        Args:
+            steps (int): Steps of the move, or of its major axis.
+            cruise_interval_us (int): Step period the ramp accelerates to.
+
+        Returns:
+            Tuple[List[StepSegment], int]: Stairs, slowest first, and the
+            step period of the cruise.
+        """
+        stairs = min(self.stairs, MAX_PROFILE_STAIRS)
+        if min(stairs, self.start_interval_us, cruise_interval_us) <= 0:
+            return [], cruise_interval_us
+        if self.acceleration <= 0:
+            return [], cruise_interval_us
+
+        start_rate = 1_000_000 // self.start_interval_us
+        cruise_rate = min(1_000_000 // cruise_interval_us, MAX_RAMP_RATE)
+        if cruise_rate <= start_rate:
+            return [], cruise_interval_us
+
+        ramp: List[StepSegment] = []
+        ramp_steps = 0
+        low = start_rate
+        for i in range(1, stairs + 1):
+            high = start_rate + (cruise_rate - start_rate) * i // stairs
+            count = (high - low) * (high + low) // (2 * self.acceleration)
+            if count == 0 or 2 * (ramp_steps + count) > steps:
+                return ramp, _rate_interval(low)
+            ramp.append(StepSegment(count, _rate_interval(low)))
+            ramp_steps += count
+            low = high
+        return ramp, cruise_interval_us
+
+
+class _Staircase:
+    """Segments of a profile with symmetric ramps around a cruise segment.
+
+    Subclasses provide ``steps``, the steps paced by the profile,
+    ``interval_us``, the step period to cruise at, and ``ramp``.
+    """
+
+    steps: int
+    interval_us: int
+    ramp: Optional[Ramp]
+
+    def _build(self) -> Tuple[List[StepSegment], StepSegment]:
+        """Stairs and cruise segment, built like the firmware does."""
+        if self.ramp is None:
+            return [], StepSegment(self.steps, self.interval_us)
+        stairs, interval_us = self.ramp.build(self.steps, self.interval_us)
+        ramp_steps = sum(stair.steps for stair in stairs)
+        return stairs, StepSegment(self.steps - 2 * ramp_steps, interval_us)
+
+    @property
+    def stairs(self) -> List[StepSegment]:
+        """Acceleration stairs, slowest first, replayed in reverse to stop."""
+        return self._build()[0]
+
+    @property
+    def cruise(self) -> StepSegment:
+        """Segment run between the ramps."""
+        return self._build()[1]
+
+    @property
+    def segments(self) -> List[StepSegment]:
+        """All segments in execution order."""
+        stairs, cruise = self._build()
+        return stairs + [cruise] + stairs[::-1]
+
+    @property
+    def duration(self) -> float:
+        """Predicted seconds the move takes."""
+        return sum(segment.duration for segment in self.segments)
+
+    def _encode(self, *fields: str) -> bytes:
+        """Command of the fields, followed by the ramp if any."""
+        fields = fields + ((self.ramp.encode(),) if self.ramp is not None else ())
+        return bytes("_".join(fields), "utf-8")
+
+
+@dataclass
+class MotionProfile(_Staircase):
+    """A planned move of one axis.
+
+    Args:
+        direction (Direction): Direction of the move.
+        steps (int): Steps to move.
+        interval_us (int): Step period to cruise at.
+        ramp (Optional[Ramp]): Acceleration and deceleration around the
+            cruise. Defaults to none, all steps run at ``interval_us``.
+    """
+
+    direction: Direction
+    steps: int
+    interval_us: int
+    ramp: Optional[Ramp] = None
+
+    def position(self, taken: int) -> Tuple[int, int]:
+        """Y and Z offsets after ``taken`` steps.
+
+        Args:
+            taken (int): Steps, as reported by the controller.
+
+        Returns:
+            Tuple[int, int]: Steps moved up and forward.
+        """
+        axis, sign = AXES[self.direction]
+        offset = sign * min(max(taken, 0), self.steps)
+        return (offset, 0) if axis == "y" else (0, offset)
+
+    def command(self) -> bytes:
+        """Encodes the profile for the controller.
+
+        Moves without a ramp at the period of a speed value are sent as a
+        plain single command, the others look like
+        ``profile_<direction>_<steps>_<cruise interval>[_<ramp>]``, the ramp
+        being encoded by `Ramp.encode`.
+
+        Returns:
+            bytes: The command to execute.
+        """
+        speed = MAX_SPEED - self.interval_us // 2
+        if (
+            self.ramp is None
+            and 0 <= speed
+            and step_period_us(speed) == self.interval_us
+        ):
+            return generate_command(Mode.SINGLE, self.direction, self.steps, speed)
+        return self._encode(
+            "profile", self.direction.value, str(self.steps), str(self.interval_us)
+        )
+
+
+@dataclass
+class LineProfile(_Staircase):
+    """A planned move of the Y and Z axes together along a straight line.
+
+    The profile paces the major axis, the one with more steps. Steps of the
+    other axis are interleaved with Bresenham's algorithm.
+
+    Args:
+        dy (int): Steps up, negative to move down.
+        dz (int): Steps forward, negative to move backward.
+        interval_us (int): Major axis step period to cruise at.
+        ramp (Optional[Ramp]): Major axis acceleration and deceleration.
+            Defaults to none.
+    """
+
+    dy: int
+    dz: int
+    interval_us: int
+    ramp: Optional[Ramp] = None
+
+    @property
+    def steps(self) -> int:
+        """Steps of the major axis."""
+        return max(abs(self.dy), abs(self.dz))
+
+    def position(self, taken: int) -> Tuple[int, int]:
+        """Y and Z offsets after ``taken`` major axis steps.
+
+        Args:
+            taken (int): Major axis steps, as reported by the controller.
+
+        Returns:
+            Tuple[int, int]: Steps moved up and forward.
+        """
+        major, minor = self.steps, min(abs(self.dy), abs(self.dz))
+        taken = min(max(taken, 0), major)
+        minor_taken = max(0, -((major // 2 - taken * minor) // major)) if major else 0
+        if abs(self.dy) >= abs(self.dz):
+            y, z = taken, minor_taken
+        else:
+            y, z = minor_taken, taken
+        return int(math.copysign(y, self.dy)), int(math.copysign(z, self.dz))
+
+    def command(self) -> bytes:
+        """Encodes the profile for the controller.
+
+        The command looks like
+        ``line_<dy>_<dz>_<cruise interval>[_<ramp>]``.
+
+        Returns:
+            bytes: The command to execute.
+        """
+        return self._encode("line", str(self.dy), str(self.dz), str(self.interval_us))
+
+
+@dataclass
+class TimingModel:
+    """Predicts how long the controller takes to complete a command.
+
+    The prediction is ``overhead + scale * planned + per_byte * size`` where
+    ``planned`` is the stepping time of the command's profile and ``size`` the
+    bytes sent for it. ``overhead`` covers parsing and the replies, ``scale``
+    the per-step cost of the firmware loop on top of its delays and
+    ``per_byte`` the serial transfer of the command.
+
+    Args:
+        overhead (float): Seconds added to every command. Defaults to 0.
+        scale (float): Ratio of real to planned stepping time. Defaults to 1.
+        per_byte (float): Seconds per byte sent. Defaults to a byte's
+            ``BITS_PER_BYTE`` bits at 9600 baud.
+    """
+
+    overhead: float = 0.0
+    scale: float = 1.0
+    per_byte: float = BITS_PER_BYTE / 9600
+
+    def transfer(self, size: int) -> float:
+        """Seconds ``size`` bytes take to reach the controller."""
+        return self.per_byte * size
+
+    def predict(self, planned: float, size: int = 0) -> float:
+        """Predicted seconds from sending a command to its completion.
+
+        Args:
+            planned (float): Planned stepping time of the command.
+            size (int): Bytes sent for the command, 0 if they reached the
+                controller while it was busy. Defaults to 0.
+        """
+        return self.overhead + self.scale * planned + self.transfer(size)
+
+    def fit(self, samples: Iterable[Tuple[float, int, float]]) -> "TimingModel":
+        """Least-squares fit of ``(planned, size, elapsed)`` samples of real moves.
+
+        Coefficients the samples cannot tell apart, e.g. ``per_byte`` while
+        all commands have the same size, keep their value in this model.
+
+        Returns:
+            TimingModel: The fitted model.
+        """
+        samples = np.array(list(samples), dtype=float).reshape(-1, 3)
+        if samples.shape[0] == 0:
+            return TimingModel(scale=self.scale, per_byte=self.per_byte)
+
+        columns, elapsed = samples[:, :2], samples[:, 2]
+        coefficients = np.array([self.scale, self.per_byte])
+        free = np.ptp(columns, axis=0) > 1e-9
+        if free.any():
+            known = elapsed - columns[:, ~free] @ coefficients[~free]
+            centred = columns[:, free] - columns[:, free].mean(axis=0)
+            solution = np.linalg.lstsq(centred, known - known.mean(), rcond=None)[0]
+            coefficients[free] = np.maximum(solution, 0.0)
+        overhead = max(float((elapsed - columns @ coefficients).mean()), 0.0)
+        return TimingModel(overhead, float(coefficients[0]), float(coefficients[1]))
+
+
+def parse_command(cmd: bytes) -> Optional[Union[MotionProfile, LineProfile]]:
+    """Profile a stepper command executes.
+
+    Plain ``<mode>_<direction>_<steps>_<speed>`` commands run a single
+    segment at the period of their speed.
+
+    Args:
+        cmd (bytes): Unframed command.
+
+    Returns:
+        Optional[Union[MotionProfile, LineProfile]]: The profile, or None for
+        rolls and commands that do not move a stepper.
+    """
+    fields = cmd.split(b"_", 4)
+    fields += [b""] * (5 - len(fields))
+    try:
+        steps, value = int(fields[2]), int(fields[3])
+        if fields[0] == b"line":
+            return LineProfile(int(fields[1]), steps, value, Ramp.parse(fields[4]))
+
+        direction = Direction(fields[1].decode())
+        ramp = Ramp.parse(fields[4]) if fields[0] == b"profile" else None
+    except (TypeError, ValueError):
+        return None
+
+    if direction not in AXES:
+        return None
+    if fields[0] == b"profile":
+        return MotionProfile(direction, max(steps, 0), value, ramp)
+    return MotionProfile(direction, max(steps, 0), step_period_us(value))
+
+
+def _frame_size(cmd: bytes) -> int:
+    """Bytes a command takes on the line, framed with a two digit ID."""
+    return len(frame_command(cmd, 10))
+
+
+def _cheapest(
+    profiles: Iterable[_Staircase], timing: Optional[TimingModel]
+) -> _Staircase:
+    """The profile predicted to complete first, its transfer included."""
+    timing = timing or TimingModel()
+    return min(
+        profiles,
+        key=lambda profile: timing.predict(
+            profile.duration, _frame_size(profile.command())
+        ),
+    )
+
+
+def _ramps(
+    steps: int, limits: AxisLimits, max_stairs: int
+) -> List[Tuple[int, Optional[Ramp]]]:
+    """Cruise period and ramp of a move at the start rate and of a ramped one.
+
+    The bytes of a ramp do not depend on its number of stairs, and more
+    stairs follow the acceleration more closely, so ramps have
+    ``max_stairs``.
+    """
+    start = _interval_us(limits.start_rate)
+    plans: List[Tuple[int, Optional[Ramp]]] = [(start, None)]
+
+    # rate reached halfway through a triangular profile
+    peak = min(
+        limits.max_rate,
+        MAX_RAMP_RATE,
+        math.sqrt(limits.start_rate**2 + limits.acceleration * steps),
+    )
+    cruise = _interval_us(peak)
+    if max_stairs > 0 and cruise < start:
+        acceleration = max(int(limits.acceleration), 1)
+        plans.append((cruise, Ramp(start, max_stairs, acceleration)))
+    return plans
+
+
+def plan_move(
+    direction: Direction,
+    steps: int,
+    limits: Optional[AxisLimits] = None,
+    max_stairs: int = MAX_PROFILE_STAIRS,
+    timing: Optional[TimingModel] = None,
+) -> MotionProfile:
+    """Plans a trapezoidal move of a stepper axis.
+
+    The move accelerates from ``limits.start_rate`` to ``limits.max_rate``,
+    or to the highest rate it can reach and still stop in time (triangular
+    profile). It runs entirely at the start rate instead if ``timing``
+    predicts that to complete first once the bytes of the ramp are counted,
+    which is the case of short moves.
+
+    Args:
+        direction (Direction): Direction of a stepper axis.
+        steps (int): Steps to move.
+        limits (Optional[AxisLimits]): Limits of the axis. Defaults to the
+            entry of `DEFAULT_LIMITS` for the axis.
+        max_stairs (int): Maximum number of stairs per ramp. Defaults to
+            `MAX_PROFILE_STAIRS`.
+        timing (Optional[TimingModel]): Model weighing stepping time against
+            transfer time, e.g. `Scanner.timing`. Defaults to an uncalibrated
+            controller at 9600 baud.
+
+    Raises:
+        ValueError: If ``direction`` is a roll or ``steps`` is negative.
+
+    Returns:
+        MotionProfile: The planned move.
+    """
+    if direction not in AXES:
+        raise ValueError(f"{direction} is not a stepper direction")
+    if steps < 0:
+        raise ValueError("Steps must not be negative")
+    if not 0 <= max_stairs <= MAX_PROFILE_STAIRS:
+        raise ValueError(f"max_stairs must be in [0, {MAX_PROFILE_STAIRS}]")
+
+    limits = limits or DEFAULT_LIMITS[AXES[direction][0]]
+    return _cheapest(
+        (
+            MotionProfile(direction, steps, interval_us, ramp)
+            for interval_us, ramp in _ramps(steps, limits, max_stairs)
+        ),
+        timing,
+    )
+
+
+def plan_line(
+    dy: int,
+    dz: int,
+    limits: Optional[AxisLimits] = None,
+    max_stairs: int = MAX_PROFILE_STAIRS,
+    timing: Optional[TimingModel] = None,
+) -> LineProfile:
+    """Plans a coordinated move of the Y and Z axes.
+
+    Both axes arrive together, so a diagonal takes as long as its longer
+    component instead of the sum of both. Like `plan_move`, the major axis
+    ramps only if ``timing`` predicts the ramp to pay for its bytes.
+
+    Args:
+        dy (int): Steps up, negative to move down.
+        dz (int): Steps forward, negative to move backward.
+        limits (Optional[AxisLimits]): Limits of the major axis. Defaults to
+            the tighter of the `DEFAULT_LIMITS` of both axes.
+        max_stairs (int): Maximum number of stairs per ramp. Defaults to
+            `MAX_PROFILE_STAIRS`.
+        timing (Optional[TimingModel]): Model weighing stepping time against
+            transfer time. Defaults to an uncalibrated controller at 9600
+            baud.
+
+    Returns:
+        LineProfile: The planned move.
+    """
+    if not 0 <= max_stairs <= MAX_PROFILE_STAIRS:
+        raise ValueError(f"max_stairs must be in [0, {MAX_PROFILE_STAIRS}]")
+
+    if limits is None:
+        y, z = DEFAULT_LIMITS["y"], DEFAULT_LIMITS["z"]
+        limits = AxisLimits(
+            start_rate=min(y.start_rate, z.start_rate),
+            max_rate=min(y.max_rate, z.max_rate),
+            acceleration=min(y.acceleration, z.acceleration),
+        )
+    return _cheapest(
+        (
+            LineProfile(dy, dz, interval_us, ramp)
+            for interval_us, ramp in _ramps(max(abs(dy), abs(dz)), limits, max_stairs)
+        ),
+        timing,
+    )
@@ -0,0 +1,139 @@
+"""Wire format of the scanner controller's serial protocol.
+
+Commands and the enums naming their fields, and the frames wrapping them. The
+planner builds commands from these without depending on `Scanner`.
+"""
+
+from enum import Enum
+from typing import Dict, Tuple, Union
+
+PROTOCOL_VERSION = 1
+FRAME_START = b"#"
+FRAME_DELIMITER = b":"
+FRAME_END = b"\n"
+MAX_LINE_LENGTH = 128  # size of the controller's line buffer
+BITS_PER_BYTE = 10  # start, 8 data and stop bits on the serial line
+
+
+class SpeedMode(Enum):
+    """Speed modes."""
+
+    NORMAL: str = "normal"
+    FAST: str = "fast"
+
+    def speed(self) -> int:
+        """Speed value represented by the speed mode."""
+        if self == SpeedMode.NORMAL:
+            return "25"
+
+        if self == SpeedMode.FAST:
+            return "50"
+
+        return 0
+
+
+class Mode(Enum):
+    """Run modes."""
+
+    QUEUE: str = "queue"
+    SINGLE: str = "single"
+
+
+class Direction(Enum):
+    """Directions in which the scanner can move."""
+
+    UP = "up"
+    DOWN = "down"
+    FORWARD = "forward"
+    BACKWARD = "backward"
+    XROLL = "xRoll"
+    YROLL = "yRoll"
+
+
+# axis and sign of the position change of each stepper direction
+AXES: Dict[Direction, Tuple[str, int]] = {
+    Direction.UP: ("y", 1),
+    Direction.DOWN: ("y", -1),
+    Direction.FORWARD: ("z", 1),
+    Direction.BACKWARD: ("z", -1),
+}
+
+
+def frame_command(cmd: bytes, command_id: int) -> bytes:
+    """Wraps a command in a protocol frame.
+
+    Frames look like ``#<version>:<id>:<command>\\n``. The newline lets the
+    controller start executing as soon as the frame is complete.
+
+    Args:
+        cmd (bytes): Command, as generated by `generate_command`.
+        command_id (int): ID the controller acknowledges the command with.
+
+    Raises:
+        ValueError: If the frame does not fit the controller's line buffer.
+
+    Returns:
+        bytes: The framed command.
+    """
+    if FRAME_END in cmd:
+        raise ValueError("Commands must not contain a newline")
+
+    frame = b"".join(
+        [
+            FRAME_START,
+            str(PROTOCOL_VERSION).encode(),
+            FRAME_DELIMITER,
+            str(command_id).encode(),
+            FRAME_DELIMITER,
+            cmd,
+            FRAME_END,
+        ]
+    )
+    if len(frame) >= MAX_LINE_LENGTH:
+        raise ValueError(f"Frame exceeds {MAX_LINE_LENGTH - 1} bytes: {frame!r}")
+    return frame
+
+
+def parse_frame(frame: bytes) -> Tuple[int, int, bytes]:
+    """Splits a protocol frame into its version, ID and command.
+
+    Args:
+        frame (bytes): Frame, with or without its trailing newline.
+
+    Raises:
+        ValueError: If ``frame`` is not a protocol frame.
+
+    Returns:
+        Tuple[int, int, bytes]: Protocol version, command ID and command.
+    """
+    frame = frame.rstrip(b"\r\n")
+    if not frame.startswith(FRAME_START):
+        raise ValueError(f"Not a protocol frame: {frame!r}")
+
+    version, command_id, cmd = frame[1:].split(FRAME_DELIMITER, 2)
+    return int(version), int(command_id), cmd
+
+
+def generate_command(
+    mode: Mode, direction: Direction, steps: int, speed: Union[SpeedMode, int]
+) -> bytes:
+    """Generates a command from the specified values.
+
+    Args:
+        mode (Mode): Operation mode. Possible values are `queue` | `single`.
+        direction (Direction): Direction of the command.
+        steps (int): How many steps to perform.
+        speed (Union[SpeedMode, int]): Speed of the command,
+
+    Returns:
+        bytes: The command to execute.
+    """
+    command = [mode.value, direction.value, str(steps)]
+    if isinstance(speed, SpeedMode):
+        command.append(speed.speed())
+    else:
+        command.append(str(speed))
+
+    command = "_".join(command)
+    command = bytes(command, "utf-8")
+    return command
@@ -0,0 +1,394 @@
+"""Scan paths over the Y/Z plane of the stage.
+
+A scan visits a grid of stops, each one field of view apart minus the
+requested overlap. :func:`plan_raster` covers a rectangle in serpentine
+(boustrophedon) order; :func:`plan_tour` covers any set of regions of interest
+with a nearest-neighbour tour improved by 2-opt. Stops are joined by
+coordinated moves, whose duration depends on the longer of the two axis
+travels and on the bytes of their command, so tours are optimised for the
+time the timing model predicts for the moves.
+"""
+
+import dataclasses
+import math
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from Scanner3D.interface import MoveResult, MoveStatus, Scanner
+from Scanner3D.planner import AxisLimits, LineProfile, TimingModel, plan_line
+
+Point = Tuple[int, int]  # (y, z) in steps
+
+
+@dataclass(frozen=True)
+class Region:
+    """Axis-aligned rectangle of stage positions, in steps.
+
+    Args:
+        y_min (int): Lowest Y position.
+        z_min (int): Lowest Z position.
+        y_max (int): Highest Y position.
+        z_max (int): Highest Z position.
+    """
+
+    y_min: int
+    z_min: int
+    y_max: int
+    z_max: int
+
+    def __post_init__(self) -> None:
+        if self.y_min > self.y_max or self.z_min > self.z_max:
+            raise ValueError("Region minimums must not exceed its maximums")
+
+
+@dataclass
+class ScanPlan:
+    """Stops of a scan and the moves joining them.
+
+    Args:
+        start (Point): Position the scan is planned from.
+        points (List[Point]): Stops, in visiting order.
+        moves (List[LineProfile]): Move to each stop from the previous one.
+        expected_time (float): Predicted seconds for all moves and dwells.
+    """
+
+    start: Point
+    points: List[Point]
+    moves: List[LineProfile]
+    expected_time: float
+
+    def commands(self) -> List[bytes]:
+        """Commands of the moves, for `Scanner.move`."""
+        return [move.command() for move in self.moves]
+
+    def run(
+        self,
+        scanner: Scanner,
+        on_stop: Optional[Callable[[int, Point], None]] = None,
+        timeout: Optional[float] = None,
+    ) -> List[MoveResult]:
+        """Visit the stops, blocking until the scan is done.
+
+        Moves are computed from the position the scanner tracks, so a scan
+        started away from ``start`` still visits the planned stops. Without
+        ``on_stop`` nothing happens at the stops, so each move is sent while
+        the previous one runs and its transfer is hidden. The planned moves
+        are sent after the first, as they start from the planned stops.
+
+        Args:
+            scanner (Scanner): Connected scanner.
+            on_stop (Optional[Callable[[int, Point], None]]): Called with the
+                index and position of each stop once the stage arrived there.
+            timeout (Optional[float]): Seconds to wait for each move.
+
+        Returns:
+            List[MoveResult]: Results of the moves. The scan ends early at the
+            first move that does not complete. A move already sent after it
+            still runs and is waited for, but not reported.
+        """
+        if on_stop is None:
+            return self._run_pipelined(scanner, timeout)
+
+        results = []
+        for index, (y, z) in enumerate(self.points):
+            position = scanner.position
+            result = scanner.move_to(y - position["y"], z - position["z"]).result(
+                timeout
+            )
+            results.append(result)
+            if result.status != MoveStatus.DONE:
+                break
+            on_stop(index, (y, z))
+        return results
+
+    def _run_pipelined(
+        self, scanner: Scanner, timeout: Optional[float]
+    ) -> List[MoveResult]:
+        """Visit the stops, sending each move before the previous completed."""
+        if not self.points:
+            return []
+
+        position = scanner.position
+        y, z = self.points[0]
+        sent = scanner.move_to(y - position["y"], z - position["z"])
+        results = []
+        for move in self.moves[1:] + [None]:
+            following = None if move is None else scanner.move(move.command())
+            result = sent.result(timeout)
+            results.append(result)
+            if result.status != MoveStatus.DONE:
+                if following is not None:
+                    following.result(timeout)
+                break
+            sent = following
+        return results
+
+
+def _axis_stops(low: int, high: int, stride: int) -> np.ndarray:
+    """Evenly spaced stops from low to high, at most stride apart."""
+    count = math.ceil((high - low) / stride) + 1
+    return np.rint(np.linspace(low, high, count)).astype(int)
+
+
+def _strides(pitch: Union[int, Tuple[int, int]], overlap: float) -> Tuple[int, int]:
+    """Y and Z distance between neighbouring stops."""
+    if not 0 <= overlap < 1:
+        raise ValueError("Overlap must be in [0, 1)")
+
+    pitch_y, pitch_z = (pitch, pitch) if isinstance(pitch, int) else pitch
+    if pitch_y <= 0 or pitch_z <= 0:
+        raise ValueError("Pitch must be positive")
+    return max(int(pitch_y * (1 - overlap)), 1), max(int(pitch_z * (1 - overlap)), 1)
+
+
+def serpentine(
+    region: Region,
+    pitch: Union[int, Tuple[int, int]],
+    overlap: float = 0.0,
+    start: Optional[Point] = None,
+) -> List[Point]:
+    """Stops covering a region in boustrophedon order.
+
+    Rows run along Z and alternate direction, so consecutive stops are always
+    neighbours. The scan begins at the corner of the region nearest to
+    ``start``.
+
+    Args:
+        region (Region): Region to cover.
+        pitch (Union[int, Tuple[int, int]]): Field of view in steps, the same
+            for both axes or as ``(y, z)``.
+        overlap (float): Fraction of the field of view shared by neighbouring
+            stops. Defaults to 0.
+        start (Optional[Point]): Position before the scan. Defaults to the
+            lowest corner.
+
+    Returns:
+        List[Point]: Stops, in visiting order.
+    """
+    stride_y, stride_z = _strides(pitch, overlap)
+    rows = _axis_stops(region.y_min, region.y_max, stride_y)
+    columns = _axis_stops(region.z_min, region.z_max, stride_z)
+    if start is not None:
+        if abs(start[0] - rows[-1]) < abs(start[0] - rows[0]):
+            rows = rows[::-1]
+        if abs(start[1] - columns[-1]) < abs(start[1] - columns[0]):
+            columns = columns[::-1]
+
+    points = []
+    for index, y in enumerate(rows):
+        row = columns if index % 2 == 0 else columns[::-1]
+        points.extend((int(y), int(z)) for z in row)
+    return points
+
+
+def _line_timing(timing: TimingModel, dwell: float) -> TimingModel:
+    """Timing to plan lines with, without transfer when moves are pipelined."""
+    return timing if dwell else dataclasses.replace(timing, per_byte=0.0)
+
+
+def _frame_size(cmd: bytes) -> int:
+    """Bytes a command takes on the line, framed with a two digit ID."""
+    return len(Scanner.frame_command(cmd, 10))
+
+
+class _MoveCost:
+    """Predicted seconds of the coordinated moves between stops.
+
+    A move costs the predicted time of the profile of its longer travel,
+    computed once per distance, plus the transfer of the digits of both
+    travels. Signs are left out so the cost is symmetric, as 2-opt assumes.
+
+    Args:
+        timing (TimingModel): Model the moves are planned and predicted with.
+        limits (Optional[AxisLimits]): Limits passed to `plan_line`.
+    """
+
+    def __init__(self, timing: TimingModel, limits: Optional[AxisLimits]) -> None:
+        self._timing = timing
+        self._limits = limits
+        self._major_costs: Dict[int, float] = {}
+
+    def _major_cost(self, steps: int) -> float:
+        """Predicted seconds of a line of ``steps`` steps, but its digits."""
+        if steps not in self._major_costs:
+            move = plan_line(steps, 0, self._limits, timing=self._timing)
+            size = _frame_size(move.command()) - len(str(steps)) - 1
+            self._major_costs[steps] = self._timing.predict(move.duration, size)
+        return self._major_costs[steps]
+
+    def __call__(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        travels = np.abs(np.asarray(a) - np.asarray(b))
+        majors, inverse = np.unique(travels.max(axis=-1), return_inverse=True)
+        costs = np.array([self._major_cost(int(steps)) for steps in majors])
+        digits = np.floor(np.log10(np.maximum(travels, 1))) + 1
+        return costs[inverse].reshape(travels.shape[:-1]) + (
+            self._timing.per_byte * digits.sum(axis=-1)
+        )
+
+
+def _nearest_neighbour(
+    points: np.ndarray, start: np.ndarray, cost: _MoveCost
+) -> np.ndarray:
+    """Greedy tour from start, returns the visiting order of the points."""
+    order = np.empty(len(points), dtype=int)
+    visited = np.zeros(len(points), dtype=bool)
+    current = start
+    for i in range(len(points)):
+        costs = np.where(visited, np.inf, cost(points, current))
+        order[i] = int(np.argmin(costs))
+        visited[order[i]] = True
+        current = points[order[i]]
+    return order
+
+
+def _two_opt(route: np.ndarray, cost: _MoveCost, max_passes: int) -> np.ndarray:
+    """Improve an open route with a fixed first node by segment reversals.
+
+    Args:
+        route (np.ndarray): ``(n, 2)`` positions, the first one being fixed.
+        cost (_MoveCost): Cost of the moves between positions.
+        max_passes (int): Maximum number of passes over the route.
+
+    Returns:
+        np.ndarray: Indices into ``route`` in the improved order.
+    """
+    order = np.arange(len(route))
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, len(order) - 1):
+            nodes = route[order]
+            before, first = nodes[i - 1], nodes[i]
+            # reversing order[i:j + 1] replaces the edges (i - 1, i) and
+            # (j, j + 1) by (i - 1, j) and (i, j + 1), the last j has no
+            # edge after it
+            last = nodes[i + 1 :]
+            after = nodes[i + 2 :]
+            removed = cost(before, first) + np.append(cost(last[:-1], after), 0)
+            added = cost(before, last) + np.append(cost(first, after), 0)
+            gains = removed - added
+            j = int(np.argmax(gains))
+            if gains[j] > 0:
+                order[i : i + j + 2] = order[i : i + j + 2][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def _plan(
+    points: Sequence[Point],
+    start: Point,
+    timing: Optional[TimingModel],
+    dwell: float,
+    limits: Optional[AxisLimits],
+) -> ScanPlan:
+    """Moves joining the stops and the predicted time of the scan.
+
+    With a dwell, each move is sent once the previous stop is done and pays
+    for its transfer. Without, moves are pipelined and only the part of a
+    transfer the previous move does not cover adds to the scan.
+    """
+    timing = timing or TimingModel()
+    line_timing = _line_timing(timing, dwell)
+    moves = []
+    expected_time = 0.0
+    previous, covered = start, 0.0
+    for point in points:
+        move = plan_line(
+            point[0] - previous[0], point[1] - previous[1], limits, timing=line_timing
+        )
+        moves.append(move)
+        size = _frame_size(move.command())
+        if dwell:
+            expected_time += timing.predict(move.duration, size) + dwell
+        else:
+            stepping = timing.predict(move.duration)
+            expected_time += stepping + max(timing.transfer(size) - covered, 0.0)
+            covered = stepping
+        previous = point
+    return ScanPlan(start, list(points), moves, expected_time)
+
+
+def plan_raster(
+    region: Region,
+    pitch: Union[int, Tuple[int, int]],
+    overlap: float = 0.0,
+    start: Point = (0, 0),
+    timing: Optional[TimingModel] = None,
+    dwell: float = 0.0,
+    limits: Optional[AxisLimits] = None,
+) -> ScanPlan:
+    """Plans a serpentine scan of a rectangular region.
+
+    Args:
+        region (Region): Region to cover.
+        pitch (Union[int, Tuple[int, int]]): Field of view in steps, the same
+            for both axes or as ``(y, z)``.
+        overlap (float): Fraction of the field of view shared by neighbouring
+            stops. Defaults to 0.
+        start (Point): Position before the scan. Defaults to ``(0, 0)``.
+        timing (Optional[TimingModel]): Model of the move durations, e.g.
+            `Scanner.timing`. Defaults to an uncalibrated controller at 9600
+            baud.
+        dwell (float): Seconds spent at each stop, e.g. for a capture.
+            Defaults to 0.
+        limits (Optional[AxisLimits]): Limits passed to `plan_line`.
+
+    Returns:
+        ScanPlan: The scan.
+    """
+    points = serpentine(region, pitch, overlap, start)
+    return _plan(points, start, timing, dwell, limits)
+
+
+def plan_tour(
+    regions: Iterable[Region],
+    pitch: Union[int, Tuple[int, int]],
+    overlap: float = 0.0,
+    start: Point = (0, 0),
+    timing: Optional[TimingModel] = None,
+    dwell: float = 0.0,
+    limits: Optional[AxisLimits] = None,
+    max_passes: int = 20,
+) -> ScanPlan:
+    """Plans a short scan visiting several regions of interest.
+
+    The stops of all regions are gathered, duplicates removed, and ordered by
+    a nearest-neighbour tour from ``start`` that 2-opt then shortens, both
+    ranking moves by their predicted time.
+
+    Args:
+        regions (Iterable[Region]): Regions to cover.
+        pitch (Union[int, Tuple[int, int]]): Field of view in steps, the same
+            for both axes or as ``(y, z)``.
+        overlap (float): Fraction of the field of view shared by neighbouring
+            stops. Defaults to 0.
+        start (Point): Position before the scan. Defaults to ``(0, 0)``.
+        timing (Optional[TimingModel]): Model of the move durations, e.g.
+            `Scanner.timing`. Defaults to an uncalibrated controller at 9600
+            baud.
+        dwell (float): Seconds spent at each stop, e.g. for a capture.
+            Defaults to 0.
+        limits (Optional[AxisLimits]): Limits passed to `plan_line`.
+        max_passes (int): Maximum number of 2-opt passes. Defaults to 20.
+
+    Returns:
+        ScanPlan: The scan.
+    """
+    points = list(
+        dict.fromkeys(
+            point for region in regions for point in serpentine(region, pitch, overlap)
+        )
+    )
+    if not points:
+        return ScanPlan(start, [], [], 0.0)
+
+    cost = _MoveCost(_line_timing(timing or TimingModel(), dwell), limits)
+    positions = np.array(points)
+    order = _nearest_neighbour(positions, np.array(start), cost)
+    route = np.vstack([np.array(start)[None], positions[order]])
+    improved = _two_opt(route, cost, max_passes)
+    points = [points[order[i - 1]] for i in improved[1:]]
+    return _plan(points, start, timing, dwell, limits)
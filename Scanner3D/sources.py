@@ -0,0 +1,434 @@
+"""Frame sources the capture pipeline can read from.
+
+Every camera backend implements :class:`FrameSource`, so capture, display and
+analysis stages can be exercised against real cameras, recorded stacks or a
+synthetic generator without changes.
+"""
+
+import glob
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+class FrameSource(ABC):
+    """A producer of frames.
+
+    Frames are either colour images of shape ``(H, W, 3)`` in OpenCV's BGR
+    order, or raw sensor images of shape ``(H, W)`` whose mosaic is given by
+    :attr:`bayer_pattern`. Sources may reuse the arrays they return, so copy
+    frames that must outlive the next :meth:`read`.
+    """
+
+    bayer_pattern: Optional[str] = None
+
+    def open(self) -> None:
+        """Acquire the underlying device or resources."""
+
+    @abstractmethod
+    def read(self) -> Optional[np.ndarray]:
+        """Return the next frame, or None if no frame is available."""
+
+    def close(self) -> None:
+        """Release the underlying device or resources."""
+
+    def __enter__(self) -> "FrameSource":
+        self.open()
+        return self
+
+    def __exit__(self, *_args) -> None:
+        self.close()
+
+
+class OpenCVSource(FrameSource):
+    """Capture frames with ``cv2.VideoCapture``.
+
+    Args:
+        device (Union[int, str]): Device index or video path. Defaults to 0.
+    """
+
+    def __init__(self, device: Union[int, str] = 0) -> None:
+        self._device = device
+        self._capture = None
+
+    def open(self) -> None:
+        import cv2  # pylint: disable=import-outside-toplevel
+
+        if self._capture is None:
+            self._capture = cv2.VideoCapture(self._device)
+
+    def read(self) -> Optional[np.ndarray]:
+        ret, frame = self._capture.read()
+        return frame if ret else None
+
+    def close(self) -> None:
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+
+class UEyeSource(FrameSource):
+    """Capture raw frames from an IDS uEye camera through ``pyueye``.
+
+    Args:
+        device_id (int): Camera handle id. Defaults to 0.
+        aoi (Optional[Tuple[int, int, int, int]]): ``(x, y, width, height)``
+            area of interest. Defaults to the full sensor.
+        exposure (Optional[float]): Exposure in milliseconds.
+        fps (Optional[float]): Frame rate of the camera.
+        buffer_count (int): Number of sequence buffers. Defaults to 4.
+        timeout (int): Milliseconds to wait for a frame. Defaults to 1000.
+        bayer_pattern (str): Mosaic of the sensor. Defaults to ``"GB"``.
+    """
+
+    def __init__(
+        self,
+        device_id: int = 0,
+        aoi: Optional[Tuple[int, int, int, int]] = None,
+        exposure: Optional[float] = None,
+        fps: Optional[float] = None,
+        buffer_count: int = 4,
+        timeout: int = 1000,
+        bayer_pattern: str = "GB",
+    ) -> None:
+        self._device_id = device_id
+        self._aoi = aoi
+        self._exposure = exposure
+        self._fps = fps
+        self._buffer_count = buffer_count
+        self._timeout = timeout
+        self.bayer_pattern = bayer_pattern
+        self._ueye = None
+        self._h_cam = None
+        self._buffers = []
+        self._shape = None
+
+    def _check(self, ret: int) -> None:
+        """Raise if a uEye call did not succeed."""
+        if ret != self._ueye.IS_SUCCESS:
+            raise RuntimeError(f"uEye call failed with error {ret}")
+
+    def open(self) -> None:
+        from pyueye import ueye  # pylint: disable=import-outside-toplevel
+
+        self._ueye = ueye
+        self._h_cam = ueye.HIDS(self._device_id)
+        self._check(ueye.is_InitCamera(self._h_cam, None))
+        self._check(ueye.is_SetColorMode(self._h_cam, ueye.IS_CM_SENSOR_RAW8))
+
+        rect = ueye.IS_RECT()
+        if self._aoi is not None:
+            rect.s32X, rect.s32Y, rect.s32Width, rect.s32Height = (
+                ueye.int(v) for v in self._aoi
+            )
+            self._check(
+                ueye.is_AOI(
+                    self._h_cam, ueye.IS_AOI_IMAGE_SET_AOI, rect, ueye.sizeof(rect)
+                )
+            )
+        self._check(
+            ueye.is_AOI(self._h_cam, ueye.IS_AOI_IMAGE_GET_AOI, rect, ueye.sizeof(rect))
+        )
+        width, height = rect.s32Width.value, rect.s32Height.value
+        self._shape = (height, width)
+
+        for _ in range(self._buffer_count):
+            mem_ptr, mem_id = ueye.c_mem_p(), ueye.int()
+            self._check(
+                ueye.is_AllocImageMem(self._h_cam, width, height, 8, mem_ptr, mem_id)
+            )
+            self._check(ueye.is_AddToSequence(self._h_cam, mem_ptr, mem_id))
+            self._buffers.append((mem_ptr, mem_id))
+        self._check(ueye.is_InitImageQueue(self._h_cam, 0))
+
+        if self._fps is not None:
+            ueye.is_SetFrameRate(self._h_cam, ueye.double(self._fps), ueye.DOUBLE())
+        if self._exposure is not None:
+            exposure = ueye.double(self._exposure)
+            ueye.is_Exposure(
+                self._h_cam,
+                ueye.IS_EXPOSURE_CMD_SET_EXPOSURE,
+                exposure,
+                ueye.sizeof(exposure),
+            )
+        self._check(ueye.is_CaptureVideo(self._h_cam, ueye.IS_DONT_WAIT))
+
+    def read(self) -> Optional[np.ndarray]:
+        ueye = self._ueye
+        mem_ptr, mem_id = ueye.c_mem_p(), ueye.int()
+        ret = ueye.is_WaitForNextImage(self._h_cam, self._timeout, mem_ptr, mem_id)
+        if ret != ueye.IS_SUCCESS:
+            return None
+
+        height, width = self._shape
+        try:
+            data = ueye.get_data(mem_ptr, width, height, 8, width, True)
+            return np.reshape(data, self._shape).copy()
+        finally:
+            self._check(ueye.is_UnlockSeqBuf(self._h_cam, mem_id, mem_ptr))
+
+    def close(self) -> None:
+        if self._h_cam is None:
+            return
+
+        ueye = self._ueye
+        ueye.is_StopLiveVideo(self._h_cam, ueye.IS_FORCE_VIDEO_STOP)
+        for mem_ptr, mem_id in self._buffers:
+            ueye.is_FreeImageMem(self._h_cam, mem_ptr, mem_id)
+        self._buffers = []
+        ueye.is_ExitCamera(self._h_cam)
+        self._h_cam = None
+
+
+class _Pacer:
+    """Sleep so that successive ticks happen at a fixed rate."""
+
+    def __init__(self, fps: Optional[float]) -> None:
+        self._period = None if not fps else 1.0 / fps
+        self._deadline = None
+
+    def wait(self) -> None:
+        """Sleep until the next tick is due."""
+        if self._period is None:
+            return
+
+        now = time.perf_counter()
+        if self._deadline is None or now - self._deadline > self._period:
+            # first frame, or fell more than a frame behind: do not burst
+            self._deadline = now
+        elif self._deadline > now:
+            time.sleep(self._deadline - now)
+        self._deadline += self._period
+
+
+def _legacy_frame_index(path: str) -> Tuple[int, str]:
+    """Sort key for ``file<idx>Exp_...bin`` frames written by the microscope."""
+    match = re.match(r"file(\d+)", os.path.basename(path))
+    return (int(match.group(1)) if match else -1, path)
+
+
+class ReplaySource(FrameSource):
+    """Replay raw frames saved as ``.bin`` files.
+
+    Args:
+        paths (Union[str, Sequence[str]]): Directory of ``.bin`` files or an
+            explicit list of files, replayed in frame index order.
+        shape (Tuple[int, ...]): Shape of a frame, e.g. ``(2048, 2048)``.
+        dtype (np.dtype): Data type of the frames. Defaults to ``np.uint8``.
+        fps (Optional[float]): Replay rate. Defaults to as fast as possible.
+        loop (bool): Start over after the last frame. Defaults to True.
+        bayer_pattern (Optional[str]): Mosaic of single channel frames.
+            Defaults to ``"GB"``.
+    """
+
+    def __init__(
+        self,
+        paths: Union[str, Sequence[str]],
+        shape: Tuple[int, ...],
+        dtype: np.dtype = np.uint8,
+        fps: Optional[float] = None,
+        loop: bool = True,
+        bayer_pattern: Optional[str] = "GB",
+    ) -> None:
+        if isinstance(paths, str):
+            paths = glob.glob(os.path.join(paths, "*.bin"))
+        self._paths: List[str] = sorted(paths, key=_legacy_frame_index)
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        self._loop = loop
+        self._pacer = _Pacer(fps)
+        self._index = 0
+        self.bayer_pattern = bayer_pattern if len(self._shape) == 2 else None
+
+    def read(self) -> Optional[np.ndarray]:
+        if self._index == len(self._paths):
+            if not self._loop or not self._paths:
+                return None
+            self._index = 0
+
+        path = self._paths[self._index]
+        self._index += 1
+        self._pacer.wait()
+        return np.fromfile(path, dtype=self._dtype).reshape(self._shape)
+
+
+class SyntheticSource(FrameSource):
+    """Generate frames at a configurable resolution and rate.
+
+    A small pool of frames with a moving bar and sensor noise is rendered on
+    :meth:`open` and then cycled, so the generator costs almost nothing per
+    frame and can outpace any real camera.
+
+    Args:
+        width (int): Frame width. Defaults to 1920.
+        height (int): Frame height. Defaults to 1080.
+        fps (Optional[float]): Frame rate. Defaults to unpaced.
+        mode (str): ``"rgb"`` for colour frames or ``"bayer"`` for raw
+            single channel frames. Defaults to ``"rgb"``.
+        bayer_pattern (str): Mosaic of raw frames. Defaults to ``"GB"``.
+        pool_size (int): Number of distinct frames. Defaults to 8.
+        seed (int): Seed of the noise generator. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        width: int = 1920,
+        height: int = 1080,
+        fps: Optional[float] = None,
+        mode: str = "rgb",
+        bayer_pattern: str = "GB",
+        pool_size: int = 8,
+        seed: int = 0,
+    ) -> None:
+        if mode not in ("rgb", "bayer"):
+            raise ValueError(f"Unknown synthetic mode {mode!r}")
+
+        self._width = width
+        self._height = height
+        self._mode = mode
+        self._pool_size = pool_size
+        self._seed = seed
+        self._pacer = _Pacer(fps)
+        self._pool = []
+        self._index = 0
+        self.bayer_pattern = bayer_pattern if mode == "bayer" else None
+
+    def open(self) -> None:
+        rng = np.random.default_rng(self._seed)
+        gradient = np.linspace(32, 160, self._width, dtype=np.float32)
+        bar_width = max(self._width // 16, 1)
+        self._pool = []
+        for i in range(self._pool_size):
+            frame = np.broadcast_to(gradient, (self._height, self._width)).copy()
+            start = i * (self._width - bar_width) // max(self._pool_size - 1, 1)
+            frame[:, start : start + bar_width] = 230
+            if self._mode == "rgb":
+                frame = np.stack([frame * 0.8, frame, frame * 0.6], axis=-1)
+            frame += rng.normal(0, 4, frame.shape).astype(np.float32)
+            self._pool.append(np.clip(frame, 0, 255).astype(np.uint8))
+
+    def read(self) -> Optional[np.ndarray]:
+        if not self._pool:
+            self.open()
+
+        self._pacer.wait()
+        frame = self._pool[self._index]
+        self._index = (self._index + 1) % self._pool_size
+        return frame
+
+    def close(self) -> None:
+        self._pool = []
+
+
+class SwitchableSource(FrameSource):
+    """Forward reads to a source that can be replaced while capturing.
+
+    Opening and closing are left to the owner of the wrapped sources, see
+    :class:`CaptureManager`. Until a source is selected, :meth:`read` waits
+    for one instead of returning straight away, so a capture loop does not
+    spin.
+
+    Args:
+        source (Optional[FrameSource]): Initial source. Defaults to None.
+        idle_timeout (float): Seconds :meth:`read` waits for a source before
+            returning None. Defaults to 0.1.
+    """
+
+    def __init__(
+        self, source: Optional[FrameSource] = None, idle_timeout: float = 0.1
+    ) -> None:
+        self._source = source
+        self._idle_timeout = idle_timeout
+        self._selected = threading.Condition()
+
+    @property
+    def bayer_pattern(self) -> Optional[str]:
+        """Mosaic of the wrapped source."""
+        source = self._source
+        return None if source is None else source.bayer_pattern
+
+    def switch(self, source: FrameSource) -> None:
+        """Read from ``source`` from the next frame on."""
+        with self._selected:
+            self._source = source
+            self._selected.notify_all()
+
+    def read(self) -> Optional[np.ndarray]:
+        with self._selected:
+            self._selected.wait_for(
+                lambda: self._source is not None, self._idle_timeout
+            )
+            source = self._source
+        return None if source is None else source.read()
+
+
+class CaptureManager:
+    """Enumerate capture devices once and open each of them at most once.
+
+    Devices are opened lazily on first use and stay open until :meth:`close`,
+    so switching back and forth between cameras never reopens a device. The
+    pipeline reads from :attr:`active`, which follows :meth:`select` without
+    being torn down.
+
+    Args:
+        devices (Sequence[str]): Names of the devices, in index order.
+        factory (Callable[[int], FrameSource]): Creates the source of a device
+            index. Defaults to :class:`OpenCVSource`.
+    """
+
+    def __init__(
+        self,
+        devices: Sequence[str],
+        factory: Callable[[int], FrameSource] = OpenCVSource,
+    ) -> None:
+        self._devices = list(devices)
+        self._factory = factory
+        self._sources: Dict[int, FrameSource] = {}
+        self._lock = threading.Lock()
+        self._active = SwitchableSource()
+        self._selected = None
+
+    @property
+    def devices(self) -> List[str]:
+        """Names of the enumerated devices."""
+        return list(self._devices)
+
+    @property
+    def active(self) -> SwitchableSource:
+        """Source that follows the selected device."""
+        return self._active
+
+    @property
+    def selected(self) -> Optional[int]:
+        """Index of the selected device."""
+        return self._selected
+
+    def get(self, index: int) -> FrameSource:
+        """Return the opened source of a device, opening it on first use."""
+        if not 0 <= index < len(self._devices):
+            raise IndexError(f"No capture device with index {index}")
+
+        with self._lock:
+            source = self._sources.get(index)
+            if source is None:
+                source = self._factory(index)
+                source.open()
+                self._sources[index] = source
+            return source
+
+    def select(self, index: int) -> None:
+        """Switch the active source to another device."""
+        self._active.switch(self.get(index))
+        self._selected = index
+
+    def close(self) -> None:
+        """Close every opened device."""
+        with self._lock:
+            sources, self._sources = self._sources, {}
+        for source in sources.values():
+            source.close()
@@ -0,0 +1,258 @@
+"""Lossless compression of raw frames.
+
+A predictor first turns a frame into small residuals. ``"bayer"`` splits the
+mosaic into its four colour planes and replaces each pixel by its difference
+to the previous pixel of the same colour, ``"delta"`` does the same along
+whole rows. Samples of more than one byte are then split into byte planes, so
+the mostly constant high bytes compress apart from the noisy low bytes.
+Finally a codec compresses bands of rows on a thread pool, the standard
+library codecs release the GIL while they run.
+"""
+
+import lzma
+import os
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+PREDICTORS = ("none", "delta", "bayer")
+DEFAULT_CHUNK_ROWS = 256
+
+
+class Codec(ABC):
+    """A lossless byte compressor, e.g. :class:`ZlibCodec`."""
+
+    name: str
+
+    @abstractmethod
+    def encode(self, data: bytes) -> bytes:
+        """Compress ``data``."""
+
+    @abstractmethod
+    def decode(self, data: bytes) -> bytes:
+        """Decompress what :meth:`encode` returned."""
+
+
+class ZlibCodec(Codec):
+    """Deflate, fast at low levels.
+
+    Residuals look like noise, so searching them for repeated strings costs
+    time and saves little. Run length encoding is faster, smaller on noisy
+    frames, and still collapses flat backgrounds.
+
+    Args:
+        level (int): Compression level, 1 to 9. Defaults to 1.
+        strategy (int): ``zlib`` strategy. Defaults to ``zlib.Z_RLE``.
+    """
+
+    name = "zlib"
+
+    def __init__(self, level: int = 1, strategy: int = zlib.Z_RLE) -> None:
+        self.level = level
+        self.strategy = strategy
+
+    def encode(self, data: bytes) -> bytes:
+        compressor = zlib.compressobj(
+            self.level, zlib.DEFLATED, zlib.MAX_WBITS, strategy=self.strategy
+        )
+        return compressor.compress(data) + compressor.flush()
+
+    def decode(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class LzmaCodec(Codec):
+    """LZMA, smaller output for a lot more CPU time.
+
+    Args:
+        preset (int): Compression preset, 0 to 9. Defaults to 0.
+    """
+
+    name = "lzma"
+
+    def __init__(self, preset: int = 0) -> None:
+        self.preset = preset
+
+    def encode(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self.preset)
+
+    def decode(self, data: bytes) -> bytes:
+        return lzma.decompress(data)
+
+
+_CODECS: Dict[str, Callable[[], Codec]] = {
+    ZlibCodec.name: ZlibCodec,
+    LzmaCodec.name: LzmaCodec,
+}
+
+
+def register_codec(name: str, factory: Callable[[], Codec]) -> None:
+    """Make a codec available by name, to readers of the files it writes.
+
+    Args:
+        name (str): Name stored in the files, at most 8 characters.
+        factory (Callable[[], Codec]): Creates the codec.
+
+    Raises:
+        ValueError: If the name is too long.
+    """
+    if len(name) > 8:
+        raise ValueError("Codec names have at most 8 characters")
+    _CODECS[name] = factory
+
+
+def get_codec(name: str) -> Codec:
+    """Create a registered codec.
+
+    Raises:
+        ValueError: If no codec has this name.
+    """
+    try:
+        return _CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown codec {name!r}") from None
+
+
+def _planes(band: np.ndarray, predictor: str) -> List[np.ndarray]:
+    """Views of ``band`` whose neighbouring pixels are predicted."""
+    if predictor == "bayer":
+        return [band[row::2, column::2] for row in (0, 1) for column in (0, 1)]
+    return [band]
+
+
+def _residuals(plane: np.ndarray) -> np.ndarray:
+    """Differences to the previous pixel of each row, wrapping around."""
+    residuals = plane.copy()
+    np.subtract(plane[:, 1:], plane[:, :-1], out=residuals[:, 1:])
+    return residuals
+
+
+class FrameCodec:
+    """Compresses frames in bands of rows on a thread pool.
+
+    Args:
+        codec (Union[str, Codec]): Codec, or name of a registered one.
+            Defaults to ``"zlib"``.
+        predictor (str): One of :data:`PREDICTORS`. Defaults to ``"bayer"``.
+        chunk_rows (int): Rows compressed together, even to keep the mosaic
+            aligned. Defaults to 256.
+        workers (Optional[int]): Threads compressing bands. Defaults to the
+            number of CPUs.
+
+    Raises:
+        ValueError: If the codec or predictor is unknown, or ``chunk_rows`` is
+            not a positive even number.
+    """
+
+    def __init__(
+        self,
+        codec: Union[str, Codec] = "zlib",
+        predictor: str = "bayer",
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+        workers: Optional[int] = None,
+    ) -> None:
+        if predictor not in PREDICTORS:
+            raise ValueError(f"Unknown predictor {predictor!r}")
+        if chunk_rows < 2 or chunk_rows % 2:
+            raise ValueError("chunk_rows must be a positive even number")
+
+        self.codec = get_codec(codec) if isinstance(codec, str) else codec
+        self.predictor = predictor
+        self.chunk_rows = chunk_rows
+        self._workers = workers or os.cpu_count() or 1
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def __enter__(self) -> "FrameCodec":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def encode(self, frame: np.ndarray) -> bytes:
+        """Compress a frame.
+
+        Raises:
+            ValueError: If the predictor does not apply to the frame.
+        """
+        if self.predictor != "none":
+            if not np.issubdtype(frame.dtype, np.integer):
+                raise ValueError("Predictors only apply to integer frames")
+            if frame.ndim < 2:
+                raise ValueError("Predictors apply to frames of rows")
+
+        frame = np.ascontiguousarray(frame, dtype=frame.dtype.newbyteorder("<"))
+        bands = [
+            frame[start : start + self.chunk_rows]
+            for start in range(0, len(frame), self.chunk_rows)
+        ]
+        chunks = list(self._map(self._encode_band, bands))
+        table = np.array([len(chunks), self.chunk_rows], dtype="<u4")
+        lengths = np.array([len(chunk) for chunk in chunks], dtype="<u4")
+        return b"".join([table.tobytes(), lengths.tobytes()] + chunks)
+
+    def decode(
+        self, data: bytes, shape: Tuple[int, ...], dtype: np.dtype
+    ) -> np.ndarray:
+        """Decompress a frame of the given shape and dtype."""
+        count, chunk_rows = (int(value) for value in np.frombuffer(data, "<u4", 2))
+        lengths = np.frombuffer(data, "<u4", count, offset=8)
+        ends = 8 + 4 * count + np.cumsum(lengths)
+        frame = np.empty(shape, dtype=np.dtype(dtype).newbyteorder("<"))
+        bands = [
+            (frame[i * chunk_rows : (i + 1) * chunk_rows], data[end - length : end])
+            for i, (end, length) in enumerate(zip(ends, lengths))
+        ]
+        list(self._map(lambda job: self._decode_band(*job), bands))
+        return frame
+
+    def close(self) -> None:
+        """Stop the compression threads."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def _map(self, fn, jobs):
+        """Run ``fn`` on each job, on the pool if there is more than one."""
+        if len(jobs) < 2 or self._workers < 2:
+            return map(fn, jobs)
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    self._workers, thread_name_prefix="codec"
+                )
+            pool = self._pool
+        return pool.map(fn, jobs)
+
+    def _encode_band(self, band: np.ndarray) -> bytes:
+        """Predict, split into byte planes and compress rows of a frame."""
+        planes = _planes(band, self.predictor)
+        if self.predictor != "none":
+            planes = [_residuals(plane) for plane in planes]
+        samples = np.concatenate([plane.ravel() for plane in planes])
+        itemsize = samples.dtype.itemsize
+        if itemsize > 1:
+            samples = samples.view(np.uint8).reshape(-1, itemsize).T
+        return self.codec.encode(np.ascontiguousarray(samples).tobytes())
+
+    def _decode_band(self, band: np.ndarray, data: bytes) -> None:
+        """Decompress rows of a frame into ``band``."""
+        raw = np.frombuffer(self.codec.decode(data), dtype=np.uint8)
+        itemsize = band.dtype.itemsize
+        if itemsize > 1:
+            raw = np.ascontiguousarray(raw.reshape(itemsize, -1).T)
+        samples = raw.view(band.dtype)
+
+        start = 0
+        for plane in _planes(band, self.predictor):
+            values = samples[start : start + plane.size].reshape(plane.shape)
+            start += plane.size
+            if self.predictor == "none":
+                plane[...] = values
+            else:
+                np.cumsum(values, axis=1, dtype=band.dtype, out=plane)
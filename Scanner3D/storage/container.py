@@ -0,0 +1,358 @@
+"""Single-file container for the frames of a stack.
+
+Layout, little endian::
+
+    header       _HEADER, padded to DATA_ALIGNMENT bytes
+    records      frame_count frames of frame_bytes each, back to back
+    index        frame_count _INDEX entries, one per frame
+
+The header stores the frame shape, dtype and Bayer pattern. Frames have a
+fixed size, so frame ``i`` starts at ``data_offset + i * frame_bytes`` and is
+read without scanning the file. The index holds each frame's metadata and is
+appended when the writer is closed, the header then gets its offset. A file
+whose writer never closed has no index, its frames are still readable.
+
+Compressed containers name their codec and predictor in the header (see
+:mod:`Scanner3D.storage.codecs`). Their records have varying sizes and are
+stored in the order they were written, the index holds the offset and length
+of each one. Without the index their frames cannot be located.
+"""
+
+import math
+import os
+import threading
+from dataclasses import dataclass
+from typing import BinaryIO, Optional, Tuple, Union
+
+import numpy as np
+
+from Scanner3D.storage.codecs import FrameCodec
+
+MAGIC = b"S3DSTACK"
+STACK_EXTENSION = ".s3d"
+FORMAT_VERSION = 2
+DATA_ALIGNMENT = 4096  # records start on a page boundary
+MAX_DIMS = 3
+
+_HEADER = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("ndim", "<u4"),
+        ("shape", "<u8", (MAX_DIMS,)),
+        ("dtype", "S8"),
+        ("bayer", "S4"),
+        ("frame_bytes", "<u8"),
+        ("data_offset", "<u8"),
+        ("frame_count", "<u8"),
+        ("index_offset", "<u8"),
+        ("codec", "S8"),  # since version 2, empty for raw records
+        ("predictor", "S8"),
+    ]
+)
+
+_INDEX_V1 = np.dtype(
+    [
+        ("step", "<i4"),
+        ("exposure", "<f8"),
+        ("timestamp", "<f8"),
+        ("y", "<f8"),
+        ("z", "<f8"),
+    ]
+)
+
+_INDEX = np.dtype(_INDEX_V1.descr + [("offset", "<u8"), ("length", "<u8")])
+
+PathLike = Union[str, os.PathLike]
+
+
+@dataclass
+class FrameInfo:
+    """Metadata of a frame.
+
+    Args:
+        step (int): Focal step the frame was captured at. Defaults to -1.
+        exposure (float): Exposure in ms. Defaults to NaN.
+        timestamp (float): Capture time in seconds since the epoch. NaN for
+            frames reserved but never written. Defaults to NaN.
+        y (float): Stage Y position in steps. Defaults to NaN.
+        z (float): Stage Z position in steps. Defaults to NaN.
+    """
+
+    step: int = -1
+    exposure: float = math.nan
+    timestamp: float = math.nan
+    y: float = math.nan
+    z: float = math.nan
+
+
+def _read_header(file: BinaryIO) -> np.void:
+    """Read and validate the header of a container."""
+    file.seek(0)
+    raw = file.read(_HEADER.itemsize)
+    if len(raw) < _HEADER.itemsize:
+        raise ValueError("File is too short to be a stack container")
+
+    header = np.frombuffer(raw, dtype=_HEADER)[0]
+    if header["magic"] != MAGIC:
+        raise ValueError("File is not a stack container")
+    if header["version"] > FORMAT_VERSION:
+        raise ValueError(f"Unsupported container version {header['version']}")
+    return header
+
+
+class StackFileWriter:
+    """Appends frames to a new container.
+
+    Frames are written into fixed records, so several threads may write
+    frames at once: `reserve` hands out record indices in capture order and
+    `write` fills them in any order. Close the writer to append the index.
+
+    Args:
+        path (PathLike): File to create, replaced if it exists.
+        frame_shape (Tuple[int, ...]): Shape of a frame, at most 3 dimensions.
+        dtype (np.dtype): Data type of the frames.
+        bayer_pattern (Optional[str]): Mosaic of single channel frames, e.g.
+            ``"GB"``. Defaults to None.
+        codec (Optional[FrameCodec]): Compresses the frames, in the thread
+            writing them. Defaults to raw frames.
+
+    Raises:
+        ValueError: If the shape has more than 3 dimensions or the pattern
+            more than 4 letters.
+    """
+
+    def __init__(
+        self,
+        path: PathLike,
+        frame_shape: Tuple[int, ...],
+        dtype: np.dtype,
+        bayer_pattern: Optional[str] = None,
+        codec: Optional[FrameCodec] = None,
+    ) -> None:
+        frame_shape = tuple(int(size) for size in frame_shape)
+        if not 0 < len(frame_shape) <= MAX_DIMS:
+            raise ValueError(f"Frames must have 1 to {MAX_DIMS} dimensions")
+        if bayer_pattern is not None and len(bayer_pattern) > 4:
+            raise ValueError("Bayer patterns have at most 4 letters")
+
+        self.path = path
+        self.frame_shape = frame_shape
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.bayer_pattern = bayer_pattern
+        self.codec = codec
+        self.frame_bytes = int(np.prod(frame_shape)) * self.dtype.itemsize
+        self._header = np.zeros((), dtype=_HEADER)
+        self._header["magic"] = MAGIC
+        self._header["version"] = FORMAT_VERSION
+        self._header["ndim"] = len(frame_shape)
+        self._header["shape"][: len(frame_shape)] = frame_shape
+        self._header["dtype"] = self.dtype.str.encode()
+        self._header["bayer"] = (bayer_pattern or "").encode()
+        self._header["frame_bytes"] = self.frame_bytes
+        self._header["data_offset"] = DATA_ALIGNMENT
+        if codec is not None:
+            self._header["codec"] = codec.codec.name.encode()
+            self._header["predictor"] = codec.predictor.encode()
+        self._index = np.zeros(0, dtype=_INDEX)
+        self._count = 0
+        self._end = DATA_ALIGNMENT  # end of the compressed records
+        self._lock = threading.Lock()
+        self._file = open(path, "w+b")  # pylint: disable=consider-using-with
+        self._file.write(self._header.tobytes())
+
+    def __enter__(self) -> "StackFileWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def closed(self) -> bool:
+        """Whether the index was written and the file closed."""
+        return self._file.closed
+
+    def reserve(self) -> int:
+        """Index of a new record at the end of the file."""
+        with self._lock:
+            if self._file.closed:
+                raise ValueError("The container is closed")
+            index = self._count
+            self._count += 1
+            if index >= len(self._index):
+                grown = np.zeros(max(2 * len(self._index), 64), dtype=_INDEX)
+                grown["step"] = -1
+                grown[["exposure", "timestamp", "y", "z"]] = (math.nan,) * 4
+                grown[: len(self._index)] = self._index
+                self._index = grown
+        return index
+
+    def write(self, index: int, frame: np.ndarray, info: Optional[FrameInfo] = None):
+        """Write a frame into a reserved record.
+
+        Args:
+            index (int): Record returned by `reserve`.
+            frame (np.ndarray): The frame, of the container's shape.
+            info (Optional[FrameInfo]): Metadata of the frame.
+
+        Raises:
+            ValueError: If the frame does not match the container or the
+                record was not reserved.
+        """
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Frame shape {frame.shape} is not {self.frame_shape}")
+        data = np.ascontiguousarray(frame, dtype=self.dtype)
+        if self.codec is not None:
+            data = self.codec.encode(data)
+        info = info or FrameInfo()
+        with self._lock:
+            if not 0 <= index < self._count:
+                raise ValueError(f"Record {index} was not reserved")
+            if self.codec is None:
+                offset = DATA_ALIGNMENT + index * self.frame_bytes
+            else:
+                offset = self._end
+                self._end += len(data)
+            self._file.seek(offset)
+            self._file.write(data)
+            self._index[index] = (
+                info.step,
+                info.exposure,
+                info.timestamp,
+                info.y,
+                info.z,
+                offset,
+                len(data),
+            )
+
+    def append(self, frame: np.ndarray, info: Optional[FrameInfo] = None) -> int:
+        """Write a frame into a new record.
+
+        Returns:
+            int: Index of the frame.
+        """
+        index = self.reserve()
+        self.write(index, frame, info)
+        return index
+
+    def close(self) -> None:
+        """Append the index, record it in the header and close the file."""
+        with self._lock:
+            if self._file.closed:
+                return
+
+            if self.codec is None:
+                index_offset = DATA_ALIGNMENT + self._count * self.frame_bytes
+            else:
+                index_offset = self._end
+            self._file.seek(index_offset)
+            self._file.write(self._index[: self._count].tobytes())
+            self._header["frame_count"] = self._count
+            self._header["index_offset"] = index_offset
+            self._file.seek(0)
+            self._file.write(self._header.tobytes())
+            self._file.close()
+
+
+class StackFileReader:
+    """Random access to the frames of a container.
+
+    Args:
+        path (PathLike): Container to read.
+
+    Raises:
+        ValueError: If the file is not a container.
+    """
+
+    def __init__(self, path: PathLike) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "rb")  # pylint: disable=consider-using-with
+        try:
+            header = _read_header(self._file)
+        except ValueError:
+            self._file.close()
+            raise
+
+        ndim = int(header["ndim"])
+        self.frame_shape = tuple(int(size) for size in header["shape"][:ndim])
+        self.dtype = np.dtype(header["dtype"].decode())
+        self.bayer_pattern = header["bayer"].decode() or None
+        self.frame_bytes = int(header["frame_bytes"])
+        self.data_offset = int(header["data_offset"])
+        self.complete = int(header["index_offset"]) != 0
+        self.codec = None
+        if header["codec"]:
+            self.codec = FrameCodec(
+                header["codec"].decode(), header["predictor"].decode()
+            )
+        if self.complete:
+            index_dtype = _INDEX if header["version"] >= 2 else _INDEX_V1
+            self._count = int(header["frame_count"])
+            self._file.seek(int(header["index_offset"]))
+            self.index = np.frombuffer(
+                self._file.read(self._count * index_dtype.itemsize), dtype=index_dtype
+            )
+        elif self.codec is not None:
+            # compressed records are only located by the index
+            self._count = 0
+            self.index = None
+        else:
+            # the writer did not close, count the records that made it to disk
+            size = os.fstat(self._file.fileno()).st_size - self.data_offset
+            self._count = max(size, 0) // self.frame_bytes if self.frame_bytes else 0
+            self.index = None
+
+    def __enter__(self) -> "StackFileReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        """Read a frame, negative indices count from the end."""
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(f"Frame {index} out of range")
+
+        if self.codec is None:
+            offset = self.data_offset + index * self.frame_bytes
+            length = self.frame_bytes
+        else:
+            entry = self.index[index]
+            offset, length = int(entry["offset"]), int(entry["length"])
+            if not length:  # reserved, never written
+                return np.zeros(self.frame_shape, dtype=self.dtype)
+
+        with self._lock:
+            self._file.seek(offset)
+            data = self._file.read(length)
+        if self.codec is not None:
+            return self.codec.decode(data, self.frame_shape, self.dtype)
+        return np.frombuffer(data, dtype=self.dtype).reshape(self.frame_shape)
+
+    def info(self, index: int) -> Optional[FrameInfo]:
+        """Metadata of a frame, None if the writer did not close."""
+        if self.index is None:
+            return None
+        entry = self.index[index]
+        return FrameInfo(
+            int(entry["step"]),
+            float(entry["exposure"]),
+            float(entry["timestamp"]),
+            float(entry["y"]),
+            float(entry["z"]),
+        )
+
+    def close(self) -> None:
+        """Close the file."""
+        self._file.close()
+        if self.codec is not None:
+            self.codec.close()
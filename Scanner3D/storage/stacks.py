@@ -0,0 +1,211 @@
+"""Lazy ``(N, H, W)`` views of saved focal stacks.
+
+Stacks are read through memory maps, so indexing a region of interest across
+every focal step only reads the pages holding that region, and no frame is
+loaded before it is indexed. Two layouts are supported: stack containers
+(see :mod:`Scanner3D.storage.container`) and the legacy folders of one raw
+``file<idx>Exp_...bin`` file per frame. Frames of compressed containers are
+decompressed whole when indexed.
+"""
+
+import glob
+import os
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from Scanner3D.sources import _legacy_frame_index
+from Scanner3D.storage.container import STACK_EXTENSION, StackFileReader
+
+PathLike = Union[str, os.PathLike]
+
+
+class _FrameFile:
+    """A raw frame file, mapped only while it is indexed.
+
+    Legacy stacks hold thousands of files, keeping them all mapped would run
+    out of file descriptors.
+    """
+
+    def __init__(self, path: str, shape: Tuple[int, ...], dtype: np.dtype) -> None:
+        self.path = path
+        self.shape = (1,) + shape
+        self.dtype = dtype
+        expected = int(np.prod(shape)) * dtype.itemsize
+        size = os.path.getsize(path)
+        if size != expected:
+            raise ValueError(f"{path} holds {size} bytes, a frame has {expected}")
+
+    def __getitem__(self, key):
+        frame = np.memmap(self.path, dtype=self.dtype, mode="r", shape=self.shape)
+        return frame[key]
+
+
+class _EncodedFrames:
+    """Frames of a compressed container, decompressed when indexed."""
+
+    def __init__(self, reader: StackFileReader) -> None:
+        self._reader = reader
+        self.shape = (len(reader),) + reader.frame_shape
+        self.dtype = reader.dtype
+
+    def __getitem__(self, key):
+        frames, rest = key[0], key[1:]
+        if isinstance(frames, (int, np.integer)):
+            return self._reader[int(frames)][rest]
+
+        indices = np.arange(self.shape[0])[frames]
+        if indices.size == 0:
+            return np.zeros((0,) + self.shape[1:], self.dtype)[(slice(None),) + rest]
+        return np.stack([self._reader[int(i)][rest] for i in indices])
+
+
+class LazyStack:
+    """Frames of one or more files seen as a single ``(N, H, W)`` array.
+
+    Indexing reads only the frames and regions selected, e.g.
+    ``stack[:, 100:200, 300:400]`` reads a region of interest at every focal
+    step. Indexing a single uncompressed file returns a read only memory map.
+
+    Args:
+        parts (Sequence[np.ndarray]): Arrays of frames, e.g. memory maps,
+            concatenated along their first axis. Frames must have the same
+            shape and dtype.
+
+    Raises:
+        ValueError: If there are no frames or their shapes differ.
+    """
+
+    def __init__(self, parts: Sequence[np.ndarray]) -> None:
+        self._parts = [part for part in parts if part.shape[0]]
+        if not self._parts:
+            raise ValueError("The stack has no frames")
+
+        frame_shapes = {(part.shape[1:], np.dtype(part.dtype)) for part in self._parts}
+        if len(frame_shapes) > 1:
+            raise ValueError(f"Frames of different shapes: {frame_shapes}")
+
+        self._ends = np.cumsum([part.shape[0] for part in self._parts])
+        self.frame_shape = self._parts[0].shape[1:]
+        self.dtype = np.dtype(self._parts[0].dtype)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """``(N,) + frame_shape``."""
+        return (len(self),) + self.frame_shape
+
+    @property
+    def ndim(self) -> int:
+        """Number of dimensions, frames included."""
+        return len(self.shape)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the whole stack, none of which is loaded."""
+        return len(self) * int(np.prod(self.frame_shape)) * self.dtype.itemsize
+
+    def __len__(self) -> int:
+        return int(self._ends[-1])
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        frames, rest = (key[0], key[1:]) if key else (slice(None), ())
+        if len(self._parts) == 1:
+            return self._parts[0][(frames,) + rest]
+
+        if isinstance(frames, (int, np.integer)):
+            part, local = self._locate(int(frames))
+            return part[(local,) + rest]
+
+        indices = np.arange(len(self))[frames]
+        if indices.size == 0:
+            return self._parts[0][(slice(0, 0),) + rest]
+        return np.stack(
+            [part[(local,) + rest] for part, local in map(self._locate, indices)]
+        )
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        """Load the whole stack."""
+        return np.asarray(self[:], dtype=dtype)
+
+    def _locate(self, index: int) -> Tuple[np.ndarray, int]:
+        """Part holding frame ``index`` and the frame's index in it."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Frame {index} out of range")
+
+        part = int(np.searchsorted(self._ends, index, side="right"))
+        start = int(self._ends[part - 1]) if part else 0
+        return self._parts[part], index - start
+
+
+def _container_frames(path: PathLike) -> np.ndarray:
+    """All the frames of a container, memory mapped unless compressed."""
+    reader = StackFileReader(path)
+    if reader.codec is not None:
+        return _EncodedFrames(reader)
+
+    with reader:
+        count, shape, dtype = len(reader), reader.frame_shape, reader.dtype
+        offset = reader.data_offset
+    if not count:
+        return np.zeros((0,) + shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,) + shape)
+
+
+def _stack_parts(
+    path: PathLike, shape: Optional[Tuple[int, ...]], dtype: np.dtype
+) -> List[np.ndarray]:
+    """Frame arrays of a container, or of a folder of either layout."""
+    if not os.path.isdir(path):
+        return [_container_frames(path)]
+
+    containers = sorted(glob.glob(os.path.join(path, "*" + STACK_EXTENSION)))
+    if containers:
+        return [_container_frames(container) for container in containers]
+
+    if shape is None:
+        raise ValueError(f"Give the frame shape of the legacy stack {path}")
+    files = sorted(glob.glob(os.path.join(path, "*.bin")), key=_legacy_frame_index)
+    return [_FrameFile(file, tuple(shape), np.dtype(dtype)) for file in files]
+
+
+def open_stack(
+    path: PathLike,
+    shape: Optional[Tuple[int, ...]] = None,
+    dtype: np.dtype = np.uint8,
+) -> LazyStack:
+    """Lazily open a saved stack.
+
+    Args:
+        path (PathLike): Container, folder holding containers, or legacy
+            folder of ``.bin`` frames, read in frame index order.
+        shape (Optional[Tuple[int, ...]]): Shape of a legacy frame, e.g.
+            ``(2048, 2048)``. Containers record their own.
+        dtype (np.dtype): Data type of legacy frames. Defaults to
+            ``np.uint8``.
+
+    Returns:
+        LazyStack: The frames, none of them read yet.
+
+    Raises:
+        ValueError: If the stack is empty, a legacy frame does not have the
+            given shape, or the shape of legacy frames is missing.
+    """
+    return LazyStack(_stack_parts(path, shape, dtype))
+
+
+def open_scan(
+    paths: Sequence[PathLike],
+    shape: Optional[Tuple[int, ...]] = None,
+    dtype: np.dtype = np.uint8,
+) -> LazyStack:
+    """Lazily open the stacks of a scan as one stack, in the given order.
+
+    See :func:`open_stack` for the arguments.
+    """
+    return LazyStack(
+        [part for path in paths for part in _stack_parts(path, shape, dtype)]
+    )
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CoalescerStats:
+    """Counters of a :class:`CommandCoalescer`."""
+
+    submitted: int = 0
+    sent: int = 0
+    superseded: int = 0
+    failed: int = 0
+
+
+class CommandCoalescer:
+    """Sends the newest command for each parameter at a bounded rate.
+
+    UI controls submit a command per click, keyed by the parameter it sets.
+    A command still waiting when a newer one arrives for the same key is
+    dropped, so a burst of clicks sends only the final value. Keys are sent in
+    the order they first became pending.
+
+    Commands run on a worker thread, at least ``min_interval`` seconds apart.
+    A command returning a :class:`concurrent.futures.Future`, like
+    ``Scanner.move``, is waited for before the next one is sent, so the device
+    never has more than one command in flight.
+
+    Args:
+        min_interval (float): Seconds between the start of two commands.
+            Defaults to 0.05.
+        completion_timeout (float): Seconds to wait for a returned future.
+            Defaults to 5.
+        on_error (Optional[Callable[[Hashable, Exception], None]]): Called
+            with the key and the exception when a command fails. Defaults to
+            logging it.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 0.05,
+        completion_timeout: float = 5.0,
+        on_error: Optional[Callable[[Hashable, Exception], None]] = None,
+    ) -> None:
+        self._min_interval = min_interval
+        self._completion_timeout = completion_timeout
+        self._on_error = on_error
+        self._pending: "OrderedDict[Hashable, Callable[[], Any]]" = OrderedDict()
+        self._stats = CoalescerStats()
+        self._busy = False
+        self._running = True
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, key: Hashable, command: Callable[[], Any]) -> None:
+        """Schedule ``command`` as the newest value of ``key``.
+
+        Args:
+            key (Hashable): Parameter the command sets, e.g. ``"xRoll"``.
+            command (Callable[[], Any]): Sends the command, e.g. a
+                ``functools.partial`` of a device method.
+        """
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("The coalescer is closed")
+
+            self._stats.submitted += 1
+            if key in self._pending:
+                self._stats.superseded += 1
+            self._pending[key] = command
+            self._condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every pending command was sent.
+
+        Returns:
+            bool: False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._busy, timeout
+            )
+
+    def stats(self) -> CoalescerStats:
+        """Snapshot of the coalescer counters."""
+        with self._condition:
+            return CoalescerStats(**vars(self._stats))
+
+    def close(self, flush: bool = True) -> None:
+        """Stop the worker, after sending pending commands if ``flush``."""
+        if flush:
+            self.flush()
+        with self._condition:
+            self._running = False
+            self._pending.clear()
+            self._condition.notify_all()
+        self._worker.join()
+
+    def _run(self) -> None:
+        """Send pending commands oldest key first, one at a time."""
+        last_sent = float("-inf")
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or not self._running)
+                if not self._running:
+                    return
+
+            # let newer values of the pending keys arrive until the rate allows
+            delay = last_sent + self._min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            with self._condition:
+                if not self._pending:
+                    continue
+                key, command = self._pending.popitem(last=False)
+                self._busy = True
+
+            last_sent = time.monotonic()
+            try:
+                result = command()
+                if isinstance(result, Future):
+                    result.result(self._completion_timeout)
+            except FutureTimeoutError:
+                failed = False  # the device is slow, keep sending
+            except Exception as e:  # pylint: disable=broad-except
+                failed = True
+                if self._on_error is None:
+                    logger.error("Command %r failed", key, exc_info=e)
+                else:
+                    self._on_error(key, e)
+            else:
+                failed = False
+
+            with self._condition:
+                self._busy = False
+                self._stats.sent += 1
+                self._stats.failed += failed
+                self._condition.notify_all()
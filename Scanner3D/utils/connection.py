@@ -1,35 +1,112 @@
-import glob
-import sys
-from typing import List
+import threading
+from typing import Callable, List, Optional, Set, Tuple
 
-import serial
+from serial.tools.list_ports_common import ListPortInfo
 
+# USB (VID, PID) pairs of the boards our controllers run on
+KNOWN_CONTROLLER_IDS: Set[Tuple[int, int]] = {
+    (0x2341, 0x0010),  # Arduino Mega 2560
+    (0x2341, 0x0042),  # Arduino Mega 2560 R3
+    (0x2A03, 0x0042),  # Arduino Mega 2560 R3 (arduino.org)
+    (0x2341, 0x0001),  # Arduino Uno
+    (0x2341, 0x0043),  # Arduino Uno R3
+    (0x1A86, 0x7523),  # CH340 clones
+    (0x0403, 0x6001),  # FTDI FT232
+    (0x16C0, 0x0483),  # Teensy
+}
 
-def serial_ports() -> List[str]:
+_cache: Optional[List[ListPortInfo]] = None
+_cache_lock = threading.Lock()
+
+
+def _is_controller(port: ListPortInfo) -> bool:
+    """Whether the USB ids of a port match a known controller board."""
+    return (port.vid, port.pid) in KNOWN_CONTROLLER_IDS
+
+
+def _comports() -> List[ListPortInfo]:
+    """Enumerates serial ports from the platform's device metadata.
+
+    Ports are listed from sysfs on Linux, the registry on Windows and IOKit on
+    macOS, without opening any of them. pyserial picks the platform's lister
+    when ``serial.tools.list_ports`` is imported, and fails there on others.
+
+    Raises:
+        EnvironmentError: On unsupported or unknown platforms
+    """
+    try:
+        import serial.tools.list_ports  # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise EnvironmentError("Unsupported platform") from e
+    return sorted(serial.tools.list_ports.comports(), key=lambda p: p.device)
+
+
+def serial_ports(known_only: bool = False, refresh: bool = False) -> List[str]:
     """Lists serial port names.
 
+    The result of the first call is cached; pass ``refresh`` or use a
+    :class:`PortWatcher` to pick up devices plugged in later.
+
+    Args:
+        known_only (bool): Only list boards in ``KNOWN_CONTROLLER_IDS``.
+            Defaults to False.
+        refresh (bool): Enumerate the ports again. Defaults to False.
+
     Raises:
         EnvironmentError: On unsupported or unknown platforms
 
     Returns:
-        List[str]: A list of the serial ports available on the system
+        List[str]: A list of the serial ports available on the system, known
+        controllers first
     """
-    if sys.platform.startswith("win"):
-        ports = ["COM%s" % (i + 1) for i in range(256)]
-    elif sys.platform.startswith("linux") or sys.platform.startswith("cygwin"):
-        # this excludes your current terminal "/dev/tty"
-        ports = glob.glob("/dev/tty[A-Za-z]*")
-    elif sys.platform.startswith("darwin"):
-        ports = glob.glob("/dev/tty.*")
-    else:
-        raise EnvironmentError("Unsupported platform")
-
-    result = []
-    for port in ports:
-        try:
-            s = serial.Serial(port)
-            s.close()
-            result.append(port)
-        except (OSError, serial.SerialException):
-            pass
-    return result
+    global _cache  # pylint: disable=global-statement
+
+    with _cache_lock:
+        if _cache is None or refresh:
+            _cache = _comports()
+        ports = _cache
+
+    controllers = [port.device for port in ports if _is_controller(port)]
+    if known_only:
+        return controllers
+    return controllers + [port.device for port in ports if not _is_controller(port)]
+
+
+class PortWatcher(threading.Thread):
+    """Watches for serial ports being plugged in or removed.
+
+    Polling the device metadata is cheap since no port is opened, so the
+    watcher refreshes the cache of ``serial_ports`` and calls ``callback`` with
+    the new list whenever it changes.
+
+    Args:
+        callback (Callable[[List[str]], None]): Called from the watcher thread
+            with the ports, as returned by ``serial_ports``.
+        interval (float): Seconds between two polls. Defaults to 1.
+        known_only (bool): Only report known controllers. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[List[str]], None],
+        interval: float = 1.0,
+        known_only: bool = False,
+    ) -> None:
+        super().__init__(daemon=True)
+        self._callback = callback
+        self._interval = interval
+        self._known_only = known_only
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        ports = serial_ports(known_only=self._known_only)
+        while not self._stopped.wait(self._interval):
+            current = serial_ports(known_only=self._known_only, refresh=True)
+            if current != ports:
+                ports = current
+                self._callback(ports)
+
+    def stop(self) -> None:
+        """Stops watching and waits for the thread to finish."""
+        self._stopped.set()
+        self.join()
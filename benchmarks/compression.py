@@ -0,0 +1,122 @@
+"""Compression ratio against throughput for raw Bayer frames.
+
+Each codec and predictor compresses the same frames, first on one thread,
+then on a pool of threads, and writes them into a stack container the way the
+microscope saves its captures. The reported frame rates are to be compared to
+the camera's, 10 frames per second at 2048x2048 RAW8.
+
+Run from the repository root, on synthetic frames or on a saved stack::
+
+    python benchmarks/compression.py --frames 20
+    python benchmarks/compression.py --stack Stack18.10.2026_10.00.00
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from Scanner3D.sources import SyntheticSource
+from Scanner3D.storage.codecs import FrameCodec
+from Scanner3D.storage.container import StackFileWriter
+from Scanner3D.storage.stacks import open_stack
+
+CONFIGS = (
+    ("zlib", "none"),
+    ("zlib", "delta"),
+    ("zlib", "bayer"),
+    ("lzma", "bayer"),
+)
+
+
+def _report(config: str, name: str, value: float, unit: str) -> None:
+    print(f"{config:<12} {name:<30} {value:>10.2f} {unit}")
+
+
+def _frames(args: argparse.Namespace) -> List[np.ndarray]:
+    """Frames to compress, read once so the disk is not measured."""
+    if args.stack:
+        stack = open_stack(args.stack, shape=args.shape)
+        return [np.array(stack[i]) for i in range(min(len(stack), args.frames))]
+
+    source = SyntheticSource(args.size, args.size, mode="bayer", seed=args.seed)
+    return [source.read().copy() for _ in range(args.frames)]
+
+
+def bench_codec(codec: FrameCodec, frames: Sequence[np.ndarray], name: str) -> None:
+    """Ratio, compression and decompression rates of one configuration."""
+    start = time.perf_counter()
+    encoded = [codec.encode(frame) for frame in frames]
+    encode_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for frame, data in zip(frames, encoded):
+        decoded = codec.decode(data, frame.shape, frame.dtype)
+        if not np.array_equal(decoded, frame):
+            raise AssertionError(f"{name} is not lossless")
+    decode_s = time.perf_counter() - start
+
+    raw = sum(frame.nbytes for frame in frames)
+    _report(name, "compressed size", 100 * sum(map(len, encoded)) / raw, "%")
+    _report(name, "compression", raw / encode_s / 1e6, "MB/s")
+    _report(name, "compression", len(frames) / encode_s, "fps")
+    _report(name, "decompression", raw / decode_s / 1e6, "MB/s")
+
+
+def bench_container(
+    codec: Optional[FrameCodec], frames: Sequence[np.ndarray], name: str
+) -> None:
+    """Frames per second saved into a container, and bytes on disk."""
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "stack.s3d")
+        start = time.perf_counter()
+        with StackFileWriter(
+            path, frames[0].shape, frames[0].dtype, "GB", codec=codec
+        ) as writer:
+            for frame in frames:
+                writer.append(frame)
+        seconds = time.perf_counter() - start
+        size = os.path.getsize(path)
+    _report(name, "saved to a container", len(frames) / seconds, "fps")
+    _report(name, "file size", size / 1e6, "MB")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the benchmarks and print their results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--frames", type=int, default=20, help="frames per test")
+    parser.add_argument(
+        "--size", type=int, default=2048, help="side of the synthetic frames"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="synthetic noise seed")
+    parser.add_argument("--stack", default=None, help="saved stack to compress")
+    parser.add_argument(
+        "--shape",
+        type=int,
+        nargs=2,
+        default=None,
+        metavar=("HEIGHT", "WIDTH"),
+        help="frame shape of a legacy stack of .bin files",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="compression threads, all CPUs"
+    )
+    args = parser.parse_args(argv)
+
+    frames = _frames(args)
+    print(f"{len(frames)} frames of {frames[0].shape} {frames[0].dtype}")
+    bench_container(None, frames, "raw")
+    for codec_name, predictor in CONFIGS:
+        name = f"{codec_name}/{predictor}"
+        with FrameCodec(codec_name, predictor, workers=1) as codec:
+            bench_codec(codec, frames, name + " x1")
+        with FrameCodec(codec_name, predictor, workers=args.workers) as codec:
+            bench_codec(codec, frames, name)
+            bench_container(codec, frames, name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""End-to-end latency benchmark of the controllers, against their emulators.
+
+Each controller emulator is served on a pseudo-terminal, paced like the
+serial line, and driven through the unchanged ``Scanner`` and
+``ArduinoControl`` code. The benchmark reports command round trips,
+throughput and the execution time of a raster scan for each protocol mode:
+
+* ``legacy``: unframed scanner commands, which the controller only runs once
+  the line went idle, so the host has to wait for each one to finish.
+* ``framed``: framed scanner commands, one at a time or pipelined.
+* ``program``: segments uploaded to the controller's motion queue at once.
+* ``planned``: coordinated moves with planned acceleration profiles, each
+  sent while the previous one runs.
+* ``microscope``: ``ArduinoControl`` commands acknowledged by the microscope
+  controller.
+
+Run from the repository root, POSIX only::
+
+    python benchmarks/serial_latency.py --count 50
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from Scanner3D.emulator import (
+    LEGACY_IDLE_S,
+    ControllerEmulator,
+    FocalSweepEmulator,
+    PtyEmulator,
+)
+from Scanner3D.interface import Direction, MotionSegment, Scanner, SpeedMode
+from Scanner3D.scan import Region, ScanPlan, plan_raster
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), os.pardir, "Examples", "Microscope")
+)
+from ArduinoControl import ArduinoControl  # noqa: E402 pylint: disable=C0413
+
+SHORT_MOVE = b"single_up_1_50"
+SCAN_REGION = Region(0, 0, 3000, 3000)
+SCAN_PITCH = 1000
+
+
+def _report(mode: str, name: str, value: float, unit: str) -> None:
+    print(f"{mode:<11} {name:<34} {value:>10.2f} {unit}")
+
+
+def _latencies(mode: str, samples: Sequence[float]) -> None:
+    """Report the median and 95th percentile of round trips in seconds."""
+    _report(mode, "round trip, median", np.median(samples) * 1e3, "ms")
+    _report(mode, "round trip, 95th percentile", np.percentile(samples, 95) * 1e3, "ms")
+
+
+def _timed(action: Callable[[], object]) -> float:
+    """Seconds taken by ``action``."""
+    start = time.monotonic()
+    action()
+    return time.monotonic() - start
+
+
+def _wait_idle(scanner: Scanner) -> None:
+    """Wait for an unframed command to finish and the line to go idle.
+
+    The controller runs a command once the line was idle for
+    ``LEGACY_IDLE_S``, a command sent any sooner is merged into it.
+    """
+    time.sleep(max(scanner.idle_at - time.monotonic(), 0) + 2 * LEGACY_IDLE_S)
+
+
+def _axis_commands(plan: ScanPlan) -> List[bytes]:
+    """The scan as one single axis move per axis and stop, without planning."""
+    commands = []
+    previous = plan.start
+    for y, z in plan.points:
+        for delta, positive, negative in (
+            (y - previous[0], Direction.UP, Direction.DOWN),
+            (z - previous[1], Direction.FORWARD, Direction.BACKWARD),
+        ):
+            if delta:
+                direction = positive if delta > 0 else negative
+                commands.append(
+                    b"single_%s_%d_%s"
+                    % (
+                        direction.value.encode(),
+                        abs(delta),
+                        SpeedMode.NORMAL.speed().encode(),
+                    )
+                )
+        previous = (y, z)
+    return commands
+
+
+def bench_legacy(emulator: ControllerEmulator, port: str, count: int) -> None:
+    """Unframed commands, each waited for by its predicted duration."""
+    scanner = Scanner(port, framed=False)
+    try:
+        seconds = _timed(
+            lambda: [
+                (scanner.move(SHORT_MOVE), _wait_idle(scanner)) for _ in range(count)
+            ]
+        )
+        _report("legacy", "short moves per second", count / seconds, "1/s")
+
+        plan = plan_raster(SCAN_REGION, SCAN_PITCH)
+        commands = _axis_commands(plan)
+        seconds = _timed(
+            lambda: [(scanner.move(cmd), _wait_idle(scanner)) for cmd in commands]
+        )
+        _report("legacy", f"raster scan, {len(plan.points)} stops", seconds, "s")
+    finally:
+        scanner.close()
+    print(f"{'':<11} emulator position {emulator.position}")
+
+
+def bench_framed(port: str, count: int) -> None:
+    """Framed commands, one at a time, pipelined and as motion programs."""
+    scanner = Scanner(port)
+    try:
+        samples = [
+            _timed(lambda: scanner.move(SHORT_MOVE).result(5)) for _ in range(count)
+        ]
+        _latencies("framed", samples)
+
+        seconds = _timed(
+            lambda: [scanner.move(SHORT_MOVE) for _ in range(count)][-1].result(30)
+        )
+        _report("framed", "pipelined short moves per second", count / seconds, "1/s")
+
+        segments = [MotionSegment(Direction.UP, 1, 50)] * count
+        seconds = _timed(lambda: scanner.run_program(segments).result(30))
+        _report("program", "queued short moves per second", count / seconds, "1/s")
+
+        plan = plan_raster(SCAN_REGION, SCAN_PITCH, start=(0, 0))
+        commands = _axis_commands(plan)
+        seconds = _timed(lambda: [scanner.move(cmd) for cmd in commands][-1].result(60))
+        _report("framed", f"raster scan, {len(plan.points)} stops", seconds, "s")
+
+        scanner.set_position(0, 0)
+        plan = plan_raster(SCAN_REGION, SCAN_PITCH, timing=scanner.timing)
+        seconds = _timed(lambda: plan.run(scanner, timeout=60))
+        _report("planned", f"raster scan, {len(plan.points)} stops", seconds, "s")
+        _report("planned", "raster scan, predicted", plan.expected_time, "s")
+
+        seconds = _timed(
+            lambda: [scanner.move(cmd) for cmd in plan.commands()][-1].result(60)
+        )
+        _report("planned", "raster scan, pipelined", seconds, "s")
+    finally:
+        scanner.close()
+
+
+def bench_microscope(emulator: FocalSweepEmulator, port: str, count: int) -> None:
+    """Acknowledged microscope commands, parameters and focal stacks."""
+    arduino = ArduinoControl(port, verbose=False)
+    try:
+        samples = [_timed(lambda: arduino.setExposure(20000)) for _ in range(count)]
+        _latencies("microscope", samples)
+
+        seconds = _timed(lambda: [arduino.stepForward() for _ in range(count)])
+        _report("microscope", "focal steps per second", count / seconds, "1/s")
+
+        # the controller reads the next command once the stack was captured
+        seconds = _timed(lambda: (arduino.startFocalStack(), arduino.reportValues()))
+        _report("microscope", f"focal stack, {emulator.step_total} steps", seconds, "s")
+
+        arduino.startLiveView()
+        samples = [_timed(lambda: arduino.setExposure(20000)) for _ in range(3)]
+        _report("microscope", "round trip in live view", np.mean(samples) * 1e3, "ms")
+    finally:
+        arduino.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the benchmarks and print their results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--count", type=int, default=50, help="commands per test")
+    parser.add_argument(
+        "--baudrate",
+        type=int,
+        default=9600,
+        help="emulated serial line rate, 0 for no pacing",
+    )
+    args = parser.parse_args(argv)
+    baudrate = args.baudrate or None
+
+    emulator = ControllerEmulator()
+    with PtyEmulator(emulator, baudrate) as server:
+        bench_legacy(emulator, server.port, args.count)
+    with PtyEmulator(ControllerEmulator(), baudrate) as server:
+        bench_framed(server.port, args.count)
+
+    emulator = FocalSweepEmulator()
+    with PtyEmulator(emulator, baudrate) as server:
+        bench_microscope(emulator, server.port, args.count)
+
+
+if __name__ == "__main__":
+    main()
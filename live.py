@@ -4,15 +4,21 @@ import argparse
 import ctypes
 import functools
 import sys
-from typing import Callable
+import threading
+from typing import Callable, List, Optional, Tuple
 
 import cv2
 import numpy as np
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
-from numpy.lib.function_base import copy
 from PyQt5 import QtGui
-from PyQt5.QtCore import Qt, QThread  # pylint: disable=no-name-in-module
+from PyQt5.QtCore import (  # pylint: disable=no-name-in-module
+    QObject,
+    Qt,
+    QThread,
+    QTimer,
+    pyqtSignal,
+)
 from PyQt5.QtGui import (  # pylint: disable=no-name-in-module
     QFont,
     QIcon,
@@ -25,8 +31,18 @@ from PyQt5.QtMultimedia import (  # pylint: disable=no-name-in-module
     QMediaPlayer,
 )
 
-from Scanner3D.interface import Direction, Mode, Scanner, SpeedMode
-from Scanner3D.utils.connection import serial_ports
+from Scanner3D.interface import Direction, Mode, MoveResult, Scanner, SpeedMode
+from Scanner3D.planner import plan_move
+from Scanner3D.sources import (
+    CaptureManager,
+    FrameSource,
+    OpenCVSource,
+    ReplaySource,
+    SyntheticSource,
+    UEyeSource,
+)
+from Scanner3D.utils.coalescer import CommandCoalescer
+from Scanner3D.utils.connection import PortWatcher, serial_ports
 
 user32 = ctypes.windll.user32
 user32.SetProcessDPIAware()
@@ -41,41 +57,181 @@ from PyQt5.QtWidgets import (
     QWidget,
 )
 
+from utils.frame_bus import FrameBus
 from utils.queue import Queue
 
 MAX_PREDS = 50
+IDLE_SLEEP_MS = 10
 
 
 # pylint disable=missing-function-docstring
 def get_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Video Demo For Anomaly Detection")
-    return parser.parse_args()
+    parser.add_argument(
+        "--frame-bus",
+        default=None,
+        help="Name of a shared memory segment to publish frames to worker processes",
+    )
+    parser.add_argument(
+        "--source",
+        choices=["opencv", "ueye", "replay", "synthetic"],
+        default="opencv",
+        help="Frame source to capture from",
+    )
+    parser.add_argument(
+        "--replay-path", default=None, help="Directory of .bin frames to replay"
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        nargs=2,
+        default=[1920, 1080],
+        metavar=("WIDTH", "HEIGHT"),
+        help="Frame size of the replay and synthetic sources",
+    )
+    parser.add_argument(
+        "--fps", type=float, default=None, help="Rate of the replay/synthetic sources"
+    )
+    parser.add_argument(
+        "--bayer", action="store_true", help="Generate raw Bayer synthetic frames"
+    )
+    args = parser.parse_args()
+    if args.source == "replay" and args.replay_path is None:
+        parser.error("--source replay requires --replay-path")
+    return args
+
+
+def make_source(args: argparse.Namespace) -> Optional[FrameSource]:
+    """Create the frame source selected on the command line.
+
+    Returns None for OpenCV, whose cameras the window enumerates itself.
+    """
+    width, height = args.size
+    if args.source == "ueye":
+        return UEyeSource(fps=args.fps)
+    if args.source == "replay":
+        return ReplaySource(args.replay_path, shape=(height, width), fps=args.fps)
+    if args.source == "synthetic":
+        return SyntheticSource(
+            width=width,
+            height=height,
+            fps=args.fps,
+            mode="bayer" if args.bayer else "rgb",
+        )
+    return None
+
+
+def _rgb_conversion(
+    frame: np.ndarray, bayer_pattern: str
+) -> Tuple[int, Tuple[int, ...]]:
+    """OpenCV code converting a BGR or raw Bayer frame to RGB, and RGB shape."""
+    if frame.ndim == 2:
+        return getattr(cv2, f"COLOR_BAYER_{bayer_pattern}2RGB"), frame.shape + (3,)
+    return cv2.COLOR_BGR2RGB, frame.shape
+
+
+def _convert_into(code: int) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+    """Colour conversion writing into a destination array, for `Queue.put`."""
+    return lambda src, dst: cv2.cvtColor(src, code, dst=dst)
+
+
+class FramePresenter(QObject):
+    """Show the latest captured frame on a label, at most once per refresh.
+
+    Frames are submitted from the capture thread without blocking. The GUI
+    thread converts and paints only the newest one, so frames the screen could
+    not show are never converted.
+
+    Args:
+        view (QLabel): Label that displays the frames.
+        convert_fn (Callable[[np.ndarray], QPixmap]): Converts a frame for the
+            label, called on the GUI thread.
+        refresh_rate (Optional[float]): Maximum paints per second. Defaults to
+            the refresh rate of the primary screen.
+    """
+
+    _frame_pending = pyqtSignal()
+
+    def __init__(
+        self,
+        view: QLabel,
+        convert_fn: Callable[[np.ndarray], QPixmap],
+        refresh_rate: Optional[float] = None,
+    ) -> None:
+        super().__init__()
+        self._view = view
+        self._convert_fn = convert_fn
+        if refresh_rate is None:
+            screen = QApplication.primaryScreen()
+            refresh_rate = screen.refreshRate() if screen is not None else 60.0
+        self._interval_ms = max(int(1000 / refresh_rate), 1)
+        self._lock = threading.Lock()
+        self._latest = None
+        self._pending = False
+        self._frame_pending.connect(self._present, Qt.QueuedConnection)
+
+    def submit(self, frame: np.ndarray) -> None:
+        """Offer a frame for display, replacing any frame not yet painted."""
+        with self._lock:
+            self._latest = frame
+            if self._pending:
+                return
+            self._pending = True
+        self._frame_pending.emit()
+
+    def _present(self) -> None:
+        with self._lock:
+            frame, self._latest = self._latest, None
+        if frame is not None:
+            self._view.setPixmap(self._convert_fn(frame))
+        QTimer.singleShot(self._interval_ms, self._release)
+
+    def _release(self) -> None:
+        with self._lock:
+            pending = self._pending = self._latest is not None
+        if pending:
+            self._frame_pending.emit()
 
 
 class VideoThread(QThread):
     """Read video stream and store frames in a queue."""
 
     def __init__(
-        self, queue: Queue, preprocess_fn: Callable, camera_view: QLabel
+        self,
+        source: FrameSource,
+        queue: Queue,
+        presenter: FramePresenter,
+        frame_bus: Optional[FrameBus] = None,
     ) -> None:
         super().__init__()
         self._run_flag = True
+        self._source = source
         self._queue = queue
-        self._preprocess_fn = preprocess_fn
-        self._camera_view = camera_view
+        self._presenter = presenter
+        self._frame_bus = frame_bus
 
     def run(self) -> None:
-        # capture from web cam
-        cap = cv2.VideoCapture(0)
-        while self._run_flag:
-            ret, cv_img = cap.read()
-            if ret:
-                qt_img = self._preprocess_fn(cv_img)
-                self._camera_view.setPixmap(qt_img)
-                cv_img = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-                self._queue.put(cv_img)
-        # shut down capture system
-        cap.release()
+        with self._source:
+            while self._run_flag:
+                cv_img = self._source.read()
+                if cv_img is None:
+                    # no source selected, or a replay that ended
+                    self.msleep(IDLE_SLEEP_MS)
+                    continue
+
+                code, shape = _rgb_conversion(cv_img, self._source.bayer_pattern)
+                # convert once, straight into the queue slot, and share the
+                # slot with the preview: it is reused only after a full ring
+                rgb_img = self._queue.put(
+                    cv_img,
+                    transform=_convert_into(code),
+                    shape=shape,
+                )
+                if rgb_img is None:  # discarded by the queue overflow policy
+                    rgb_img = cv2.cvtColor(cv_img, code)
+                self._presenter.submit(rgb_img)
+                if self._frame_bus is not None:
+                    self._frame_bus.publish(rgb_img)
 
     def stop(self) -> None:
         """Sets run flag to False and waits for thread to finish."""
@@ -86,21 +242,22 @@ class VideoThread(QThread):
 class VideoConsumer(QThread):
     """Consume frames from a queue and perform predictions."""
 
-    def __init__(
-        self,
-        queue: Queue,
-    ) -> None:
+    def __init__(self, queue: Queue, batch_size: int = 32, stride: int = 32) -> None:
         super().__init__()
         self._run_flag = True
         self._queue = queue
+        self._batch_size = batch_size
+        self._stride = stride
 
     def run(self) -> None:
         while self._run_flag:
-            with self._queue._lock:
-                if not self._queue.full():
-                    continue
+            batch = self._queue.wait_batch(
+                size=self._batch_size, stride=self._stride, timeout=0.1
+            )
+            if batch is None:
+                continue
 
-                batch = copy(list(reversed(self._queue.get())))
+            batch = batch[::-1]
 
     def stop(self) -> None:
         """Sets run flag to False and waits for thread to finish."""
@@ -123,12 +280,27 @@ class Window(QWidget):
     https://codeloop.org/python-how-to-create-media-player-in-pyqt5/
     """
 
+    ports_changed = pyqtSignal(list)
+    position_changed = pyqtSignal(str)
+
     def __init__(
         self,
+        source: Optional[FrameSource] = None,
+        frame_bus_name: Optional[str] = None,
     ) -> None:
         super().__init__()
 
-        self.camera = None
+        if source is None:
+            devices = [
+                camera.description() for camera in QCameraInfo.availableCameras()
+            ]
+            self.capture_manager = CaptureManager(devices, factory=OpenCVSource)
+        else:
+            self.capture_manager = CaptureManager(
+                [type(source).__name__], factory=lambda _: source
+            )
+        self._preview = None
+        self.frame_bus = None if frame_bus_name is None else FrameBus(frame_bus_name)
         self.current_camera_name = None
 
         self.frames_queue = Queue(max_size=32)
@@ -145,6 +317,9 @@ class Window(QWidget):
         self.setWindowIcon(QIcon("player.png"))
 
         self._baudrate = 9600
+        self._scanner = None
+        # roll clicks keep only the newest angle of each servo
+        self._commands = CommandCoalescer()
 
         p = self.palette()
         p.setColor(QPalette.Window, Qt.black)
@@ -159,10 +334,8 @@ class Window(QWidget):
     def init_ui(self) -> None:
         """Create media player object."""
         # setup camera
-        self.available_cameras = QCameraInfo.availableCameras()
         self.camera_view = QLabel()
         self.frames_queue = Queue(max_size=32)
-        self.camera_id = None
         self.select_camera()
 
         # creating a combo box for selecting camera
@@ -170,9 +343,7 @@ class Window(QWidget):
         camera_selector.setStatusTip("Choose camera")
         camera_selector.setToolTip("Select Camera")
         camera_selector.setToolTipDuration(2500)
-        camera_selector.addItems(
-            [camera.description() for camera in self.available_cameras]
-        )
+        camera_selector.addItems(self.capture_manager.devices)
         camera_selector.currentIndexChanged.connect(self.select_camera)
 
         # buttons grid
@@ -193,25 +364,55 @@ class Window(QWidget):
         self.serial_list_widget.activated.connect(self._serial_list_clicked)
         self._serial_list_clicked(0)
 
+        self.ports_changed.connect(self._update_ports)
+        self._port_watcher = PortWatcher(self.ports_changed.emit)
+        self._port_watcher.start()
+
+        # stage position
+        self.position_label = QLabel()
+        self.position_label.setStyleSheet("color: white")
+        self.position_label.setFont(QFont("Arial", 14))
+        self.position_changed.connect(self.position_label.setText)
+
         # create grid layout
         gridLayout = QGridLayout()
         gridLayout.addWidget(buttons_grid_widget, 2, 8, 3, 3)
+        gridLayout.addWidget(self.position_label, 5, 8, 1, 3)
         # set widgets to the hbox layout
         gridLayout.addWidget(self.serial_list_widget, 0, 0, 1, 2)
+        gridLayout.addWidget(camera_selector, 0, 2, 1, 2)
         gridLayout.addWidget(self.camera_view, 1, 0, 5, 5)
 
         self.setLayout(gridLayout)
 
         # create the video capture thread
+        self.presenter = FramePresenter(
+            view=self.camera_view, convert_fn=self.convert_cv_qt
+        )
         self.thread = VideoThread(
+            source=self.capture_manager.active,
             queue=self.frames_queue,
-            preprocess_fn=self.convert_cv_qt,
-            camera_view=self.camera_view,
+            presenter=self.presenter,
+            frame_bus=self.frame_bus,
         )
         self._video_consumer = VideoConsumer(queue=self.frames_queue)
         self.thread.start()
         # self._video_consumer.start()
 
+    def closeEvent(self, event) -> None:  # pylint: disable=invalid-name
+        """Stop the capture pipeline before the window closes."""
+        self.thread.stop()
+        if self._video_consumer.isRunning():
+            self._video_consumer.stop()
+        self.capture_manager.close()
+        self._port_watcher.stop()
+        self._commands.close(flush=False)
+        if self._scanner is not None:
+            self._scanner.close()
+        if self.frame_bus is not None:
+            self.frame_bus.close()
+        super().closeEvent(event)
+
     def _setup_buttons(self):
         dirs = ["up", "down", "forward", "backward", "xRoll", "yRoll"]
         modes = ["normal", "fast"]
@@ -234,6 +435,14 @@ class Window(QWidget):
                     )
                     texts[" ".join([mode, dir])] = text
 
+                elif SpeedMode(mode) == SpeedMode.FAST:
+                    # accelerate instead of starting at the fast rate
+                    message = plan_move(Direction(dir), 10000).command()
+
+                    button.clicked.connect(
+                        functools.partial(self._move, action=message)
+                    )
+
                 else:
                     message = Scanner.generate_command_for_specs(
                         mode=Mode.SINGLE,
@@ -270,7 +479,16 @@ class Window(QWidget):
         return gridLayout
 
     def _move(self, action) -> None:
-        self._scanner.move(action)
+        self._scanner.move(action, callback=self._report_position)
+
+    def _report_position(self, _result: MoveResult) -> None:
+        """Show the tracked stage position, called from the reply thread."""
+        position = self._scanner.position
+        servos = self._scanner.servos
+        self.position_changed.emit(
+            f"Y {position['y']}  Z {position['z']}  "
+            f"X roll {servos[Direction.XROLL]}  Y roll {servos[Direction.YROLL]}"
+        )
 
     def _roll(self, edit_text: QLineEdit, dir: Direction):
         message = Scanner.generate_command_for_specs(
@@ -280,7 +498,12 @@ class Window(QWidget):
             speed=SpeedMode("normal"),
         )
         print(message)
-        self._scanner.move(message)
+        self._commands.submit(
+            dir.value,
+            functools.partial(
+                self._scanner.move, message, callback=self._report_position
+            ),
+        )
 
     def _serial_list_clicked(
         self,
@@ -290,33 +513,64 @@ class Window(QWidget):
             return
 
         port = self._ports[item]
+        if self._scanner is not None:
+            self._scanner.close()
         self._scanner = Scanner(port=port, baudrate=self._baudrate)
         print(f"Using serial {port}")
 
-    def convert_cv_qt(self, cv_img: np.ndarray) -> QPixmap:
-        """Convert from an opencv image to QPixmap."""
-        rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
+    def _update_ports(self, ports: List[str]) -> None:
+        """Refresh the serial list after a port was plugged in or removed."""
+        current = self.serial_list_widget.currentText()
+        self._ports = ports
+        self.serial_list_widget.clear()
+        self.serial_list_widget.addItems(ports)
+        if current in ports:
+            self.serial_list_widget.setCurrentIndex(ports.index(current))
+        elif ports:
+            self._serial_list_clicked(0)
+
+    def convert_cv_qt(self, rgb_image: np.ndarray) -> QPixmap:
+        """Convert from an RGB image to a QPixmap that fits the camera view.
+
+        The image is downsampled first, with area interpolation, into a buffer
+        sized to the view that is reallocated only when the view is resized.
+        """
         h, w, ch = rgb_image.shape
-        display_height, display_width = (
-            self.camera_view.height(),
-            self.camera_view.width(),
+        scale = min(self.camera_view.width() / w, self.camera_view.height() / h)
+        display_width, display_height = max(int(w * scale), 1), max(int(h * scale), 1)
+        if self._preview is None or self._preview.shape != (
+            display_height,
+            display_width,
+            ch,
+        ):
+            self._preview = np.empty(
+                (display_height, display_width, ch), dtype=rgb_image.dtype
+            )
+
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        cv2.resize(
+            rgb_image,
+            (display_width, display_height),
+            dst=self._preview,
+            interpolation=interpolation,
         )
-        bytes_per_line = ch * w
+        bytes_per_line = ch * display_width
         convert_to_Qt_format = QtGui.QImage(
-            rgb_image.data, w, h, bytes_per_line, QtGui.QImage.Format_RGB888
+            self._preview.data,
+            display_width,
+            display_height,
+            bytes_per_line,
+            QtGui.QImage.Format_RGB888,
         )
-        p = convert_to_Qt_format.scaled(
-            display_width, display_height, Qt.KeepAspectRatio
-        )
-        return QPixmap.fromImage(p)
+        return QPixmap.fromImage(convert_to_Qt_format)
 
     def select_camera(self, camera=0) -> None:
-        """Select camera to display."""
-        # getting the selected camera
-        self.camera = cv2.VideoCapture(camera)
+        """Select camera to display, without restarting the capture thread."""
+        if not self.capture_manager.devices:
+            return
 
-        # getting current camera name
-        self.current_camera_name = self.available_cameras[camera].description()
+        self.capture_manager.select(camera)
+        self.current_camera_name = self.capture_manager.devices[camera]
 
     def play_video(self) -> None:
         """Change the state of the media player."""
@@ -350,6 +604,6 @@ if __name__ == "__main__":
     args = get_args()
 
     app = QApplication(sys.argv)
-    window = Window()
+    window = Window(source=make_source(args), frame_bus_name=args.frame_bus)
 
     sys.exit(app.exec_())
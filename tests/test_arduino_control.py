@@ -0,0 +1,62 @@
+"""Tests of the focal sweep controller's reply handling, on a pseudo-terminal."""
+
+import os
+import sys
+import threading
+import time
+import tty
+
+import pytest
+from serial import SerialException
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), os.pardir, "Examples", "Microscope")
+)
+from ArduinoControl import ArduinoControl  # noqa: E402 pylint: disable=C0413
+
+
+@pytest.fixture(name="board")
+def fixture_board():
+    """A connection to the master end of a raw pty, the board side."""
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    control = ArduinoControl(os.ttyname(slave), connect_timeout=0, verbose=False)
+    yield control, master
+    control.close()
+    for fd in (master, slave):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def _reply_later(master: int, *chunks: bytes) -> None:
+    """Write chunks further apart than the read timeout, from a thread."""
+
+    def write() -> None:
+        for chunk in chunks:
+            time.sleep(0.25)
+            os.write(master, chunk)
+
+    threading.Thread(target=write, daemon=True).start()
+
+
+def test_reply_split_across_reads(board):
+    control, master = board
+    _reply_later(master, b"Expo", b"sure: 20000\r\nok:pe2", b"0000\r\n")
+
+    reply = control.request("pe20000", timeout=2)
+
+    assert reply.acknowledged
+    assert reply.lines == ["Exposure: 20000"]
+    assert reply.values == {"Exposure": 20000}
+
+
+def test_broken_connection_raises_from_request(board):
+    control, master = board
+    threading.Timer(0.2, os.close, (master,)).start()
+
+    with pytest.raises(SerialException):
+        control.request("pe20000", timeout=2)
+    with pytest.raises(SerialException):
+        control.request("pe20000")
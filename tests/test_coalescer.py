@@ -0,0 +1,85 @@
+"""Tests of the UI command coalescer."""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from Scanner3D.utils.coalescer import CommandCoalescer
+
+
+@pytest.fixture(name="coalescer")
+def fixture_coalescer():
+    coalescer = CommandCoalescer(min_interval=0)
+    yield coalescer
+    coalescer.close(flush=False)
+
+
+def test_later_value_replaces_pending_one(coalescer):
+    sent = []
+    release = threading.Event()
+    coalescer.submit("busy", release.wait)
+    for value in range(3):
+        coalescer.submit("x", lambda value=value: sent.append(("x", value)))
+    coalescer.submit("y", lambda: sent.append(("y", 0)))
+    release.set()
+
+    assert coalescer.flush(timeout=5)
+    assert sent == [("x", 2), ("y", 0)]
+    stats = coalescer.stats()
+    assert (stats.submitted, stats.sent, stats.superseded) == (5, 3, 2)
+
+
+def test_commands_are_paced_by_min_interval():
+    starts = []
+    coalescer = CommandCoalescer(min_interval=0.05)
+    for key in range(4):
+        coalescer.submit(key, lambda: starts.append(time.monotonic()))
+
+    assert coalescer.flush(timeout=5)
+    coalescer.close()
+    assert len(starts) == 4
+    assert min(b - a for a, b in zip(starts, starts[1:])) >= 0.045
+
+
+def test_returned_future_is_waited_for(coalescer):
+    future = Future()
+    events = []
+    coalescer.submit("move", lambda: future)
+    coalescer.submit("light", lambda: events.append(future.done()))
+
+    time.sleep(0.05)
+    assert not events
+    future.set_result(None)
+    assert coalescer.flush(timeout=5)
+    assert events == [True]
+
+
+def test_failures_go_to_on_error():
+    errors = []
+    coalescer = CommandCoalescer(min_interval=0, on_error=lambda *e: errors.append(e))
+    error = OSError("port closed")
+
+    def fail():
+        raise error
+
+    coalescer.submit("x", fail)
+
+    assert coalescer.flush(timeout=5)
+    coalescer.close()
+    assert errors == [("x", error)]
+    assert coalescer.stats().failed == 1
+
+
+def test_failures_are_logged_by_default(coalescer, caplog):
+    def fail():
+        raise OSError("port closed")
+
+    with caplog.at_level(logging.ERROR, logger="Scanner3D.utils.coalescer"):
+        coalescer.submit("x", fail)
+        assert coalescer.flush(timeout=5)
+
+    assert "'x' failed" in caplog.text
+    assert "port closed" in caplog.text
@@ -0,0 +1,81 @@
+"""Tests of serial port discovery."""
+
+import sys
+import threading
+
+import pytest
+import serial.tools.list_ports
+from serial.tools.list_ports_common import ListPortInfo
+
+from Scanner3D.utils import connection
+from Scanner3D.utils.connection import PortWatcher, serial_ports
+
+
+def _port(device, vid=None, pid=None):
+    port = ListPortInfo(device, skip_link_detection=True)
+    port.vid, port.pid = vid, pid
+    return port
+
+
+@pytest.fixture(name="ports")
+def fixture_ports(monkeypatch):
+    """Ports the platform lists, and the number of times it was asked."""
+    listed = {"ports": [], "calls": 0}
+
+    def comports():
+        listed["calls"] += 1
+        return list(listed["ports"])
+
+    monkeypatch.setattr(serial.tools.list_ports, "comports", comports)
+    monkeypatch.setattr(connection, "_cache", None)
+    return listed
+
+
+def test_known_controllers_are_listed_first(ports):
+    ports["ports"] = [_port("/dev/ttyS0"), _port("/dev/ttyUSB0", 0x2341, 0x0043)]
+
+    assert serial_ports() == ["/dev/ttyUSB0", "/dev/ttyS0"]
+    assert serial_ports(known_only=True) == ["/dev/ttyUSB0"]
+
+
+def test_ports_are_cached_until_refreshed(ports):
+    ports["ports"] = [_port("/dev/ttyS0")]
+    assert serial_ports() == ["/dev/ttyS0"]
+
+    ports["ports"] = [_port("/dev/ttyS0"), _port("/dev/ttyS1")]
+    assert serial_ports() == ["/dev/ttyS0"]
+    assert ports["calls"] == 1
+
+    assert serial_ports(refresh=True) == ["/dev/ttyS0", "/dev/ttyS1"]
+    assert serial_ports() == ["/dev/ttyS0", "/dev/ttyS1"]
+    assert ports["calls"] == 2
+
+
+def test_unsupported_platform_raises_environment_error(ports, monkeypatch):
+    # pyserial fails to import its lister on platforms it does not support
+    monkeypatch.setitem(sys.modules, "serial.tools.list_ports", None)
+
+    with pytest.raises(EnvironmentError):
+        serial_ports()
+    assert ports["calls"] == 0
+
+
+def test_port_watcher_reports_changes(ports):
+    ports["ports"] = [_port("/dev/ttyS0")]
+    reported = []
+    changed = threading.Event()
+
+    def callback(current):
+        reported.append(current)
+        changed.set()
+
+    watcher = PortWatcher(callback, interval=0.01)
+    watcher.start()
+    try:
+        ports["ports"] = [_port("/dev/ttyS0"), _port("/dev/ttyACM0", 0x2341, 0x0042)]
+        assert changed.wait(timeout=5)
+    finally:
+        watcher.stop()
+
+    assert reported == [["/dev/ttyACM0", "/dev/ttyS0"]]
+    assert serial_ports() == ["/dev/ttyACM0", "/dev/ttyS0"]
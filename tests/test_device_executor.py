@@ -0,0 +1,81 @@
+"""Tests of the microscope's device worker thread."""
+
+import os
+import sys
+import threading
+
+import pytest
+
+QtCore = pytest.importorskip("PyQt5.QtCore")
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), os.pardir, "Examples", "Microscope")
+)
+from DeviceExecutor import DeviceExecutor  # noqa: E402 pylint: disable=C0413
+
+
+@pytest.fixture(name="executor")
+def fixture_executor():
+    """An executor and the signals it emitted, delivered on its worker thread."""
+    executor = DeviceExecutor()
+    emitted = []
+    # no event loop runs, so take the signals on the emitting thread
+    executor.finished.connect(
+        lambda name, value: emitted.append(("finished", name, value)),
+        QtCore.Qt.DirectConnection,
+    )
+    executor.failed.connect(
+        lambda name, error: emitted.append(("failed", name, error)),
+        QtCore.Qt.DirectConnection,
+    )
+    yield executor, emitted
+    executor.shutdown()
+
+
+def test_results_are_emitted_in_submission_order(executor):
+    executor, emitted = executor
+    threads = []
+
+    def set_exposure(value):
+        threads.append(threading.current_thread())
+        return value
+
+    futures = [executor.submit("exposure", set_exposure, value) for value in range(3)]
+
+    assert [future.result(timeout=5) for future in futures] == [0, 1, 2]
+    executor.shutdown()
+    assert emitted == [("finished", "exposure", value) for value in range(3)]
+    assert len(set(threads)) == 1
+    assert threads[0] is not threading.current_thread()
+
+
+def test_failures_are_emitted(executor):
+    executor, emitted = executor
+    error = OSError("no reply")
+
+    def LightsOn():  # pylint: disable=invalid-name
+        raise error
+
+    future = executor.call(LightsOn)
+
+    assert future.exception(timeout=5) is error
+    executor.shutdown()
+    assert emitted == [("failed", "LightsOn", error)]
+
+
+def test_cancelled_calls_emit_nothing(executor):
+    executor, emitted = executor
+    started, release = threading.Event(), threading.Event()
+
+    def busy():
+        started.set()
+        return release.wait(5)
+
+    executor.submit("busy", busy)
+    pending = executor.submit("pending", lambda: None)
+
+    assert started.wait(5)
+    threading.Timer(0.05, release.set).start()
+    executor.shutdown(cancel_pending=True)
+
+    assert pending.cancelled()
+    assert emitted == [("finished", "busy", True)]
@@ -0,0 +1,39 @@
+"""Tests of the controller emulator against the firmware's behaviour."""
+
+import time
+
+import numpy as np
+
+from Scanner3D.emulator import ControllerEmulator, PtyEmulator
+from Scanner3D.interface import Direction, MotionSegment, Scanner, SpeedMode
+
+
+def _frame(cmd: bytes, command_id: int = 0) -> bytes:
+    return Scanner.frame_command(cmd, command_id)
+
+
+def test_queued_segment_above_int_range():
+    emulator = ControllerEmulator()
+    emulator.feed(_frame(b"queue_forward_40000_50"))
+
+    replies = emulator.feed(_frame(b"queue_run_1_0"))
+
+    assert replies[-2:] == [b"seg:0:0:40000", b"done:0:40000"]
+    assert emulator.position["z"] == 40000
+
+
+def test_program_progress_is_paced_by_segments():
+    segment = MotionSegment(Direction.FORWARD, 1000, SpeedMode.FAST)  # 0.1 s
+    reported = []
+    with PtyEmulator(ControllerEmulator(), baudrate=None) as pty:
+        scanner = Scanner(pty.port)
+        try:
+            scanner.run_program(
+                [segment] * 4, lambda index, steps: reported.append(time.monotonic())
+            ).result(timeout=5)
+        finally:
+            scanner.close()
+
+    gaps = np.diff(reported)
+    assert len(gaps) == 3
+    assert np.allclose(gaps, 0.1, atol=0.03)
@@ -0,0 +1,72 @@
+"""Tests of the shared memory frame bus."""
+
+import os
+import subprocess
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from utils.frame_bus import FrameBus, FrameBusReader
+
+
+@pytest.fixture(name="bus")
+def fixture_bus():
+    bus = FrameBus(f"test_frame_bus_{os.getpid()}", capacity=4)
+    yield bus
+    bus.close()
+
+
+def test_new_geometry_starts_a_generation(bus):
+    bus.publish(np.zeros((4, 4), dtype=np.uint8))
+    reader = FrameBusReader(bus.name, 0, timeout=1)
+    bus.publish(np.ones((4, 4), dtype=np.uint8))
+    assert reader.read_copy(timeout=1).shape == (4, 4)
+    frame = np.full((2, 3), 300, dtype=np.uint16)
+    bus.publish(frame)
+
+    assert bus.generation == 1
+    assert np.array_equal(reader.read_copy(timeout=1), frame)
+    assert reader.generation == 1
+    assert reader.cursor == 3
+    reader.close()
+
+
+def test_lag_counts_across_generations(bus):
+    bus.publish(np.zeros((4, 4), dtype=np.uint8))
+    reader = FrameBusReader(bus.name, 0, timeout=1)
+    bus.publish(np.zeros((4, 4), dtype=np.uint16))
+    bus.publish(np.zeros((4, 4), dtype=np.uint16))
+
+    assert reader.read(timeout=1)[0] == 1
+    assert bus.lag() == 1
+    reader.close()
+
+
+def test_exiting_reader_process_keeps_the_segment(bus):
+    bus.publish(np.zeros((4, 4), dtype=np.uint8))
+    script = (
+        "from utils.frame_bus import FrameBusReader;"
+        f"FrameBusReader({bus.name!r}, 1, timeout=1).close()"
+    )
+    root = os.path.join(os.path.dirname(__file__), os.pardir)
+    subprocess.run(
+        [sys.executable, "-c", script], cwd=root, check=True, capture_output=True
+    )
+
+    reader = FrameBusReader(bus.name, 0, timeout=1)
+    bus.publish(np.ones((4, 4), dtype=np.uint8))
+    assert reader.read_copy(timeout=1)[0, 0] == 1
+    reader.close()
+
+
+def test_stale_segment_is_replaced(bus):
+    stale = shared_memory.SharedMemory(name=bus.name, create=True, size=16)
+    stale.close()
+
+    bus.publish(np.ones((4, 4), dtype=np.uint8))
+
+    reader = FrameBusReader(bus.name, 0, timeout=1)
+    assert reader.generation == 0
+    reader.close()
@@ -0,0 +1,60 @@
+"""Tests of the camera's cache of buffer metadata, without a camera."""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyueye")
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), os.pardir, "Examples", "Microscope")
+)
+import IdsCamera  # noqa: E402 pylint: disable=C0413
+
+
+def _buffer(mem_id):
+    return SimpleNamespace(mem_id=SimpleNamespace(value=mem_id))
+
+
+@pytest.fixture(name="camera")
+def fixture_camera(monkeypatch):
+    """A camera whose driver calls succeed, counting metadata queries."""
+    queries = []
+
+    def memory_info(_h_cam, img_buff):
+        queries.append(img_buff.mem_id.value)
+        return SimpleNamespace(img_buff=img_buff)
+
+    monkeypatch.setattr(IdsCamera, "MemoryInfo", memory_info)
+    monkeypatch.setattr(IdsCamera.ueye, "is_AOI", lambda *args: 0)
+    monkeypatch.setattr(IdsCamera.ueye, "is_SetColorMode", lambda *args: 0)
+    return IdsCamera.Camera(), queries
+
+
+def test_memory_info_is_queried_once_per_buffer(camera):
+    camera, queries = camera
+
+    first = camera.memory_info(_buffer(1))
+
+    assert camera.memory_info(_buffer(1)) is first
+    assert camera.memory_info(_buffer(2)) is not first
+    assert queries == [1, 2]
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda camera: camera.set_aoi(0, 0, 1024, 1024),
+        lambda camera: camera.set_colormode(IdsCamera.ueye.IS_CM_SENSOR_RAW8),
+    ],
+    ids=["set_aoi", "set_colormode"],
+)
+def test_memory_info_is_queried_again_after_a_change(camera, change):
+    camera, queries = camera
+    first = camera.memory_info(_buffer(1))
+
+    change(camera)
+
+    assert camera.memory_info(_buffer(1)) is not first
+    assert queries == [1, 1]
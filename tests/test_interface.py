@@ -0,0 +1,104 @@
+"""Tests of the scanner's reply handling, on a pseudo-terminal."""
+
+import os
+import time
+import tty
+
+import pytest
+from serial import SerialException
+
+from Scanner3D.emulator import ControllerEmulator, PtyEmulator
+from Scanner3D.interface import (
+    Direction,
+    MotionSegment,
+    MoveStatus,
+    Scanner,
+    SpeedMode,
+)
+
+
+@pytest.fixture(name="board")
+def fixture_board():
+    """A scanner connected to the master end of a raw pty, the board side."""
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    scanner = Scanner(os.ttyname(slave))
+    yield scanner, master
+    scanner.close()
+    for fd in (master, slave):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def _write_slowly(master: int, *chunks: bytes) -> None:
+    """Write chunks further apart than the scanner's read timeout."""
+    for chunk in chunks:
+        os.write(master, chunk)
+        time.sleep(0.25)
+
+
+def test_reply_split_across_reads(board):
+    scanner, master = board
+    future = scanner.move(b"single_forward_42_50")
+
+    _write_slowly(master, b"ack:0\r\ndone:0:4", b"2\r\n")
+    result = future.result(timeout=2)
+
+    assert result.status == MoveStatus.DONE
+    assert result.steps == 42
+    assert scanner.position == {"y": 0, "z": 42}
+
+
+def test_reply_after_split_switch_notice(board):
+    scanner, master = board
+    future = scanner.move(b"single_forward_10_50")
+
+    _write_slowly(master, b"Dow", b"n,Up,stop:0:7\r\n")
+
+    assert future.result(timeout=2).steps == 7
+    assert not scanner.limit_switch_pressed
+
+
+def test_broken_connection_fails_pending_moves(board):
+    scanner, master = board
+    future = scanner.move(b"single_forward_10_50")
+
+    os.close(master)
+
+    with pytest.raises(SerialException):
+        future.result(timeout=2)
+    with pytest.raises(SerialException):
+        scanner.move(b"single_forward_10_50").result(timeout=2)
+
+
+def test_program_after_long_move_fits_receive_buffer():
+    segments = [MotionSegment(Direction.UP, 100, SpeedMode.FAST)] * 10
+    with PtyEmulator(ControllerEmulator()) as pty:
+        scanner = Scanner(pty.port)
+        try:
+            move = scanner.move(b"single_forward_3000_50")
+            program = scanner.run_program(segments)
+
+            assert move.result(timeout=5).status == MoveStatus.DONE
+            assert program.result(timeout=5).steps == 1000
+        finally:
+            scanner.close()
+
+    assert pty.overflowed == 0
+    assert pty.emulator.position == {"y": 1000, "z": 3000}
+
+
+def test_rapid_moves_fit_receive_buffer():
+    with PtyEmulator(ControllerEmulator()) as pty:
+        scanner = Scanner(pty.port)
+        try:
+            futures = [scanner.move(b"single_forward_500_50") for _ in range(8)]
+            results = [future.result(timeout=5) for future in futures]
+        finally:
+            scanner.close()
+
+    assert [result.status for result in results] == [MoveStatus.DONE] * 8
+    assert pty.overflowed == 0
+    assert pty.emulator.position["z"] == 4000
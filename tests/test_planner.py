@@ -0,0 +1,106 @@
+"""Tests of the motion planner and the timing model."""
+
+import numpy as np
+import pytest
+
+from Scanner3D.emulator import ControllerEmulator, PtyEmulator
+from Scanner3D.interface import BITS_PER_BYTE, Direction, Scanner
+from Scanner3D.planner import (
+    MAX_PROFILE_STAIRS,
+    PULL_IN_RATE,
+    LineProfile,
+    MotionProfile,
+    Ramp,
+    TimingModel,
+    parse_command,
+    plan_line,
+    plan_move,
+)
+
+
+def test_timing_fit_recovers_transfer_time():
+    truth = TimingModel(overhead=0.02, scale=1.05, per_byte=BITS_PER_BYTE / 9600)
+    rng = np.random.default_rng(0)
+    samples = [
+        (planned, size, truth.predict(planned, size))
+        for planned, size in zip(rng.uniform(0, 1, 20), rng.integers(20, 60, 20))
+    ]
+
+    fitted = TimingModel(per_byte=0.0).fit(samples)
+
+    assert fitted.overhead == pytest.approx(truth.overhead)
+    assert fitted.scale == pytest.approx(truth.scale)
+    assert fitted.per_byte == pytest.approx(truth.per_byte)
+
+
+def test_timing_fit_keeps_coefficients_it_cannot_tell():
+    model = TimingModel(scale=1.1, per_byte=0.002)
+
+    fitted = model.fit([(0.1, 30, 0.2), (0.3, 30, 0.4)])
+
+    assert fitted.per_byte == model.per_byte
+    assert fitted.scale == pytest.approx(1.0)
+    assert fitted.overhead == pytest.approx(0.1 - 30 * 0.002)
+
+
+def test_long_command_predicted_slower():
+    with PtyEmulator(ControllerEmulator()) as pty:
+        scanner = Scanner(pty.port)
+        try:
+            for cmd in (b"single_up_100_50", b"single_up_100_50_" + b"0" * 40) * 3:
+                scanner.move(cmd).result(timeout=2)
+            short = scanner.predict(b"single_up_100_50")
+            long = scanner.predict(b"single_up_100_50_" + b"0" * 40)
+        finally:
+            scanner.close()
+
+    assert scanner.timing.per_byte == pytest.approx(BITS_PER_BYTE / 9600, rel=0.25)
+    assert long - short == pytest.approx(41 * BITS_PER_BYTE / 9600, rel=0.25)
+
+
+def test_short_move_is_a_single_command_at_pull_in_rate():
+    profile = plan_move(Direction.UP, 100)
+
+    assert profile.interval_us == 1e6 / PULL_IN_RATE
+    assert profile.command() == b"single_up_100_0"
+    assert parse_command(profile.command()) == profile
+
+
+def test_long_move_ramps_up_and_down():
+    profile = plan_move(Direction.FORWARD, 20000)
+
+    assert profile.ramp == Ramp(200, MAX_PROFILE_STAIRS, 40000)
+    assert len(profile.stairs) == MAX_PROFILE_STAIRS
+    assert profile.stairs[0].interval_us == 1e6 / PULL_IN_RATE
+    assert profile.cruise.interval_us == 50
+    assert sum(segment.steps for segment in profile.segments) == 20000
+    assert profile.duration < plan_move(Direction.FORWARD, 20000, max_stairs=0).duration
+    assert parse_command(profile.command()) == profile
+
+
+def test_ramp_is_cut_short_in_short_moves():
+    profile = MotionProfile(Direction.UP, 2000, 50, Ramp(100, 8, 40000))
+
+    assert 0 < len(profile.stairs) < 8
+    assert 2 * sum(stair.steps for stair in profile.stairs) <= 2000
+    assert profile.cruise.interval_us > 50
+    assert sum(segment.steps for segment in profile.segments) == 2000
+
+
+@pytest.mark.parametrize(
+    "profile",
+    [
+        plan_move(Direction.DOWN, 3000),
+        plan_line(3000, -1000),
+        LineProfile(-500, 2000, 100),
+    ],
+)
+def test_emulator_runs_the_planned_profile(profile):
+    emulator = ControllerEmulator()
+
+    replies = emulator.feed(Scanner.frame_command(profile.command(), 0))
+
+    assert replies[-1] == b"done:0:%d" % profile.steps
+    assert emulator.last_duration == pytest.approx(profile.duration)
+    position = (emulator.position["y"], emulator.position["z"])
+    assert position == profile.position(profile.steps)
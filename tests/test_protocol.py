@@ -0,0 +1,64 @@
+"""Tests of the framed controller protocol."""
+
+import pytest
+
+from Scanner3D.emulator import ControllerEmulator
+from Scanner3D.protocol import (
+    MAX_LINE_LENGTH,
+    PROTOCOL_VERSION,
+    Direction,
+    Mode,
+    SpeedMode,
+    frame_command,
+    generate_command,
+    parse_frame,
+)
+
+
+@pytest.mark.parametrize("command_id", [0, 7, 999_999])
+@pytest.mark.parametrize(
+    "cmd", [b"single_up_100_25", b"queue_run_3_0", b"line_-5_12_200_200.8.40000"]
+)
+def test_frame_round_trip(cmd, command_id):
+    frame = frame_command(cmd, command_id)
+
+    assert frame.startswith(b"#") and frame.endswith(b"\n")
+    assert parse_frame(frame) == (PROTOCOL_VERSION, command_id, cmd)
+    assert parse_frame(frame.rstrip(b"\n") + b"\r\n") == (
+        PROTOCOL_VERSION,
+        command_id,
+        cmd,
+    )
+
+
+def test_generated_command_is_framed():
+    cmd = generate_command(Mode.SINGLE, Direction.BACKWARD, 250, SpeedMode.FAST)
+
+    assert cmd == b"single_backward_250_50"
+    assert parse_frame(frame_command(cmd, 3))[2] == cmd
+
+
+def test_frame_rejects_newline_and_overlong_commands():
+    with pytest.raises(ValueError):
+        frame_command(b"single_up_1_0\nsingle_up_1_0", 0)
+    with pytest.raises(ValueError):
+        frame_command(b"x" * MAX_LINE_LENGTH, 0)
+
+
+@pytest.mark.parametrize(
+    "frame",
+    [b"1:2:single_up_1_0\n", b"#1:2\n", b"#\n", b"#v:2:single_up_1_0\n", b"#1::x\n"],
+)
+def test_malformed_frames_are_rejected(frame):
+    with pytest.raises(ValueError):
+        parse_frame(frame)
+
+
+def test_emulator_rejects_malformed_and_unknown_version_frames():
+    emulator = ControllerEmulator()
+
+    assert emulator.feed(b"#1:x:single_up_1_0\n") == [b"err:-1"]
+    assert emulator.feed(b"#%d:4:single_up_1_0\n" % (PROTOCOL_VERSION + 1)) == [
+        b"err:4"
+    ]
+    assert emulator.position == {"y": 0, "z": 0}
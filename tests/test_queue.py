@@ -0,0 +1,194 @@
+"""Tests of the frame ring buffer."""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from utils.queue import OverflowPolicy, Queue, QueueStats
+
+
+def test_put_transform_into_another_shape():
+    queue = Queue(4)
+    raw = np.arange(12, dtype=np.uint8).reshape(3, 4)
+
+    slot = queue.put(
+        raw, transform=lambda src, dst: np.copyto(dst, src[..., None]), shape=(3, 4, 3)
+    )
+
+    assert slot.shape == (3, 4, 3)
+    assert np.shares_memory(slot, queue.get(1))
+    assert np.array_equal(queue.get(1)[0, ..., 2], raw)
+
+
+def _frame(value: int) -> np.ndarray:
+    return np.full((2, 2), value, dtype=np.uint8)
+
+
+def _values(frames: np.ndarray) -> list:
+    return [int(frame[0, 0]) for frame in frames]
+
+
+def _consumed_queue(policy: OverflowPolicy, **kwargs) -> Queue:
+    """A full queue of two frames, both still needed by its consumer."""
+    queue = Queue(2, policy=policy, **kwargs)
+    assert queue.wait_batch(1, timeout=0) is None
+    for value in range(2):
+        queue.put(_frame(value))
+    return queue
+
+
+def test_ring_overwrites_without_counting_drops_while_unconsumed():
+    queue = Queue(2, policy=OverflowPolicy.DROP_NEWEST)
+
+    for value in range(5):
+        assert queue.put(_frame(value)) is not None
+
+    assert _values(queue.get()) == [3, 4]
+    assert queue.stats() == QueueStats(enqueued=5, dropped=0, high_water=0, lag=5)
+
+
+def test_drop_oldest_overwrites_pending_frame():
+    queue = _consumed_queue(OverflowPolicy.DROP_OLDEST)
+
+    assert queue.put(_frame(2)) is not None
+
+    assert _values(queue.wait_batch(2, timeout=0)) == [1, 2]
+    assert queue.stats() == QueueStats(enqueued=3, dropped=1, high_water=2, lag=0)
+
+
+def test_drop_newest_discards_incoming_frame():
+    queue = _consumed_queue(OverflowPolicy.DROP_NEWEST)
+
+    assert queue.put(_frame(2)) is None
+
+    assert _values(queue.wait_batch(2, timeout=0)) == [0, 1]
+    assert queue.stats().dropped == 1
+    assert queue.stats().enqueued == 2
+
+
+def test_block_requires_timeout():
+    with pytest.raises(ValueError):
+        Queue(2, policy=OverflowPolicy.BLOCK)
+
+
+def test_block_waits_for_consumer_then_gives_up():
+    queue = _consumed_queue(OverflowPolicy.BLOCK, block_timeout=0.1)
+
+    start = time.monotonic()
+    assert queue.put(_frame(2)) is None
+    assert time.monotonic() - start == pytest.approx(0.1, abs=0.05)
+    assert queue.stats().dropped == 1
+
+    threading.Timer(0.02, queue.wait_batch, (2,), {"timeout": 0}).start()
+    assert queue.put(_frame(3)) is not None
+    assert _values(queue.get()) == [1, 3]
+
+
+def test_decimate_keeps_every_nth_overflowing_frame():
+    queue = _consumed_queue(OverflowPolicy.DECIMATE, decimate_every=2)
+
+    kept = [queue.put(_frame(value)) is not None for value in range(2, 6)]
+
+    assert kept == [False, True, False, True]
+    assert _values(queue.wait_batch(2, timeout=0)) == [3, 5]
+    assert queue.stats().dropped == 4
+
+
+def test_get_returns_frames_oldest_first_across_the_wrap():
+    queue = Queue(4)
+    assert len(queue.get()) == 0
+
+    for value in range(6):
+        queue.put(_frame(value))
+
+    assert queue.full()
+    assert _values(queue.get()) == [2, 3, 4, 5]
+    assert _values(queue.get(3)) == [3, 4, 5]
+    assert _values(queue.get(1)) == [5]
+
+
+def test_slots_are_reused_from_one_preallocated_buffer():
+    queue = Queue(3, frame_shape=(2, 2))
+    slots = [queue.put(_frame(value)) for value in range(4)]
+
+    assert np.shares_memory(slots[0], slots[3])
+    assert int(slots[0][0, 0]) == 3
+    # contiguous windows are views into the ring, wrapped ones copies
+    assert np.shares_memory(queue.get(1), slots[3])
+    assert not np.shares_memory(queue.get(2), slots[2])
+
+
+def test_new_frame_geometry_reallocates_the_ring():
+    queue = Queue(3)
+    queue.put(_frame(1))
+    queue.put(_frame(2))
+
+    queue.put(np.full((3, 3), 7, dtype=np.uint16))
+
+    frames = queue.get()
+    assert frames.shape == (1, 3, 3)
+    assert frames.dtype == np.uint16
+
+
+def test_wait_batch_times_out_without_new_frames():
+    queue = Queue(4)
+    queue.put(_frame(0))
+
+    start = time.monotonic()
+    assert queue.wait_batch(2, timeout=0.05) is None
+    assert time.monotonic() - start >= 0.04
+
+
+def test_wait_batch_wakes_when_the_batch_is_complete():
+    queue = Queue(4)
+    queue.put(_frame(0))
+    threading.Timer(0.02, queue.put, (_frame(1),)).start()
+
+    assert _values(queue.wait_batch(2, timeout=5)) == [0, 1]
+
+
+@pytest.mark.parametrize(
+    "size, stride, batches",
+    [
+        (3, 1, [[0, 1, 2], [1, 2, 3], [2, 3, 4], [3, 4, 5]]),
+        (2, 2, [[0, 1], [2, 3], [4, 5]]),
+        (2, 3, [[1, 2], [4, 5]]),
+    ],
+)
+def test_wait_batch_strides(size, stride, batches):
+    queue = Queue(8)
+    queue.wait_batch(size, stride, timeout=0)
+    for value in range(6):
+        queue.put(_frame(value))
+
+    received = []
+    while True:
+        batch = queue.wait_batch(size, stride, timeout=0)
+        if batch is None:
+            break
+        received.append(_values(batch))
+
+    assert received == batches
+
+
+def test_wait_batch_returns_a_copy():
+    queue = Queue(2)
+    queue.put(_frame(0))
+
+    batch = queue.wait_batch(1, timeout=0)
+    queue.put(_frame(1))
+    queue.put(_frame(2))
+
+    assert _values(batch) == [0]
+
+
+def test_wait_batch_rejects_bad_sizes():
+    queue = Queue(4)
+    with pytest.raises(ValueError):
+        queue.wait_batch(5)
+    with pytest.raises(ValueError):
+        queue.wait_batch(0)
+    with pytest.raises(ValueError):
+        queue.wait_batch(2, stride=0)
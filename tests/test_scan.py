@@ -0,0 +1,59 @@
+"""Tests of scan planning and execution against the controller emulator."""
+
+import time
+
+import pytest
+
+from Scanner3D.emulator import ControllerEmulator, PtyEmulator
+from Scanner3D.interface import MoveStatus, Scanner
+from Scanner3D.planner import TimingModel
+from Scanner3D.scan import Region, plan_raster
+
+
+def test_pipelined_scan_ramps_and_visits_all_stops():
+    plan = plan_raster(Region(0, 0, 2000, 2000), 1000, timing=TimingModel())
+    emulator = ControllerEmulator()
+    with PtyEmulator(emulator, baudrate=None) as pty:
+        scanner = Scanner(pty.port)
+        try:
+            results = plan.run(scanner, timeout=5)
+        finally:
+            scanner.close()
+
+    assert all(move.ramp is not None for move in plan.moves if move.steps)
+    assert [result.status for result in results] == [MoveStatus.DONE] * 9
+    assert (emulator.position["y"], emulator.position["z"]) == plan.points[-1]
+
+
+def test_scan_with_dwell_skips_ramps_of_short_moves():
+    plan = plan_raster(Region(0, 0, 200, 200), 100, dwell=0.1)
+
+    assert all(move.ramp is None for move in plan.moves)
+    assert plan.commands()[1] == b"line_0_100_200"
+
+
+@pytest.mark.parametrize("dwell", [0.0, 0.05])
+def test_expected_time_matches_emulated_scan(dwell):
+    calibration = (b"single_up_100_50", b"single_down_2000_50", b"line_0_1000_100")
+    with PtyEmulator(ControllerEmulator()) as pty:
+        scanner = Scanner(pty.port)
+        try:
+            for cmd in calibration + (b"single_up_1_50_" + b"0" * 30,):
+                scanner.move(cmd).result(timeout=5)
+            plan = plan_raster(
+                Region(0, 0, 2000, 2000),
+                1000,
+                start=(scanner.position["y"], scanner.position["z"]),
+                timing=scanner.timing,
+                dwell=dwell,
+            )
+
+            start = time.monotonic()
+            plan.run(
+                scanner, (lambda index, point: time.sleep(dwell)) if dwell else None, 5
+            )
+            elapsed = time.monotonic() - start
+        finally:
+            scanner.close()
+
+    assert plan.expected_time == pytest.approx(elapsed, rel=0.1)
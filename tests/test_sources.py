@@ -0,0 +1,25 @@
+"""Tests of the frame sources."""
+
+import threading
+import time
+
+from Scanner3D.sources import SwitchableSource, SyntheticSource
+
+
+def test_switchable_source_waits_for_a_source():
+    source = SwitchableSource(idle_timeout=0.1)
+
+    start = time.monotonic()
+    assert source.read() is None
+    assert time.monotonic() - start >= 0.1
+
+
+def test_switchable_source_wakes_up_on_switch():
+    source = SwitchableSource(idle_timeout=5)
+    threading.Timer(0.05, source.switch, (SyntheticSource(8, 4, seed=0),)).start()
+
+    start = time.monotonic()
+    frame = source.read()
+
+    assert frame.shape == (4, 8, 3)
+    assert time.monotonic() - start < 1
@@ -0,0 +1,40 @@
+"""Tests of the microscope's background frame writer."""
+
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), os.pardir, "Examples", "Microscope")
+)
+from StackWriter import StackWriter  # noqa: E402 pylint: disable=C0413
+
+
+def test_flush_async_resolves_once_frames_are_written(tmp_path):
+    writer = StackWriter(workers=1)
+    threads = threading.active_count()
+
+    for i in range(3):
+        assert writer.submit(str(tmp_path / f"{i}.raw"), np.full((4, 4), i, np.uint8))
+    futures = [writer.flush_async() for _ in range(5)]
+
+    assert threading.active_count() == threads
+    assert all(future.result(timeout=5).written == 3 for future in futures)
+    assert writer.flush_async().result(timeout=0).written == 3
+    writer.close()
+
+
+def test_write_failures_are_counted_and_reported(tmp_path):
+    failures = []
+    writer = StackWriter(on_error=lambda target, e: failures.append((target, e)))
+    target = str(tmp_path / "missing" / "frame.raw")
+
+    writer.submit(target, np.zeros((4, 4), np.uint8))
+    writer.flush(timeout=5)
+
+    assert writer.stats().errors == 1
+    assert failures[0][0] == target
+    assert isinstance(failures[0][1], OSError)
+    writer.close()
@@ -0,0 +1,166 @@
+"""Round trips of frames through the codecs, the container and open_stack."""
+
+import numpy as np
+import pytest
+
+from Scanner3D.storage.codecs import PREDICTORS, FrameCodec
+from Scanner3D.storage.container import (
+    STACK_EXTENSION,
+    FrameInfo,
+    StackFileReader,
+    StackFileWriter,
+)
+from Scanner3D.storage.stacks import open_scan, open_stack
+
+SHAPES = [(6, 8), (7, 5), (1, 9), (5, 3, 3)]
+
+
+def _frames(count, shape, dtype, seed=0):
+    rng = np.random.default_rng(seed)
+    high = np.iinfo(dtype).max + 1
+    return rng.integers(0, high, size=(count,) + shape, dtype=dtype)
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("predictor", PREDICTORS)
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+def test_codec_round_trip(codec, predictor, shape, dtype):
+    frame = _frames(1, shape, dtype)[0]
+    with FrameCodec(codec, predictor, chunk_rows=2, workers=2) as frame_codec:
+        data = frame_codec.encode(frame)
+        decoded = frame_codec.decode(data, shape, dtype)
+
+    assert decoded.dtype == dtype
+    assert np.array_equal(decoded, frame)
+
+
+def test_codec_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        FrameCodec("zlib", "median")
+    with pytest.raises(ValueError):
+        FrameCodec("zlib", chunk_rows=3)
+    with pytest.raises(ValueError):
+        FrameCodec("brotli")
+    with FrameCodec() as codec, pytest.raises(ValueError):
+        codec.encode(np.zeros(4, dtype=np.uint8))
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("compressed", [False, True])
+def test_container_round_trip(tmp_path, compressed, shape, dtype):
+    path = tmp_path / ("stack" + STACK_EXTENSION)
+    frames = _frames(3, shape, dtype)
+    codec = FrameCodec(chunk_rows=2) if compressed else None
+    with StackFileWriter(path, shape, dtype, "GB", codec) as writer:
+        # records are filled out of order, as by several writer threads
+        records = [writer.reserve() for _ in frames]
+        for record in reversed(records):
+            writer.write(record, frames[record], FrameInfo(step=10 * record))
+    if codec is not None:
+        codec.close()
+
+    with StackFileReader(path) as reader:
+        assert reader.complete
+        assert (reader.frame_shape, reader.dtype) == (shape, np.dtype(dtype))
+        assert reader.bayer_pattern == "GB"
+        assert len(reader) == 3
+        for i, frame in enumerate(frames):
+            assert np.array_equal(reader[i], frame)
+            assert reader.info(i).step == 10 * i
+        assert np.array_equal(reader[-1], frames[-1])
+
+
+def test_unclosed_raw_container_keeps_its_frames(tmp_path):
+    path = tmp_path / ("stack" + STACK_EXTENSION)
+    frames = _frames(2, (4, 6), np.uint16)
+    writer = StackFileWriter(path, (4, 6), np.uint16)
+    for frame in frames:
+        writer.append(frame)
+    writer._file.flush()  # pylint: disable=protected-access
+
+    with StackFileReader(path) as reader:
+        assert not reader.complete
+        assert reader.info(0) is None
+        assert np.array_equal(np.stack([reader[0], reader[1]]), frames)
+    writer.close()
+
+
+def test_reserved_record_never_written_reads_as_zeros(tmp_path):
+    path = tmp_path / ("stack" + STACK_EXTENSION)
+    with FrameCodec() as codec:
+        with StackFileWriter(path, (4, 4), np.uint8, codec=codec) as writer:
+            writer.reserve()
+            writer.append(np.ones((4, 4), np.uint8))
+
+    with StackFileReader(path) as reader:
+        assert not reader[0].any()
+        assert reader[1].all()
+
+
+def test_container_rejects_frames_of_another_shape(tmp_path):
+    path = tmp_path / ("stack" + STACK_EXTENSION)
+    with StackFileWriter(path, (4, 4), np.uint8) as writer:
+        with pytest.raises(ValueError):
+            writer.append(np.zeros((4, 5), np.uint8))
+    with pytest.raises(ValueError):
+        writer.reserve()
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_open_stack_of_a_folder_of_containers(tmp_path, compressed):
+    frames = _frames(5, (7, 5), np.uint16)
+    codec = FrameCodec(chunk_rows=2) if compressed else None
+    for name, part in (("a", frames[:2]), ("b", frames[2:])):
+        with StackFileWriter(
+            tmp_path / (name + STACK_EXTENSION), (7, 5), np.uint16, codec=codec
+        ) as writer:
+            for frame in part:
+                writer.append(frame)
+    if codec is not None:
+        codec.close()
+
+    stack = open_stack(tmp_path)
+
+    assert stack.shape == (5, 7, 5)
+    assert stack.dtype == np.uint16
+    assert np.array_equal(stack[:, 2:5, 1:4], frames[:, 2:5, 1:4])
+    assert np.array_equal(stack[3], frames[3])
+    assert np.array_equal(stack[::-2], frames[::-2])
+    assert np.array_equal(np.asarray(stack), frames)
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_open_stack_of_a_legacy_folder(tmp_path, dtype):
+    frames = _frames(11, (3, 5), dtype)
+    for i, frame in enumerate(frames):
+        frame.tofile(tmp_path / f"file{i}Exp_3.0.bin")
+
+    stack = open_stack(tmp_path, shape=(3, 5), dtype=dtype)
+
+    # frame 10 sorts after frame 9, not after frame 1
+    assert np.array_equal(stack[:], frames)
+    assert np.array_equal(stack[9:, 1:, ::2], frames[9:, 1:, ::2])
+
+
+def test_open_stack_of_a_legacy_folder_checks_the_frame_size(tmp_path):
+    np.zeros((3, 5), np.uint8).tofile(tmp_path / "file0Exp_3.0.bin")
+
+    with pytest.raises(ValueError):
+        open_stack(tmp_path)
+    with pytest.raises(ValueError):
+        open_stack(tmp_path, shape=(3, 5), dtype=np.uint16)
+
+
+def test_open_scan_concatenates_stacks(tmp_path):
+    frames = _frames(4, (2, 3), np.uint8)
+    paths = []
+    for i in range(2):
+        path = tmp_path / (f"scan{i}" + STACK_EXTENSION)
+        with StackFileWriter(path, (2, 3), np.uint8) as writer:
+            for frame in frames[2 * i : 2 * i + 2]:
+                writer.append(frame)
+        paths.append(path)
+
+    assert np.array_equal(open_scan(paths)[:], frames)
@@ -0,0 +1,325 @@
+"""This module contains a ring of frames in shared memory that worker
+processes can attach to and read without copying."""
+import os
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+MAX_READERS = 16
+_MAX_DIMS = 4
+_created = set()  # names of the segments this process created and tracks
+
+_HEADER = np.dtype(
+    [
+        ("capacity", "<i8"),
+        ("ndim", "<i8"),
+        ("shape", "<i8", (_MAX_DIMS,)),
+        ("dtype", "S8"),
+        ("written", "<i8"),
+        ("generation", "<i8"),
+        ("retired", "<i8"),
+        ("cursors", "<i8", (MAX_READERS,)),
+    ]
+)
+
+
+def _layout(
+    capacity: int, shape: Tuple[int, ...], dtype: np.dtype
+) -> Tuple[int, int, int]:
+    """Offsets of the slot sequence numbers and of the frames, and total size."""
+    seq_offset = _HEADER.itemsize
+    frames_offset = seq_offset + capacity * 8
+    frames_offset += -frames_offset % 64  # keep frames cache-line aligned
+    size = frames_offset + capacity * int(np.prod(shape)) * dtype.itemsize
+    return seq_offset, frames_offset, size
+
+
+def _open(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing segment without taking ownership of it.
+
+    Before Python 3.13 the resource tracker of every process that attaches to
+    a segment unlinks it when that process exits (bpo-39959), which would
+    destroy the bus when a reader exits.
+    """
+    if sys.version_info >= (3, 13):
+        # pylint: disable-next=unexpected-keyword-arg
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == "posix" and name not in _created:
+        # pylint: disable-next=protected-access
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _check_dims(shape: Tuple[int, ...]) -> None:
+    if len(shape) > _MAX_DIMS:
+        raise ValueError(f"Frames may have at most {_MAX_DIMS} dimensions")
+
+
+class _Segment:
+    """Typed views over a frame bus shared memory segment."""
+
+    def __init__(self, shm: shared_memory.SharedMemory) -> None:
+        self.shm = shm
+        self.header = np.ndarray((), dtype=_HEADER, buffer=shm.buf)
+        capacity = int(self.header["capacity"])
+        shape = tuple(int(d) for d in self.header["shape"][: int(self.header["ndim"])])
+        dtype = np.dtype(self.header["dtype"].item().decode())
+        seq_offset, frames_offset, _ = _layout(capacity, shape, dtype)
+        self.slot_seq = np.ndarray(
+            (capacity,), dtype="<i8", buffer=shm.buf, offset=seq_offset
+        )
+        self.frames = np.ndarray(
+            (capacity,) + shape, dtype=dtype, buffer=shm.buf, offset=frames_offset
+        )
+
+    def close(self) -> None:
+        # views must be released before the mapping can be closed
+        del self.header, self.slot_seq, self.frames
+        self.shm.close()
+
+
+class FrameBus:
+    """Publish frames into a named shared memory ring.
+
+    The segment is created on the first ``publish`` call, once the frame
+    geometry is known, replacing any segment of the same name a crashed
+    producer left behind. Every slot carries the sequence number of the frame it
+    holds, so readers can detect when the producer has lapped them. A frame
+    of another shape or dtype replaces the segment by one of the next
+    generation, which readers switch to.
+
+    Args:
+        name (str): Name of the shared memory segment.
+        capacity (int): Number of frames kept in the ring. Defaults to 64.
+    """
+
+    def __init__(self, name: str, capacity: int = 64) -> None:
+        self._name = name
+        self._capacity = capacity
+        self._segment = None
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory segment."""
+        return self._name
+
+    @property
+    def generation(self) -> int:
+        """Number of times the segment was replaced for a new frame geometry."""
+        return 0 if self._segment is None else int(self._segment.header["generation"])
+
+    def _create(
+        self,
+        shape: Tuple[int, ...],
+        dtype: np.dtype,
+        written: int = 0,
+        generation: int = 0,
+    ) -> None:
+        """Create the segment for frames of ``shape`` and ``dtype``."""
+        _check_dims(shape)
+        _, _, size = _layout(self._capacity, shape, dtype)
+        try:
+            shm = shared_memory.SharedMemory(name=self._name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a producer that crashed before closing the bus
+            stale = shared_memory.SharedMemory(name=self._name)
+            stale.unlink()
+            stale.close()
+            shm = shared_memory.SharedMemory(name=self._name, create=True, size=size)
+        _created.add(self._name)
+        header = np.ndarray((), dtype=_HEADER, buffer=shm.buf)
+        header["capacity"] = self._capacity
+        header["ndim"] = len(shape)
+        header["shape"][: len(shape)] = shape
+        header["dtype"] = dtype.str.encode()
+        header["written"] = written
+        header["generation"] = generation
+        header["retired"] = 0
+        header["cursors"] = -1
+        del header
+        self._segment = _Segment(shm)
+        self._segment.slot_seq[:] = -1
+
+    def publish(self, frame: np.ndarray) -> int:
+        """Copy a frame into the ring.
+
+        Sequence numbers carry on across segment generations.
+
+        Returns:
+            int: Sequence number of the published frame.
+        """
+        if self._segment is None:
+            self._create(frame.shape, frame.dtype)
+        elif (
+            frame.shape != self._segment.frames.shape[1:]
+            or frame.dtype != self._segment.frames.dtype
+        ):
+            self._replace(frame.shape, frame.dtype)
+
+        segment = self._segment
+        seq = int(segment.header["written"])
+        slot = seq % self._capacity
+        segment.slot_seq[slot] = -1  # readers treat the slot as being written
+        np.copyto(segment.frames[slot], frame)
+        segment.slot_seq[slot] = seq
+        segment.header["written"] = seq + 1
+        return seq
+
+    def _replace(self, shape: Tuple[int, ...], dtype: np.dtype) -> None:
+        """Create the next generation's segment and retire the current one."""
+        _check_dims(shape)
+        old = self._segment
+        old.shm.unlink()
+        # readers find the new segment under the name once the old one retired
+        self._create(
+            shape, dtype, int(old.header["written"]), int(old.header["generation"]) + 1
+        )
+        old.header["retired"] = 1
+        old.close()
+
+    def lag(self) -> int:
+        """Number of frames the slowest attached reader is behind."""
+        if self._segment is None:
+            return 0
+
+        cursors = self._segment.header["cursors"]
+        active = cursors[cursors >= 0]
+        if active.size == 0:
+            return 0
+        return int(self._segment.header["written"] - active.min())
+
+    def close(self) -> None:
+        """Close and remove the shared memory segment."""
+        if self._segment is None:
+            return
+
+        shm = self._segment.shm
+        self._segment.close()
+        shm.unlink()
+        _created.discard(self._name)
+        self._segment = None
+
+
+class FrameBusReader:
+    """Read frames published by a :class:`FrameBus` from another process.
+
+    Args:
+        name (str): Name of the shared memory segment.
+        reader_id (int): Index of this reader's cursor, unique per reader.
+        timeout (float): Seconds to wait for the producer to create the
+            segment. Defaults to 10.
+    """
+
+    def __init__(self, name: str, reader_id: int, timeout: float = 10.0) -> None:
+        if not 0 <= reader_id < MAX_READERS:
+            raise ValueError(f"Reader id must be in [0, {MAX_READERS})")
+
+        self._name = name
+        self._reader_id = reader_id
+        self._retired: List[_Segment] = []
+        self._attach(timeout)
+
+    def _attach(self, timeout: float, cursor: Optional[int] = None) -> None:
+        """Map the current segment and start reading at cursor.
+
+        The cursor defaults to the next frame published.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                shm = _open(self._name)
+                break
+            except FileNotFoundError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+        self._segment = _Segment(shm)
+        if cursor is None:
+            cursor = int(self._segment.header["written"])
+        self._cursor = cursor
+        self._segment.header["cursors"][self._reader_id] = self._cursor
+
+    def _follow(self) -> None:
+        """Switch to the segment that replaced the retired one."""
+        # views of the retired frames may still be in use, unmap them on close
+        self._retired.append(self._segment)
+        # sequence numbers of the new segment follow the retired one's
+        self._attach(10.0, int(self._segment.header["written"]))
+
+    @property
+    def cursor(self) -> int:
+        """Sequence number of the next frame this reader will return."""
+        return self._cursor
+
+    @property
+    def generation(self) -> int:
+        """Generation of the segment read, see `FrameBus.generation`."""
+        return int(self._segment.header["generation"])
+
+    def read(
+        self, timeout: Optional[float] = None, poll_interval: float = 0.001
+    ) -> Optional[Tuple[int, np.ndarray]]:
+        """Wait for the next frame and return a zero-copy view of it.
+
+        If the producer lapped this reader, frames are skipped up to the
+        oldest one still in the ring. The view stays valid until the producer
+        wraps around; check :meth:`valid` after using it, or use
+        :meth:`read_copy`. Once the producer changed the frame geometry, the
+        reader moves to the new segment, skipping the frames of the old
+        geometry it did not read yet.
+
+        Returns:
+            Optional[Tuple[int, np.ndarray]]: Sequence number and frame, or
+            None on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._segment.header["retired"]:
+                self._follow()
+            segment = self._segment
+            capacity = segment.frames.shape[0]
+            written = int(segment.header["written"])
+            if written > self._cursor:
+                seq = max(self._cursor, written - capacity + 1)
+                slot = seq % capacity
+                if segment.slot_seq[slot] == seq:
+                    self._cursor = seq + 1
+                    segment.header["cursors"][self._reader_id] = self._cursor
+                    return seq, segment.frames[slot]
+                # the producer is overwriting this slot, move on
+                self._cursor = seq + 1
+                continue
+
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def read_copy(self, timeout: Optional[float] = None) -> Optional[np.ndarray]:
+        """Wait for the next frame that can be copied out intact."""
+        while True:
+            result = self.read(timeout)
+            if result is None:
+                return None
+
+            seq, view = result
+            frame = view.copy()
+            if self.valid(seq):
+                return frame
+
+    def valid(self, seq: int) -> bool:
+        """Whether the frame with sequence number ``seq`` is still in the ring."""
+        return bool(self._segment.slot_seq[seq % self._segment.frames.shape[0]] == seq)
+
+    def close(self) -> None:
+        """Detach from the shared memory segment."""
+        self._segment.header["cursors"][self._reader_id] = -1
+        self._segment.close()
+        for segment in self._retired:
+            segment.close()
+        self._retired = []
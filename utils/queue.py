@@ -1,32 +1,265 @@
 """This module contains an implementation of a queue that fits an online
 container for video clips."""
 import threading
-from typing import Any, List
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Optional, Tuple
+
+import numpy as np
+
+
+class OverflowPolicy(Enum):
+    """What ``put`` does when the consumer has not freed a slot."""
+
+    DROP_OLDEST: str = "drop_oldest"
+    DROP_NEWEST: str = "drop_newest"
+    BLOCK: str = "block"
+    DECIMATE: str = "decimate"
+
+
+@dataclass
+class QueueStats:
+    """Counters describing how well the consumer keeps up with the producer."""
+
+    enqueued: int = 0
+    dropped: int = 0
+    high_water: int = 0
+    lag: int = 0
 
 
 class Queue:
-    """Create a queue object with a given maximum size."""
+    """Create a fixed-capacity ring of frames with a given maximum size.
+
+    All frames live in a single preallocated ``(max_size, H, W, C)`` array.
+    The array is allocated on the first ``put`` unless ``frame_shape`` is
+    given, and reallocated only if the frame geometry changes.
+
+    Without a consumer the ring simply overwrites its oldest frame, which
+    readers of ``get`` never miss. Once ``wait_batch`` has been called, a slot
+    is pending while its consumer still needs it, and when every slot is
+    pending ``policy`` decides what ``put`` does:
+
+    * ``DROP_OLDEST`` overwrites the oldest pending frame (lossy live view).
+    * ``DROP_NEWEST`` discards the incoming frame.
+    * ``BLOCK`` waits up to ``block_timeout`` seconds for a free slot, then
+      discards the incoming frame (lossless recording).
+    * ``DECIMATE`` keeps only every ``decimate_every``-th incoming frame,
+      overwriting the oldest pending one.
+
+    Args:
+        max_size (int): Number of frames kept in the ring.
+        frame_shape (Optional[Tuple[int, ...]]): Shape of a single frame.
+        dtype (np.dtype): Data type of the frames. Defaults to ``np.uint8``.
+        policy (OverflowPolicy): Overflow policy. Defaults to ``DROP_OLDEST``.
+        block_timeout (Optional[float]): Seconds ``BLOCK`` waits, required by
+            ``BLOCK`` so a stalled consumer cannot hang the producer.
+        decimate_every (int): Frames kept by ``DECIMATE``. Defaults to 2.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        frame_shape: Optional[Tuple[int, ...]] = None,
+        dtype: np.dtype = np.uint8,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        block_timeout: Optional[float] = None,
+        decimate_every: int = 2,
+    ) -> None:
+        if decimate_every < 1:
+            raise ValueError("decimate_every must be positive")
+        if policy == OverflowPolicy.BLOCK and block_timeout is None:
+            raise ValueError("BLOCK requires a finite block_timeout")
 
-    def __init__(self, max_size: int) -> None:
-        self._queue = []
         self._max_size = max_size
+        self._dtype = np.dtype(dtype)
+        self._policy = policy
+        self._block_timeout = block_timeout
+        self._decimate_every = decimate_every
+        self._buffer = None
+        self._head = 0  # next slot to write
+        self._size = 0
+        self._written = 0  # sequence number of the next frame
+        self._cursor = 0  # sequence number after the last batch handed out
+        self._retain_from = 0  # oldest sequence number the consumer still needs
+        self._consumed = False  # whether wait_batch retains frames
+        self._overflowed = 0  # incoming frames seen while full, for DECIMATE
+        self._stats = QueueStats()
         self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        if frame_shape is not None:
+            self._allocate(tuple(frame_shape), self._dtype)
+
+    @property
+    def policy(self) -> OverflowPolicy:
+        """Overflow policy of the queue."""
+        return self._policy
+
+    def _allocate(self, frame_shape: Tuple[int, ...], dtype: np.dtype) -> None:
+        self._buffer = np.empty((self._max_size,) + frame_shape, dtype=dtype)
+        self._head = 0
+        self._size = 0
+        self._retain_from = max(self._retain_from, self._written)
+
+    def _pending(self) -> int:
+        """Frames the consumer of ``wait_batch`` still needs."""
+        if not self._consumed:
+            return 0
+        return max(self._written - self._retain_from, 0)
+
+    def _admit(self) -> bool:
+        """Apply the overflow policy, returns whether to store the frame."""
+        if self._pending() < self._max_size:
+            self._overflowed = 0
+            return True
+
+        if self._policy == OverflowPolicy.DROP_NEWEST:
+            return False
+
+        if self._policy == OverflowPolicy.BLOCK:
+            return self._not_full.wait_for(
+                lambda: self._pending() < self._max_size, self._block_timeout
+            )
+
+        if self._policy == OverflowPolicy.DECIMATE:
+            self._overflowed += 1
+            if self._overflowed % self._decimate_every:
+                return False
 
-    def put(self, item: Any) -> None:
-        """Put an item into the queue."""
+        # the oldest pending frame is about to be overwritten
+        self._stats.dropped += 1
+        self._retain_from += 1
+        return True
+
+    def put(
+        self,
+        item: np.ndarray,
+        transform: Optional[Callable[[np.ndarray, np.ndarray], Any]] = None,
+        shape: Optional[Tuple[int, ...]] = None,
+    ) -> Optional[np.ndarray]:
+        """Copy a frame into the next slot of the ring.
+
+        Args:
+            item (np.ndarray): The frame.
+            transform (Optional[Callable[[np.ndarray, np.ndarray], Any]]):
+                Called as ``transform(item, slot)`` to write the frame into the
+                slot instead of copying it, e.g. a colour conversion. It must
+                preserve the dtype of the frame.
+            shape (Optional[Tuple[int, ...]]): Shape ``transform`` writes,
+                e.g. with a colour axis added by demosaicing. Defaults to the
+                shape of the frame.
+
+        Returns:
+            Optional[np.ndarray]: The slot the frame was written to, or None if
+            the overflow policy discarded it.
+        """
+        with self._lock:
+            if not self._admit():
+                self._stats.dropped += 1
+                return None
+
+            shape = item.shape if shape is None else tuple(shape)
+            if (
+                self._buffer is None
+                or self._buffer.shape[1:] != shape
+                or self._buffer.dtype != item.dtype
+            ):
+                self._allocate(shape, item.dtype)
+
+            slot = self._buffer[self._head]
+            if transform is None:
+                np.copyto(slot, item)
+            else:
+                transform(item, slot)
+            self._head = (self._head + 1) % self._max_size
+            self._size = min(self._size + 1, self._max_size)
+            self._written += 1
+            self._stats.enqueued += 1
+            self._stats.high_water = max(
+                self._stats.high_water, min(self._pending(), self._max_size)
+            )
+            self._not_empty.notify_all()
+            return slot
+
+    def get(self, size: int = -1) -> np.ndarray:
+        """Get the latest ``size`` frames, oldest first.
+
+        The result is a view into the ring whenever the frames are contiguous
+        and a copy when they wrap around its end. Views are overwritten by the
+        producer after ``max_size`` further puts, so copy what you keep.
+        """
+        with self._lock:
+            return self._window(self._size if size == -1 else size)
+
+    def wait_batch(
+        self, size: int, stride: Optional[int] = None, timeout: Optional[float] = None
+    ) -> Optional[np.ndarray]:
+        """Block until a new batch of frames is available and return a copy.
+
+        With ``stride < size`` consecutive batches overlap (sliding window),
+        with ``stride == size`` they do not (tumbling window). A consumer that
+        falls more than the ring capacity behind gets the latest window.
+
+        Args:
+            size (int): Number of frames in a batch.
+            stride (Optional[int]): New frames between two batches. Defaults to
+                ``size``.
+            timeout (Optional[float]): Seconds to wait. Defaults to forever.
+
+        Returns:
+            Optional[np.ndarray]: The frames oldest first, or None on timeout.
+        """
+        if not 0 < size <= self._max_size:
+            raise ValueError(f"Batch size must be in [1, {self._max_size}]")
+        stride = size if stride is None else stride
+        if stride < 1:
+            raise ValueError("Stride must be positive")
+
+        with self._not_empty:
+            if not self._consumed:
+                # retain the frames from now on, the older ones are gone
+                self._consumed = True
+                self._retain_from = max(self._retain_from, self._written - self._size)
+            target = max(self._cursor + stride, size)
+            ready = self._not_empty.wait_for(
+                lambda: self._written >= target and self._size >= size, timeout
+            )
+            if not ready:
+                return None
+
+            end = target
+            if end - size < self._written - self._size:
+                end = self._written
+            self._cursor = end
+            self._retain_from = max(self._retain_from, end + stride - size)
+            self._not_full.notify_all()
+            return self._window(size, lag=self._written - end).copy()
+
+    def stats(self) -> QueueStats:
+        """Snapshot of the queue counters."""
         with self._lock:
-            self._queue.append(item)
-            if len(self._queue) > self._max_size:
-                del self._queue[0]
+            return QueueStats(
+                enqueued=self._stats.enqueued,
+                dropped=self._stats.dropped,
+                high_water=self._stats.high_water,
+                lag=self._written - self._cursor,
+            )
+
+    def _window(self, size: int, lag: int = 0) -> np.ndarray:
+        size = min(size, self._size - lag)
+        if self._buffer is None or size <= 0:
+            return np.empty((0,), dtype=self._dtype)
+
+        start = (self._head - lag - size) % self._max_size
+        if start + size <= self._max_size:
+            return self._buffer[start : start + size]
 
-    def get(self, size: int = -1) -> List[Any]:
-        """Get an item from the queue."""
-        if size == -1:
-            size = self._max_size
-        return self._queue[-size:]
+        return np.concatenate(
+            (self._buffer[start:], self._buffer[: start + size - self._max_size])
+        )
 
     def __len__(self) -> int:
-        return len(self._queue)
+        return self._size
 
     def full(self) -> bool:
-        return len(self._queue) == self._max_size
+        return self._size == self._max_size